@@ -0,0 +1,98 @@
+"""Compares generating txt2img images one at a time with denoising them in batches.
+
+Builds a tiny randomly initialized Stable Diffusion pipeline (see tiny_models.py)
+on the CPU, so nothing needs to be downloaded, then generates the same prompts and seeds one at
+a time with generate() and in batches with generate_batch(). Reports the time per image for each
+batch size, and the largest pixel difference from the images generated one at a time.
+
+    python benchmarks/batched_generation.py --images 8 --batch_sizes 1 2 4 8 --size 64
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+import torch
+from tiny_models import create_pipeline
+
+from invokeai.backend.generator import Txt2Img
+from invokeai.backend.generator.base import InvokeAIGeneratorBasicParams
+
+
+def run(generator: Txt2Img, prompts: list[str], batch_size: int, args) -> tuple[float, list]:
+    start = time.perf_counter()
+    images = list()
+    for i in range(0, len(prompts), batch_size):
+        outputs = generator.generate_batch(
+            prompts=prompts[i : i + batch_size],
+            seeds=list(range(i, min(i + batch_size, len(prompts)))),
+            steps=args.steps,
+            width=args.size,
+            height=args.size,
+        )
+        images.extend(np.asarray(o.image, dtype=int) for o in outputs)
+    return time.perf_counter() - start, images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--size", type=int, default=64, help="Image width and height")
+    parser.add_argument("--channels", type=int, default=32, help="UNet channels")
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+    torch.set_num_threads(os.cpu_count() or 1)
+    pipeline = create_pipeline(args.channels)
+    model_info = dict(model=pipeline, model_name="tiny", hash="tiny")
+    generator = Txt2Img(model_info, params=InvokeAIGeneratorBasicParams(precision="float32"))
+
+    words = ["banana", "sushi", "apple", "pie", "cat", "dog", "tea", "cake"]
+    prompts = [f"{words[i % len(words)]} {words[(i * 3 + 1) % len(words)]}" for i in range(args.images)]
+
+    # One at a time with generate(), as each invocation is run without batching
+    def generate(i: int) -> np.ndarray:
+        output = next(
+            generator.generate(
+                prompt=prompts[i], seed=i, steps=args.steps, width=args.size, height=args.size
+            )
+        )
+        return np.asarray(output.image, dtype=int)
+
+    generate(0)  # Warm up
+    start = time.perf_counter()
+    sequential = [generate(i) for i in range(len(prompts))]
+    sequential_seconds = time.perf_counter() - start
+
+    results = [
+        dict(
+            batch_size="sequential",
+            ms_per_image=round(sequential_seconds / len(prompts) * 1000, 1),
+        )
+    ]
+    for batch_size in args.batch_sizes:
+        run(generator, prompts[:batch_size], batch_size, args)  # Warm up
+        seconds, images = run(generator, prompts, batch_size, args)
+        results.append(
+            dict(
+                batch_size=batch_size,
+                ms_per_image=round(seconds / len(prompts) * 1000, 1),
+                speedup=round(sequential_seconds / seconds, 2),
+                max_pixel_difference=int(
+                    max(np.abs(a - b).max() for a, b in zip(sequential, images))
+                ),
+            )
+        )
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Compares the event service dispatching events by polling a queue (as it used to) with it
+waking up the event loop when events are emitted.
+
+Reports the CPU used by an idle event loop, and the latency of events (from being emitted on a
+worker thread to being dispatched on the event loop) during a burst of progress events.
+
+    python benchmarks/event_dispatch.py --idle_seconds 2 --events 5000 --rate 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from queue import Empty, Queue
+from typing import Any
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from invokeai.app.api.events import FastAPIEventService
+from invokeai.app.services.events import EventServiceBase
+
+
+class PollingEventService(EventServiceBase):
+    """Dispatches events by polling a queue, as the event service used to"""
+
+    def __init__(self) -> None:
+        self.latencies = list()
+        self.__queue = Queue()
+        self.__stop_event = threading.Event()
+        asyncio.create_task(self.__dispatch_from_queue())
+        super().__init__()
+
+    def stop(self):
+        self.__stop_event.set()
+
+    def dispatch(self, event_name: str, payload: Any) -> None:
+        self.__queue.put(dict(event_name=event_name, payload=payload))
+
+    async def __dispatch_from_queue(self):
+        while not self.__stop_event.is_set():
+            try:
+                event = self.__queue.get(block=False)
+                self.latencies.append(time.perf_counter() - event["payload"]["data"]["step"])
+            except Empty:
+                await asyncio.sleep(0.001)
+
+
+class RecordingEventService(FastAPIEventService):
+    """Records the latency of events instead of dispatching them to handlers"""
+
+    def __init__(self) -> None:
+        self.latencies = list()
+        super().__init__(event_handler_id=0)
+
+    def _dispatch_event(self, event_name: str, payload: Any) -> None:
+        self.latencies.append(time.perf_counter() - payload["data"]["step"])
+
+
+def emit_burst(events: EventServiceBase, count: int, rate: float) -> None:
+    start = time.perf_counter()
+    for i in range(count):
+        # Emitted at the given rate (or as fast as possible if 0)
+        if rate > 0:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        # The emit time is sent as the step, to measure latency. Each event is for a different
+        # session, so none of them are coalesced with the next
+        events.emit_generator_progress(f"session_{i}", "node", None, time.perf_counter(), count)
+
+
+async def run(service_type, args) -> dict:
+    events = service_type()
+
+    # Idle
+    cpu_start = time.process_time()
+    await asyncio.sleep(args.idle_seconds)
+    idle_cpu = (time.process_time() - cpu_start) / args.idle_seconds
+
+    # Burst of progress events from a worker thread, as emitted while generating
+    start = time.perf_counter()
+    thread = threading.Thread(target=emit_burst, args=(events, args.events, args.rate))
+    thread.start()
+    while len(events.latencies) < args.events:
+        await asyncio.sleep(0.01)
+    seconds = time.perf_counter() - start
+    thread.join()
+    events.stop()
+
+    latencies = sorted(events.latencies)
+    return dict(
+        service=service_type.__name__,
+        rate=args.rate,
+        idle_cpu_percent=round(idle_cpu * 100, 2),
+        burst_events_per_second=round(args.events / seconds),
+        latency_p50_ms=round(statistics.median(latencies) * 1000, 3),
+        latency_p99_ms=round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--idle_seconds", type=float, default=2.0)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=2000, help="Events per second (0 for as fast as possible)")
+    args = parser.parse_args()
+
+    results = [
+        asyncio.run(run(service_type, args))
+        for service_type in [PollingEventService, RecordingEventService]
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
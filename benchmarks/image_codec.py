@@ -0,0 +1,68 @@
+"""Compares image codecs: time to encode and write an image, time to read and decode it, and the
+size of the file.
+
+    python benchmarks/image_codec.py --size 512 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+from PIL import Image
+
+from invokeai.app.services.image_codec import IMAGE_CODEC_NAMES, get_image_codec, read_image
+
+
+def create_image(size: int, seed: int = 0) -> Image.Image:
+    """A smooth random RGB image, which compresses more like a generated image than noise does"""
+    pixels = np.random.RandomState(seed).randint(0, 256, (8, 8, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((size, size), Image.BILINEAR)
+
+
+def timed(f, repeat: int) -> float:
+    """The fastest of repeat calls of f, in ms"""
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return round(min(times) * 1000, 3)
+
+
+def run(codec_name: str, image: Image.Image, directory: str, repeat: int) -> dict:
+    codec = get_image_codec(codec_name)
+    path = os.path.join(directory, f"image.{codec_name}")
+
+    def write() -> None:
+        with open(path, "wb") as f:
+            codec.write(image, f)
+
+    write_ms = timed(write, repeat)
+    read_ms = timed(lambda: read_image(path).load(), repeat)
+    return dict(
+        codec=codec_name,
+        write_ms=write_ms,
+        read_ms=read_ms,
+        bytes=os.path.getsize(path),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=512, help="Width and height of the image")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    image = create_image(args.size)
+    with tempfile.TemporaryDirectory() as directory:
+        results = [run(name, image, directory, args.repeat) for name in IMAGE_CODEC_NAMES]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
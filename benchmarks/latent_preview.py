@@ -0,0 +1,83 @@
+"""Compares the time the diffusion thread spends on each progress preview.
+
+Renders and JPEG-encodes previews of random latents as the step callback did before the preview
+renderer (building the latent to RGB factors, rendering and encoding on the calling thread), and
+with LatentPreviewRenderer.render_async(), which finishes them on a worker thread. Reports the
+time per step spent on the calling thread, and how many previews were dropped because earlier
+ones were still being encoded. --step_ms simulates the time each denoising step takes.
+
+    python benchmarks/latent_preview.py --sizes 512 1024 --steps 100 --step_ms 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import torch
+from PIL import Image
+
+from invokeai.backend.stable_diffusion.latent_preview import (
+    V1_5_LATENT_RGB_FACTORS,
+    LatentPreviewRenderer,
+)
+from invokeai.backend.util.util import encode_progress_frame
+
+
+def render_sync(samples: torch.Tensor) -> bytes:
+    """How previews were rendered before the renderer"""
+    factors = torch.tensor(V1_5_LATENT_RGB_FACTORS, dtype=samples.dtype, device=samples.device)
+    latent_image = samples[0].permute(1, 2, 0) @ factors
+    latents_ubyte = ((latent_image + 1) / 2).clamp(0, 1).mul(0xFF).byte().cpu()
+    return encode_progress_frame(Image.fromarray(latents_ubyte.numpy()), "jpeg")
+
+
+def run(size: int, mode: str, args) -> dict:
+    torch.manual_seed(0)
+    device = torch.device(args.device)
+    samples = [torch.randn((1, 4, size // 8, size // 8), device=device) for _ in range(args.steps)]
+    renderer = LatentPreviewRenderer()
+    encoded = list()
+
+    def callback(step: int):
+        if mode == "sync":
+            encoded.append(render_sync(samples[step]))
+        else:
+            renderer.render_async(
+                samples[step],
+                lambda image: encoded.append(encode_progress_frame(image, "jpeg")),
+                block=step == args.steps - 1,
+            )
+
+    callback_seconds = 0.0
+    for step in range(args.steps):
+        time.sleep(args.step_ms / 1000)  # Denoising
+        start = time.perf_counter()
+        callback(step)
+        callback_seconds += time.perf_counter() - start
+    renderer.shutdown()
+
+    return dict(
+        size=size,
+        mode=mode,
+        callback_ms_per_step=round(callback_seconds / args.steps * 1000, 3),
+        dropped=args.steps - len(encoded),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024], help="Image sizes")
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--step_ms", type=float, default=20.0)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    results = [run(size, mode, args) for size in args.sizes for mode in ["sync", "async"]]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
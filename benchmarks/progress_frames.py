@@ -0,0 +1,94 @@
+"""Compares sending progress images as base64 dataURLs with sending them as binary frames.
+
+Renders latent previews of random latents, as fast_latents_step_callback does, then encodes the
+generator_progress event as a Socket.IO packet, either with a JPEG dataURL (what older clients
+get) or with the frame's bytes as a binary attachment. Reports the bytes sent and the CPU time
+(rendering the preview, encoding it and encoding the packet) per frame.
+
+    python benchmarks/progress_frames.py --sizes 512 1024 --frames 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import torch
+from socketio import packet
+
+from invokeai.backend.generator.base import Generator
+from invokeai.backend.util.util import (
+    PROGRESS_FRAME_FORMATS,
+    encode_progress_frame,
+    image_to_dataURL,
+)
+
+
+def progress_event(progress_image: dict) -> list:
+    return [
+        "generator_progress",
+        dict(
+            graph_execution_state_id="00000000-0000-0000-0000-000000000000",
+            invocation_id="1",
+            progress_image=progress_image,
+            step=1,
+            total_steps=50,
+        ),
+    ]
+
+
+def encode(sample: torch.Tensor, frame_format: str) -> list:
+    """Encodes the progress of a step into the strings and bytes sent over the socket"""
+    image = Generator.sample_to_lowres_estimated_image(sample)
+    (width, height) = (image.width * 8, image.height * 8)
+    if frame_format == "dataURL":
+        progress_image = dict(
+            width=width, height=height, dataURL=image_to_dataURL(image, image_format="JPEG")
+        )
+    else:
+        progress_image = dict(
+            width=width,
+            height=height,
+            format=frame_format,
+            data=encode_progress_frame(image, frame_format),
+        )
+
+    encoded = packet.Packet(packet.EVENT, data=progress_event(progress_image)).encode()
+    return encoded if isinstance(encoded, list) else [encoded]
+
+
+def run(size: int, frame_format: str, frames: int) -> dict:
+    torch.manual_seed(0)
+    samples = [torch.randn((1, 4, size // 8, size // 8)) for _ in range(frames)]
+    encode(samples[0], frame_format)  # Warm up
+
+    start = time.process_time()
+    sent = [encode(sample, frame_format) for sample in samples]
+    cpu_seconds = time.process_time() - start
+
+    return dict(
+        size=size,
+        format=frame_format,
+        bytes_per_frame=round(sum(len(p) for s in sent for p in s) / frames),
+        cpu_ms_per_frame=round(cpu_seconds / frames * 1000, 3),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024], help="Image sizes")
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    results = [
+        run(size, frame_format, args.frames)
+        for size in args.sizes
+        for frame_format in ["dataURL"] + PROGRESS_FRAME_FORMATS
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Compares session storage codecs: time to save and load a session, time to list sessions in
+full and by their status fields only, and the size of the stored sessions.
+
+    python benchmarks/session_codec.py --size 100 --sessions 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from session_storage import create_graph
+
+from invokeai.app.services.graph import GraphExecutionState
+from invokeai.app.services.graph_execution_storage import SESSION_STATUS_FIELDS
+from invokeai.app.services.item_codec import ITEM_CODEC_NAMES, get_item_codec
+from invokeai.app.services.sqlite import SqliteItemStorage, sqlite_memory
+
+
+def create_state(size: int) -> GraphExecutionState:
+    state = GraphExecutionState(graph=create_graph(size))
+    while True:
+        invocation = state.next()
+        if invocation is None:
+            break
+        state.complete(invocation.id, invocation.invoke(None))
+    return state
+
+
+def timed(f, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    return round((time.perf_counter() - start) / repeat * 1000, 2)
+
+
+def run(codec_name: str, states: list[GraphExecutionState], repeat: int) -> dict:
+    storage = SqliteItemStorage[GraphExecutionState](
+        sqlite_memory,
+        "graph_executions",
+        codec=get_item_codec(codec_name),
+        status_fields=SESSION_STATUS_FIELDS,
+    )
+    for state in states:
+        storage.set(state)
+
+    storage._cursor.execute(
+        "SELECT sum(length(item)) + coalesce(sum(length(data)), 0) FROM graph_executions;"
+    )
+    stored_bytes = storage._cursor.fetchone()[0]
+
+    return dict(
+        codec=codec_name,
+        set_ms=timed(lambda: storage.set(states[0]), repeat),
+        get_ms=timed(lambda: storage.get(states[0].id), repeat),
+        list_ms=timed(lambda: storage.list(per_page=len(states)), max(1, repeat // 10)),
+        list_status_ms=timed(lambda: storage.list_status(per_page=len(states)), repeat),
+        stored_bytes=stored_bytes,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100, help="Iterations per session")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    state = create_state(args.size)
+    states = [state.copy(deep=True, update=dict(id=str(i))) for i in range(args.sessions)]
+
+    results = list()
+    for codec_name in ITEM_CODEC_NAMES:
+        try:
+            get_item_codec(codec_name)
+        except ValueError:
+            continue  # msgpack isn't installed
+        results.append(run(codec_name, states, args.repeat))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
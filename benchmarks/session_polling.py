@@ -0,0 +1,104 @@
+"""Load test for session polling while the processor is writing sessions.
+
+Reader threads poll a session with get() (like clients polling /api/v1/sessions/{id}) while a
+writer thread saves sessions as fast as it can (like the processor completing nodes). Reports
+reads and writes per second for a few SQLite configurations.
+
+    python benchmarks/session_polling.py --readers 4 --seconds 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from invokeai.app.invocations.image import ShowImageInvocation
+from invokeai.app.services.graph import Graph, GraphExecutionState
+from invokeai.app.services.sqlite import SqliteItemStorage
+
+
+class SingleConnectionStorage(SqliteItemStorage[GraphExecutionState]):
+    """Reads on the write connection behind the write lock, as the storage used to"""
+
+    @contextmanager
+    def _reading(self):
+        with self._lock:
+            yield self._cursor
+
+
+def create_state(nodes: int) -> GraphExecutionState:
+    graph = Graph()
+    for i in range(nodes):
+        graph.add_node(ShowImageInvocation(id=str(i)))
+    return GraphExecutionState(graph=graph)
+
+
+def run(storage: SqliteItemStorage, readers: int, seconds: float, nodes: int) -> dict:
+    polled = create_state(nodes)
+    written = [create_state(nodes) for _ in range(8)]
+    storage.set(polled)
+
+    stop = Event()
+    reads = [0] * readers
+    writes = 0
+
+    def read(i: int):
+        while not stop.is_set():
+            storage.get(polled.id)
+            reads[i] += 1
+
+    def write():
+        nonlocal writes
+        while not stop.is_set():
+            storage.set(written[writes % len(written)])
+            writes += 1
+
+    threads = [Thread(target=read, args=(i,)) for i in range(readers)] + [
+        Thread(target=write)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return dict(
+        reads_per_second=round(sum(reads) / seconds),
+        writes_per_second=round(writes / seconds),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--nodes", type=int, default=50, help="Nodes per session")
+    args = parser.parse_args()
+
+    configurations = dict(
+        single_connection=lambda f: SingleConnectionStorage(
+            f, "graph_executions", pragmas=dict(journal_mode="delete", synchronous="full")
+        ),
+        rollback_journal=lambda f: SqliteItemStorage[GraphExecutionState](
+            f, "graph_executions", pragmas=dict(journal_mode="delete", synchronous="full")
+        ),
+        wal=lambda f: SqliteItemStorage[GraphExecutionState](f, "graph_executions"),
+    )
+
+    results = dict()
+    for name, create_storage in configurations.items():
+        with tempfile.TemporaryDirectory() as directory:
+            storage = create_storage(os.path.join(directory, "invokeai.db"))
+            results[name] = run(storage, args.readers, args.seconds, args.nodes)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Compares the bytes written to store a session with the full-state and delta session storages.
+
+Runs an iterated graph (collection -> iterate -> prompt -> collect) the way the processor does,
+loading and saving the session around every node, and counts the bytes passed to SQLite.
+
+    python benchmarks/session_storage.py --sizes 25 50 100 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Literal
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pydantic import Field
+
+from invokeai.app.invocations.baseinvocation import (
+    BaseInvocation,
+    BaseInvocationOutput,
+    InvocationContext,
+)
+
+
+# Invocations must be defined before the graph is imported
+class BenchmarkCollectionOutput(BaseInvocationOutput):
+    type: Literal["benchmark_collection_output"] = "benchmark_collection_output"
+
+    collection: list[str] = Field(default_factory=list)
+
+
+class BenchmarkCollectionInvocation(BaseInvocation):
+    type: Literal["benchmark_collection"] = "benchmark_collection"
+
+    size: int = Field(default=10)
+
+    def invoke(self, context: InvocationContext) -> BenchmarkCollectionOutput:
+        return BenchmarkCollectionOutput(
+            collection=[f"a photo of banana sushi #{i}" for i in range(self.size)]
+        )
+
+
+from invokeai.app.invocations.prompt import PromptOutput
+
+
+class BenchmarkPromptInvocation(BaseInvocation):
+    type: Literal["benchmark_prompt"] = "benchmark_prompt"
+
+    prompt: str = Field(default="")
+
+    def invoke(self, context: InvocationContext) -> PromptOutput:
+        return PromptOutput(prompt=self.prompt)
+
+
+from invokeai.app.services.graph import (
+    CollectInvocation,
+    Edge,
+    EdgeConnection,
+    Graph,
+    GraphExecutionState,
+    IterateInvocation,
+)
+from invokeai.app.services.graph_execution_storage import SqliteGraphExecutionStorage
+from invokeai.app.services.sqlite import SqliteItemStorage, sqlite_memory
+
+
+class CountingCursor:
+    """Wraps a cursor to count the bytes of the text parameters passed to it"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.bytes_written = 0
+
+    def execute(self, sql, parameters=()):
+        self.bytes_written += sum(len(p) for p in parameters if isinstance(p, str))
+        return self.cursor.execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        self.bytes_written += sum(
+            len(p) for ps in seq_of_parameters for p in ps if isinstance(p, str)
+        )
+        return self.cursor.executemany(sql, seq_of_parameters)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def create_graph(size: int) -> Graph:
+    def edge(from_id: str, from_field: str, to_id: str, to_field: str) -> Edge:
+        return Edge(
+            source=EdgeConnection(node_id=from_id, field=from_field),
+            destination=EdgeConnection(node_id=to_id, field=to_field),
+        )
+
+    g = Graph()
+    g.add_node(BenchmarkCollectionInvocation(id="collection", size=size))
+    g.add_node(IterateInvocation(id="iterate"))
+    g.add_node(BenchmarkPromptInvocation(id="prompt"))
+    g.add_node(CollectInvocation(id="collect"))
+    g.add_edge(edge("collection", "collection", "iterate", "collection"))
+    g.add_edge(edge("iterate", "item", "prompt", "prompt"))
+    g.add_edge(edge("prompt", "prompt", "collect", "item"))
+    return g
+
+
+def run_session(storage, size: int) -> dict:
+    cursor = CountingCursor(storage._cursor)
+    storage._cursor = cursor
+
+    start = time.perf_counter()
+    state = GraphExecutionState(graph=create_graph(size))
+    storage.set(state)
+    while True:
+        state = storage.get(state.id)
+        invocation = state.next()
+        if invocation is None:
+            break
+        storage.set(state)
+
+        outputs = invocation.invoke(None)
+        state = storage.get(state.id)
+        state.complete(invocation.id, outputs)
+        storage.set(state)
+
+    assert state.is_complete()
+    return dict(
+        storage=type(storage).__name__,
+        size=size,
+        nodes=len(state.execution_graph.nodes),
+        bytes_written=cursor.bytes_written,
+        seconds=round(time.perf_counter() - start, 3),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[25, 50, 100])
+    args = parser.parse_args()
+
+    results = list()
+    for size in args.sizes:
+        full = run_session(
+            SqliteItemStorage[GraphExecutionState](sqlite_memory, "graph_executions"), size
+        )
+        delta = run_session(SqliteGraphExecutionStorage(sqlite_memory, "graph_executions"), size)
+        delta["reduction"] = round(full["bytes_written"] / delta["bytes_written"], 1)
+        results.extend([full, delta])
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
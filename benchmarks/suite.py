@@ -0,0 +1,389 @@
+"""Runs the benchmark suite and saves the results as JSON, to track performance from commit to commit.
+
+The generation benchmarks (txt2img, img2img, inpaint and embiggen) use a tiny randomly initialized
+pipeline (see tiny_models.py) on the CPU, so nothing needs to be downloaded and results only depend
+on the code and the machine. The others measure the nodes API services: graph scheduling, SQLite
+session storage, image storage, image codecs and event dispatch. Times are the best of --repeat
+runs, in ms.
+
+Results are saved to benchmarks/results/{commit}.json by default. With --compare, the change of
+each metric from an earlier result file is printed too.
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --only txt2img image_storage --compare benchmarks/results/2491b90.json
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from typing import Any, Callable
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+import torch
+from event_dispatch import RecordingEventService, emit_burst
+from image_codec import run as run_image_codec
+from PIL import Image
+from session_codec import create_state
+from session_storage import create_graph
+from tiny_models import create_pipeline
+
+from invokeai.app.services.graph import GraphExecutionState
+from invokeai.app.services.image_codec import IMAGE_CODEC_NAMES
+from invokeai.app.services.image_storage import DiskImageStorage, ImageType
+from invokeai.app.services.sqlite import SqliteItemStorage
+from invokeai.backend.generator.base import (
+    Embiggen,
+    Img2Img,
+    Inpaint,
+    InvokeAIGeneratorBasicParams,
+    Txt2Img,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def best_ms(f: Callable[[], Any], repeat: int) -> float:
+    """The fastest of repeat calls of f, in ms"""
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return round(min(times) * 1000, 3)
+
+
+def create_image(size: int, seed: int) -> Image.Image:
+    """A smooth random RGB image, which compresses more like a generated image than noise does"""
+    pixels = np.random.RandomState(seed).randint(0, 256, (8, 8, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((size, size), Image.BILINEAR)
+
+
+# Generation
+
+
+def generate(generator_type, pipeline, args, **kwargs) -> dict:
+    model_info = dict(model=pipeline, model_name="tiny", hash="tiny")
+    params = InvokeAIGeneratorBasicParams(
+        precision="float32", width=args.size, height=args.size, steps=args.steps
+    )
+
+    def generate_image() -> Image.Image:
+        generator = generator_type(model_info, params=params)
+        return next(generator.generate(prompt="banana sushi", seed=1, **kwargs)).image
+
+    image = generate_image()  # Warm up, and check the output
+    return dict(
+        ms_per_image=best_ms(generate_image, args.repeat),
+        image_size=list(image.size),
+        image_md5=hashlib.md5(image.tobytes()).hexdigest(),
+    )
+
+
+def txt2img(args) -> dict:
+    return generate(Txt2Img, create_pipeline(args.channels), args)
+
+
+def img2img(args) -> dict:
+    return generate(
+        Img2Img,
+        create_pipeline(args.channels),
+        args,
+        init_image=create_image(args.size, 0),
+        strength=0.75,
+    )
+
+
+def inpaint(args) -> dict:
+    mask = Image.new("L", (args.size, args.size), 0)
+    mask.paste(255, (args.size // 4, args.size // 4, args.size * 3 // 4, args.size * 3 // 4))
+    return generate(
+        Inpaint,
+        create_pipeline(args.channels),
+        args,
+        init_image=create_image(args.size, 0).convert("RGBA"),
+        mask_image=mask,
+        strength=0.75,
+        infill_method="tile",  # patchmatch may not be installed
+    )
+
+
+def embiggen(args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        init_img = os.path.join(directory, "init.png")
+        create_image(args.size, 0).save(init_img)
+        # Scaled up 2x with a plain resize (an upscaling strength of 0 skips ESRGAN), then each
+        # tile is refined with img2img
+        return generate(
+            Embiggen,
+            create_pipeline(args.channels),
+            args,
+            init_img=init_img,
+            embiggen=[2.0, 0.0],
+            embiggen_tiles=None,
+            strength=0.4,
+        )
+
+
+# Services
+
+
+def graph_scheduling(args) -> dict:
+    """Runs an iterated graph to completion in memory, without invoking anything expensive"""
+
+    def run() -> None:
+        state = GraphExecutionState(graph=create_graph(args.graph_size))
+        while True:
+            invocation = state.next()
+            if invocation is None:
+                break
+            state.complete(invocation.id, invocation.invoke(None))
+
+    ms = best_ms(run, args.repeat)
+    nodes = len(create_state(args.graph_size).execution_graph.nodes)
+    return dict(nodes=nodes, ms_per_session=ms, nodes_per_second=round(nodes / ms * 1000))
+
+
+def sqlite_storage(args) -> dict:
+    state = create_state(args.graph_size)
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SqliteItemStorage[GraphExecutionState](
+            filename=os.path.join(directory, "benchmark.db"), table_name="graph_executions"
+        )
+        count = 20
+
+        def set_sessions() -> None:
+            for i in range(count):
+                state.id = str(i)
+                storage.set(state)
+
+        def get_sessions() -> None:
+            for i in range(count):
+                storage.get(str(i))
+
+        return dict(
+            session_nodes=len(state.execution_graph.nodes),
+            set_ms=round(best_ms(set_sessions, args.repeat) / count, 3),
+            get_ms=round(best_ms(get_sessions, args.repeat) / count, 3),
+            list_ms=best_ms(lambda: storage.list(per_page=count), args.repeat),
+        )
+
+
+def image_storage(args) -> dict:
+    images = [create_image(args.image_size, i) for i in range(args.images)]
+    with tempfile.TemporaryDirectory() as directory:
+        storage = DiskImageStorage(directory)
+
+        def save_images(storage: DiskImageStorage) -> None:
+            for i, image in enumerate(images):
+                storage.save(ImageType.RESULT, f"{i}.png", image)
+
+        def get_images(storage: DiskImageStorage) -> None:
+            for i in range(len(images)):
+                # Decoded, as they would be when used
+                storage.get(ImageType.RESULT, f"{i}.png").load()
+
+        save_ms = best_ms(lambda: save_images(storage), args.repeat)
+
+        # With background writes, the time invocations wait for, then the time until all are written
+        background = DiskImageStorage(directory, write_workers=2)
+        save_background_ms = flush_ms = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            save_images(background)
+            saved = time.perf_counter()
+            background.flush()
+            save_background_ms = min(save_background_ms, (saved - start) * 1000)
+            flush_ms = min(flush_ms, (time.perf_counter() - saved) * 1000)
+        background.stop()
+
+        # The same image, as when an image is used by several nodes
+        get_same_ms = best_ms(lambda: storage.get(ImageType.RESULT, "0.png").load(), args.repeat)
+
+        # Each image, with the cache warmed up
+        get_images(storage)
+        get_warm_ms = best_ms(lambda: get_images(storage), args.repeat)
+
+        # Each image, from disk
+        get_cold_ms = best_ms(lambda: get_images(DiskImageStorage(directory)), args.repeat)
+
+        # Intermediates saved by a node and used by the next, written or kept in memory
+        def pass_intermediates(storage: DiskImageStorage) -> None:
+            for i, image in enumerate(images):
+                storage.save(ImageType.INTERMEDIATE, f"{i}.png", image)
+                storage.get(ImageType.INTERMEDIATE, f"{i}.png").load()
+
+        intermediate_ms = best_ms(lambda: pass_intermediates(storage), args.repeat)
+        in_memory = DiskImageStorage(directory, intermediate_bytes=2**30)
+        intermediate_memory_ms = best_ms(lambda: pass_intermediates(in_memory), args.repeat)
+
+        return dict(
+            images=len(images),
+            image_size=args.image_size,
+            save_ms=round(save_ms / len(images), 3),
+            save_background_ms=round(save_background_ms / len(images), 3),
+            save_background_flush_ms=round(flush_ms, 3),
+            get_same_ms=get_same_ms,
+            get_warm_ms=round(get_warm_ms / len(images), 3),
+            get_cold_ms=round(get_cold_ms / len(images), 3),
+            intermediate_ms=round(intermediate_ms / len(images), 3),
+            intermediate_memory_ms=round(intermediate_memory_ms / len(images), 3),
+        )
+
+
+def image_codecs(args) -> dict:
+    """Writes and reads an image with each codec"""
+    image = create_image(args.image_size, 0)
+    metrics = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        for name in IMAGE_CODEC_NAMES:
+            result = run_image_codec(name, image, directory, args.repeat)
+            for metric in ("write_ms", "read_ms", "bytes"):
+                metrics[f"{name}_{metric}"] = result[metric]
+    return metrics
+
+
+def event_dispatch(args) -> dict:
+    """Emits progress events from a worker thread as fast as possible, and measures how quickly
+    they are dispatched on the event loop"""
+
+    async def run() -> tuple[float, list[float]]:
+        events = RecordingEventService()
+        start = time.perf_counter()
+        thread = threading.Thread(target=emit_burst, args=(events, args.events, 0))
+        thread.start()
+        while len(events.latencies) < args.events:
+            await asyncio.sleep(0.001)
+        seconds = time.perf_counter() - start
+        thread.join()
+        events.stop()
+        return seconds, sorted(events.latencies)
+
+    runs = [asyncio.run(run()) for _ in range(args.repeat)]
+    (seconds, latencies) = min(runs, key=lambda r: r[0])
+    return dict(
+        events=args.events,
+        events_per_second=round(args.events / seconds),
+        latency_p50_ms=round(statistics.median(latencies) * 1000, 3),
+        latency_p99_ms=round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+    )
+
+
+BENCHMARKS = dict(
+    txt2img=txt2img,
+    img2img=img2img,
+    inpaint=inpaint,
+    embiggen=embiggen,
+    graph_scheduling=graph_scheduling,
+    sqlite_storage=sqlite_storage,
+    image_storage=image_storage,
+    image_codecs=image_codecs,
+    event_dispatch=event_dispatch,
+)
+
+
+def get_commit() -> tuple[str, bool]:
+    """The short hash of the checked out commit, and whether there are uncommitted changes"""
+
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    try:
+        return (git("rev-parse", "--short", "HEAD") or "unknown", git("status", "--porcelain") != "")
+    except OSError:
+        return ("unknown", False)
+
+
+def compare(baseline: dict, results: dict) -> list[dict]:
+    """The change of each numeric metric from the baseline"""
+    changes = list()
+    for name, metrics in results["benchmarks"].items():
+        baseline_metrics = baseline.get("benchmarks", dict()).get(name, dict())
+        for metric, value in metrics.items():
+            before = baseline_metrics.get(metric)
+            if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before != 0:
+                changes.append(
+                    dict(
+                        benchmark=name,
+                        metric=metric,
+                        baseline=before,
+                        value=value,
+                        change_percent=round((value - before) / before * 100, 1),
+                    )
+                )
+            elif before is not None and value != before:
+                changes.append(dict(benchmark=name, metric=metric, baseline=before, value=value))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Benchmarks to run (all by default)")
+    parser.add_argument("--output", help="Results file [benchmarks/results/{commit}.json]")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=1, help="Torch CPU threads")
+    parser.add_argument("--size", type=int, default=64, help="Width and height of generated images")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--channels", type=int, default=32, help="UNet channels")
+    parser.add_argument("--graph_size", type=int, default=100, help="Iterations of the benchmark graph")
+    parser.add_argument("--images", type=int, default=20, help="Images saved and loaded by the image storage")
+    parser.add_argument("--image_size", type=int, default=512, help="Width and height of stored images")
+    parser.add_argument("--events", type=int, default=5000)
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+    torch.set_num_threads(args.threads)
+    (commit, dirty) = get_commit()
+
+    benchmarks = dict()
+    for name in args.only or BENCHMARKS:
+        print(f"Running {name}...", file=sys.stderr)
+        benchmarks[name] = BENCHMARKS[name](args)
+
+    results = dict(
+        commit=commit,
+        dirty=dirty,
+        date=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        environment=dict(
+            python=platform.python_version(),
+            torch=torch.__version__,
+            platform=platform.platform(),
+            processor=platform.processor(),
+            cpu_count=os.cpu_count(),
+        ),
+        settings={k: v for k, v in vars(args).items() if k not in ("only", "output", "compare")},
+        benchmarks=benchmarks,
+    )
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved the results to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(json.dumps(compare(json.load(f), results), indent=2))
+    else:
+        print(json.dumps(benchmarks, indent=2))
+
+
+if __name__ == "__main__":
+    main()
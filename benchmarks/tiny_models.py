@@ -0,0 +1,84 @@
+"""Tiny randomly initialized Stable Diffusion pipelines for benchmarks.
+
+The UNet, VAE and CLIP text encoder have the architecture of SD 1.x models (the VAE downsamples
+by 8, the UNet has cross-attention blocks), scaled down so they run quickly on the CPU and need
+nothing to be downloaded. The weights are seeded, so the images generated only depend on the code.
+"""
+import json
+import os
+import tempfile
+
+import torch
+from diffusers import AutoencoderKL, DDIMScheduler, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+from invokeai.backend.stable_diffusion import StableDiffusionGeneratorPipeline
+
+
+def create_tokenizer(directory: str) -> CLIPTokenizer:
+    """A tokenizer with a vocabulary of single letters"""
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for c in "abcdefghijklmnopqrstuvwxyz":
+        vocab[c] = len(vocab)
+        vocab[f"{c}</w>"] = len(vocab)
+
+    vocab_file = os.path.join(directory, "vocab.json")
+    merges_file = os.path.join(directory, "merges.txt")
+    with open(vocab_file, "w") as f:
+        json.dump(vocab, f)
+    with open(merges_file, "w") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(
+        vocab_file, merges_file, model_max_length=77, pad_token="<|endoftext|>"
+    )
+
+
+def create_pipeline(channels: int = 32) -> StableDiffusionGeneratorPipeline:
+    """A pipeline whose UNet has the given number of channels in its first block"""
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        sample_size=8,
+        in_channels=4,
+        out_channels=4,
+        layers_per_block=1,
+        block_out_channels=(channels, channels * 2),
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+        cross_attention_dim=32,
+        attention_head_dim=4,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=(8, 16, 32, 32),
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D",) * 4,
+        up_block_types=("UpDecoderBlock2D",) * 4,
+        latent_channels=4,
+        norm_num_groups=8,
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        tokenizer = create_tokenizer(directory)
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            vocab_size=len(tokenizer.get_vocab()),
+            hidden_size=32,
+            intermediate_size=37,
+            num_attention_heads=4,
+            num_hidden_layers=2,
+            max_position_embeddings=77,
+            bos_token_id=0,
+            eos_token_id=1,
+            pad_token_id=1,
+        )
+    )
+    pipeline = StableDiffusionGeneratorPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=unet,
+        scheduler=DDIMScheduler(clip_sample=False, steps_offset=1),
+        safety_checker=None,
+        feature_extractor=None,
+    )
+    pipeline.set_progress_bar_config(disable=True)
+    return pipeline
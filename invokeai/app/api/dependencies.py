@@ -2,13 +2,26 @@
 
 import os
 from argparse import Namespace
+from typing import Callable, Optional
 
 from ...backend import Globals
+from ..services import metrics
 from ..services.model_manager_initializer import get_model_manager
 from ..services.restoration_services import RestorationServices
+from ..services.buffered_item_storage import BufferedItemStorage
 from ..services.graph import GraphExecutionState
-from ..services.image_storage import DiskImageStorage
-from ..services.invocation_queue import MemoryInvocationQueue
+from ..services.graph_execution_storage import (
+    SESSION_STATUS_FIELDS,
+    SqliteGraphExecutionStorage,
+)
+from ..services.image_storage import DiskImageStorage, ImageType
+from ..services.invocation_cache import MemoryInvocationCache
+from ..services.item_codec import get_item_codec
+from ..services.invocation_queue import (
+    FairInvocationQueue,
+    MemoryInvocationQueue,
+    SqliteInvocationQueue,
+)
 from ..services.invocation_services import InvocationServices
 from ..services.invoker import Invoker
 from ..services.processor import DefaultInvocationProcessor
@@ -38,7 +51,11 @@ class ApiDependencies:
     invoker: Invoker = None
 
     @staticmethod
-    def initialize(config, event_handler_id: int):
+    def initialize(
+        config,
+        event_handler_id: int,
+        has_subscribers: Optional[Callable[[str], bool]] = None,
+    ):
         Globals.try_patchmatch = config.patchmatch
         Globals.always_use_cpu = config.always_use_cpu
         Globals.internet_available = config.internet_available and check_internet()
@@ -48,29 +65,86 @@ class ApiDependencies:
         # TODO: Use a logger
         print(f">> Internet connectivity is {Globals.internet_available}")
 
-        events = FastAPIEventService(event_handler_id)
+        events = FastAPIEventService(
+            event_handler_id,
+            progress_max_fps=config.progress_max_fps,
+            progress_frame_format=config.progress_frame_format,
+            has_subscribers=has_subscribers,
+        )
 
         output_folder = os.path.abspath(
             os.path.join(os.path.dirname(__file__), "../../../../outputs")
         )
 
-        images = DiskImageStorage(output_folder)
+        images = DiskImageStorage(
+            output_folder,
+            cache_bytes=config.image_cache_mb * 2**20,
+            write_workers=config.image_write_workers,
+            codecs={
+                ImageType.RESULT: config.result_image_codec,
+                ImageType.INTERMEDIATE: config.intermediate_image_codec,
+            },
+            intermediate_bytes=config.intermediate_memory_mb * 2**20,
+        )
 
         # TODO: build a file/path manager?
         db_location = os.path.join(output_folder, "invokeai.db")
+        pragmas = dict(p.split("=", 1) for p in config.sqlite_pragma)
+        session_storage_options = dict(
+            filename=db_location,
+            table_name="graph_executions",
+            pragmas=pragmas,
+            codec=get_item_codec(config.session_codec),
+            status_fields=SESSION_STATUS_FIELDS,
+        )
+        graph_execution_manager = (
+            SqliteGraphExecutionStorage(**session_storage_options)
+            if config.session_storage == "delta"
+            else SqliteItemStorage[GraphExecutionState](**session_storage_options)
+        )
+        if config.session_flush_interval > 0:
+            graph_execution_manager = BufferedItemStorage[GraphExecutionState](
+                graph_execution_manager, flush_interval=config.session_flush_interval
+            )
+        queue = (
+            SqliteInvocationQueue(filename=db_location, pragmas=pragmas)
+            if config.invocation_queue == "sqlite"
+            else FairInvocationQueue()
+            if config.invocation_queue == "fair"
+            else MemoryInvocationQueue()
+        )
 
         services = InvocationServices(
             model_manager=get_model_manager(config),
             events=events,
             images=images,
-            queue=MemoryInvocationQueue(),
-            graph_execution_manager=SqliteItemStorage[GraphExecutionState](
-                filename=db_location, table_name="graph_executions"
+            queue=queue,
+            graph_execution_manager=graph_execution_manager,
+            processor=DefaultInvocationProcessor(
+                cpu_workers=config.cpu_workers,
+                batch_window=config.batch_window,
+                max_batch_size=config.max_batch_size,
+                profile_dir=config.profile_dir,
             ),
-            processor=DefaultInvocationProcessor(),
             restoration=RestorationServices(config),
+            invocation_cache=(
+                MemoryInvocationCache(max_size=config.invocation_cache_size)
+                if config.invocation_cache_size > 0
+                else None
+            ),
         )
 
+        # Metrics that are counted by the services themselves
+        model_manager = services.model_manager
+        metrics.queue_depth.set_function(lambda: queue.get_stats().depth)
+        metrics.model_cache_hits.set_function(lambda: model_manager.cache_hits)
+        metrics.model_cache_misses.set_function(lambda: model_manager.cache_misses)
+        metrics.model_cache_evictions.set_function(lambda: model_manager.cache_evictions)
+        metrics.image_cache_hits.set_function(lambda: images.cache.hits)
+        metrics.image_cache_misses.set_function(lambda: images.cache.misses)
+        metrics.image_cache_evictions.set_function(lambda: images.cache.evictions)
+        metrics.image_cache_bytes.set_function(lambda: images.cache.bytes)
+
         ApiDependencies.invoker = Invoker(services)
 
     @staticmethod
@@ -2,51 +2,121 @@
 
 import asyncio
 import threading
-from queue import Empty, Queue
-from typing import Any
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Optional
 
 from fastapi_events.dispatcher import dispatch
 
+from ..services import metrics
 from ..services.events import EventServiceBase
 
 
 class FastAPIEventService(EventServiceBase):
+    """Dispatches events on the event loop it was created on, from any thread.
+
+    Events are handed to the loop with call_soon_threadsafe, which wakes it up, so nothing runs
+    while there are no events. Events emitted while the loop hasn't yet dispatched earlier ones
+    are dispatched with them, in the order they were emitted, with a single wakeup.
+
+    Progress events are coalesced: while a session's progress event is waiting to be dispatched,
+    newer progress for that session replaces it, so only the latest progress is sent.
+    """
+
     event_handler_id: int
-    __queue: Queue
-    __stop_event: threading.Event
+    __loop: asyncio.AbstractEventLoop
+    __pending: deque[list]
+    __pending_progress: dict[str, list]
+    __lock: threading.Lock
+    __wakeup_scheduled: bool
+    __stopped: bool
+    __has_subscribers: Optional[Callable[[str], bool]]
 
-    def __init__(self, event_handler_id: int) -> None:
+    def __init__(
+        self,
+        event_handler_id: int,
+        progress_max_fps: Optional[float] = None,
+        progress_frame_format: str = "jpeg",
+        has_subscribers: Optional[Callable[[str], bool]] = None,
+    ) -> None:
         self.event_handler_id = event_handler_id
-        self.__queue = Queue()
-        self.__stop_event = threading.Event()
-        asyncio.create_task(self.__dispatch_from_queue(stop_event=self.__stop_event))
+        self.__loop = asyncio.get_running_loop()
+        self.__pending = deque()
+        self.__pending_progress = dict()
+        self.__lock = threading.Lock()
+        self.__wakeup_scheduled = False
+        self.__stopped = False
+        self.__has_subscribers = has_subscribers
 
-        super().__init__()
+        super().__init__(
+            progress_max_fps=progress_max_fps,
+            progress_frame_format=progress_frame_format,
+        )
 
     def stop(self, *args, **kwargs):
-        self.__stop_event.set()
-        self.__queue.put(None)
+        with self.__lock:
+            self.__stopped = True
+            self.__pending.clear()
+            self.__pending_progress.clear()
+
+    def has_subscribers(self, graph_execution_state_id: str) -> bool:
+        if self.__has_subscribers is None:
+            return True
+        return self.__has_subscribers(graph_execution_state_id)
 
     def dispatch(self, event_name: str, payload: Any) -> None:
-        self.__queue.put(dict(event_name=event_name, payload=payload))
+        session_id = None
+        is_progress = False
+        if event_name == self.session_event:
+            session_id = payload["data"]["graph_execution_state_id"]
+            is_progress = payload["event"] == "generator_progress"
+
+        with self.__lock:
+            if self.__stopped:
+                return
+
+            if is_progress and session_id in self.__pending_progress:
+                # Replace the progress that hasn't been dispatched yet, keeping its place
+                self.__pending_progress[session_id][1:] = [payload, time.monotonic()]
+                return
+
+            event = [event_name, payload, time.monotonic()]
+            self.__pending.append(event)
+            if is_progress:
+                self.__pending_progress[session_id] = event
+            elif session_id is not None:
+                # Progress emitted after other events of the session mustn't overtake them
+                self.__pending_progress.pop(session_id, None)
+
+            if self.__wakeup_scheduled:
+                return
+            self.__wakeup_scheduled = True
+
+        try:
+            self.__loop.call_soon_threadsafe(self.__dispatch_pending)
+        except RuntimeError:
+            pass  # The loop has been closed
+
+    def _dispatch_event(self, event_name: str, payload: Any) -> None:
+        """Dispatches an event to the handlers. Called on the event loop."""
+        dispatch(
+            event_name,
+            payload=payload,
+            middleware_id=self.event_handler_id,
+        )
+
+    def __dispatch_pending(self) -> None:
+        """Dispatches the events emitted since the last wakeup, from the correct thread"""
+        with self.__lock:
+            events, self.__pending = self.__pending, deque()
+            self.__pending_progress.clear()
+            self.__wakeup_scheduled = False
 
-    async def __dispatch_from_queue(self, stop_event: threading.Event):
-        """Get events on from the queue and dispatch them, from the correct thread"""
-        while not stop_event.is_set():
+        dispatched = time.monotonic()
+        for event_name, payload, emitted in events:
+            metrics.event_dispatch_lag.observe(dispatched - emitted)
             try:
-                event = self.__queue.get(block=False)
-                if not event:  # Probably stopping
-                    continue
-
-                dispatch(
-                    event.get("event_name"),
-                    payload=event.get("payload"),
-                    middleware_id=self.event_handler_id,
-                )
-
-            except Empty:
-                await asyncio.sleep(0.001)
-                pass
-
-            except asyncio.CancelledError as e:
-                raise e  # Raise a proper error
+                self._dispatch_event(event_name, payload)
+            except Exception:
+                traceback.print_exc()
@@ -1,12 +1,15 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
 from datetime import datetime, timezone
+from io import BytesIO
 
 from fastapi import Path, Request, UploadFile
 from fastapi.responses import FileResponse, Response
 from fastapi.routing import APIRouter
 from PIL import Image
+from starlette.concurrency import run_in_threadpool
 
+from ...services.image_codec import get_media_type
 from ...services.image_storage import ImageType
 from ..dependencies import ApiDependencies
 
@@ -20,8 +23,24 @@ async def get_image(
 ):
     """Gets a result"""
     # TODO: This is not really secure at all. At least make sure only output results are served
-    filename = ApiDependencies.invoker.services.images.get_path(image_type, image_name)
-    return FileResponse(filename)
+    # Waits for the image to be written if it is being written in the background
+    images = ApiDependencies.invoker.services.images
+    filename = await run_in_threadpool(images.get_path, image_type, image_name)
+    media_type = get_media_type(filename)
+    if media_type is not None:
+        return FileResponse(filename, media_type=media_type)
+
+    # Stored in a format browsers can't display (e.g. npy), so sent as a PNG
+    image = await run_in_threadpool(images.get, image_type, image_name)
+    return Response(
+        content=await run_in_threadpool(_encode_png, image), media_type="image/png"
+    )
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
 
 
 @images_router.post(
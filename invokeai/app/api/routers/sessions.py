@@ -16,6 +16,8 @@ from ...services.graph import (
     GraphExecutionState,
     NodeAlreadyExecutedError,
 )
+from ...services.invocation_queue import InvocationQueueStats
+from ...services.invocation_stats import SessionStats, summarize_stats
 from ...services.item_storage import PaginatedResults
 from ..dependencies import ApiDependencies
 
@@ -49,19 +51,33 @@ async def list_sessions(
     page: int = Query(default=0, description="The page of results to get"),
     per_page: int = Query(default=10, description="The number of results per page"),
     query: str = Query(default="", description="The query string to search for"),
+    cursor: Optional[str] = Query(
+        default=None,
+        description="The next_cursor of the previous page, to get the page after it (faster than paging by number)",
+    ),
 ) -> PaginatedResults[GraphExecutionState]:
     """Gets a list of sessions, optionally searching"""
-    if filter == "":
+    if query == "":
         result = ApiDependencies.invoker.services.graph_execution_manager.list(
-            page, per_page
+            page, per_page, cursor
         )
     else:
         result = ApiDependencies.invoker.services.graph_execution_manager.search(
-            query, page, per_page
+            query, page, per_page, cursor
         )
     return result
 
 
+@session_router.get(
+    "/queue/stats",
+    operation_id="get_queue_stats",
+    responses={200: {"model": InvocationQueueStats}},
+)
+async def get_queue_stats() -> InvocationQueueStats:
+    """Gets the depth of the invocation queue and how long invocations have waited in it"""
+    return ApiDependencies.invoker.services.queue.get_stats()
+
+
 @session_router.get(
     "/{session_id}",
     operation_id="get_session",
@@ -81,6 +97,25 @@ async def get_session(
         return session
 
 
+@session_router.get(
+    "/{session_id}/stats",
+    operation_id="get_session_stats",
+    responses={
+        200: {"model": SessionStats},
+        404: {"description": "Session not found"},
+    },
+)
+async def get_session_stats(
+    session_id: str = Path(description="The id of the session to get the stats of"),
+) -> SessionStats:
+    """Gets the time and memory used by the invocations of a session, and their totals by invocation type"""
+    session = ApiDependencies.invoker.services.graph_execution_manager.get(session_id)
+    if session is None:
+        return Response(status_code=404)
+    else:
+        return summarize_stats(session.stats)
+
+
 @session_router.post(
     "/{session_id}/nodes",
     operation_id="add_node",
@@ -259,6 +294,14 @@ async def invoke_session(
     all: bool = Query(
         default=False, description="Whether or not to invoke all remaining invocations"
     ),
+    priority: Optional[int] = Query(
+        default=None,
+        description="The priority to queue the invocations at (higher runs first). Single invocations are queued ahead of invoking all by default.",
+    ),
+    owner: Optional[str] = Query(
+        default=None,
+        description="Who the invocations are for. Queued invocations take turns fairly between owners (or sessions, without an owner).",
+    ),
 ) -> None:
     """Invokes a session"""
     session = ApiDependencies.invoker.services.graph_execution_manager.get(session_id)
@@ -268,7 +311,9 @@ async def invoke_session(
     if session.is_complete():
         return Response(status_code=400)
 
-    ApiDependencies.invoker.invoke(session, invoke_all=all)
+    ApiDependencies.invoker.invoke(
+        session, invoke_all=all, priority=priority, owner=owner
+    )
     return Response(status_code=202)
 
 
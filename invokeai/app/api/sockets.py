@@ -5,34 +5,95 @@ from fastapi_events.handlers.local import local_handler
 from fastapi_events.typing import Event
 from fastapi_socketio import SocketManager
 
+from ...backend.util.util import progress_frame_to_dataURL
 from ..services.events import EventServiceBase
 
 
 class SocketIO:
+    """Sends session events to the clients subscribed to the session.
+
+    Clients that subscribe with progress_frames get progress images as raw bytes (sent as binary
+    attachments), other clients get them as base64 dataURLs.
+    """
+
     __sio: SocketManager
+    __subscriptions: dict[str, dict[str, bool]]  # Session id -> sid -> wants progress frames
+    __sessions_by_sid: dict[str, set[str]]
 
     def __init__(self, app: FastAPI):
         self.__sio = SocketManager(app=app)
+        self.__subscriptions = dict()
+        self.__sessions_by_sid = dict()
         self.__sio.on("subscribe", handler=self._handle_sub)
         self.__sio.on("unsubscribe", handler=self._handle_unsub)
+        self.__sio.on("disconnect", handler=self._handle_disconnect)
 
         local_handler.register(
             event_name=EventServiceBase.session_event, _func=self._handle_session_event
         )
 
     async def _handle_session_event(self, event: Event):
-        await self.__sio.emit(
-            event=event[1]["event"],
-            data=event[1]["data"],
-            room=event[1]["data"]["graph_execution_state_id"],
-        )
+        event_name = event[1]["event"]
+        data = event[1]["data"]
+        room = data["graph_execution_state_id"]
+
+        progress_image = data.get("progress_image")
+        if progress_image is None or "data" not in progress_image:
+            await self.__sio.emit(event=event_name, data=data, room=room)
+            return
+
+        subscriptions = self.__subscriptions.get(room, {})
+        frame_sids = [sid for sid, frames in subscriptions.items() if frames]
+        for sid in frame_sids:
+            await self.__sio.emit(event=event_name, data=data, to=sid)
+
+        if len(subscriptions) > len(frame_sids):
+            (width, height) = (progress_image["width"], progress_image["height"])
+            dataURL = progress_frame_to_dataURL(
+                progress_image["data"], progress_image["format"], (width // 8, height // 8)
+            )
+            await self.__sio.emit(
+                event=event_name,
+                data=dict(
+                    data,
+                    progress_image=dict(width=width, height=height, dataURL=dataURL),
+                ),
+                room=room,
+                skip_sid=frame_sids,
+            )
+
+    def has_subscribers(self, session_id: str) -> bool:
+        """Whether any client is subscribed to a session. Can be called from any thread."""
+        return len(self.__subscriptions.get(session_id, ())) > 0
 
     async def _handle_sub(self, sid, data, *args, **kwargs):
         if "session" in data:
             self.__sio.enter_room(sid, data["session"])
+            self.__subscriptions.setdefault(data["session"], dict())[sid] = bool(
+                data.get("progress_frames", False)
+            )
+            self.__sessions_by_sid.setdefault(sid, set()).add(data["session"])
 
         # @app.sio.on('unsubscribe')
 
     async def _handle_unsub(self, sid, data, *args, **kwargs):
         if "session" in data:
             self.__sio.leave_room(sid, data["session"])
+            self.__unsubscribe(sid, data["session"])
+
+    async def _handle_disconnect(self, sid, *args, **kwargs):
+        for session_id in list(self.__sessions_by_sid.get(sid, ())):
+            self.__unsubscribe(sid, session_id)
+
+    def __unsubscribe(self, sid: str, session_id: str) -> None:
+        sids = self.__subscriptions.get(session_id)
+        if sids is not None:
+            sids.pop(sid, None)
+            if len(sids) == 0:
+                del self.__subscriptions[session_id]
+
+        sessions = self.__sessions_by_sid.get(sid)
+        if sessions is not None:
+            sessions.discard(session_id)
+            if len(sessions) == 0:
+                del self.__sessions_by_sid[sid]
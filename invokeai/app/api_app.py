@@ -7,6 +7,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi_events.handlers.local import local_handler
 from fastapi_events.middleware import EventHandlerASGIMiddleware
@@ -18,6 +19,7 @@ from .api.routers import images, sessions
 from .api.sockets import SocketIO
 from .invocations import *
 from .invocations.baseinvocation import BaseInvocation
+from .services import metrics
 
 # Create the app
 # TODO: create this all in a method so configuration/etc. can be passed in?
@@ -56,7 +58,9 @@ async def startup_event():
     config.parse_args()
 
     ApiDependencies.initialize(
-        config=config, event_handler_id=event_handler_id
+        config=config,
+        event_handler_id=event_handler_id,
+        has_subscribers=socket_io.has_subscribers,
     )
 
 
@@ -143,6 +147,13 @@ def overridden_redoc():
     )
 
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(
+        metrics.REGISTRY.expose(), media_type="text/plain; version=0.0.4"
+    )
+
+
 def invoke_api():
     # Start our own event loop for eventing usage
     # TODO: determine if there's a better way to do this
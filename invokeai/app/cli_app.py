@@ -19,9 +19,20 @@ from .invocations.baseinvocation import BaseInvocation
 from .services.events import EventServiceBase
 from .services.model_manager_initializer import get_model_manager
 from .services.restoration_services import RestorationServices
+from .services.buffered_item_storage import BufferedItemStorage
 from .services.graph import Edge, EdgeConnection, GraphExecutionState
-from .services.image_storage import DiskImageStorage
-from .services.invocation_queue import MemoryInvocationQueue
+from .services.graph_execution_storage import (
+    SESSION_STATUS_FIELDS,
+    SqliteGraphExecutionStorage,
+)
+from .services.image_storage import DiskImageStorage, ImageType
+from .services.invocation_cache import MemoryInvocationCache
+from .services.item_codec import get_item_codec
+from .services.invocation_queue import (
+    FairInvocationQueue,
+    MemoryInvocationQueue,
+    SqliteInvocationQueue,
+)
 from .services.invocation_services import InvocationServices
 from .services.invoker import Invoker
 from .services.processor import DefaultInvocationProcessor
@@ -130,7 +141,10 @@ def invoke_cli():
     config.parse_args()
     model_manager = get_model_manager(config)
 
-    events = EventServiceBase()
+    events = EventServiceBase(
+        progress_max_fps=config.progress_max_fps,
+        progress_frame_format=config.progress_frame_format,
+    )
 
     output_folder = os.path.abspath(
         os.path.join(os.path.dirname(__file__), "../../../outputs")
@@ -138,17 +152,58 @@ def invoke_cli():
 
     # TODO: build a file/path manager?
     db_location = os.path.join(output_folder, "invokeai.db")
+    pragmas = dict(p.split("=", 1) for p in config.sqlite_pragma)
+    session_storage_options = dict(
+        filename=db_location,
+        table_name="graph_executions",
+        pragmas=pragmas,
+        codec=get_item_codec(config.session_codec),
+        status_fields=SESSION_STATUS_FIELDS,
+    )
+    graph_execution_manager = (
+        SqliteGraphExecutionStorage(**session_storage_options)
+        if config.session_storage == "delta"
+        else SqliteItemStorage[GraphExecutionState](**session_storage_options)
+    )
+    if config.session_flush_interval > 0:
+        graph_execution_manager = BufferedItemStorage[GraphExecutionState](
+            graph_execution_manager, flush_interval=config.session_flush_interval
+        )
+    queue = (
+        SqliteInvocationQueue(filename=db_location, pragmas=pragmas)
+        if config.invocation_queue == "sqlite"
+        else FairInvocationQueue()
+        if config.invocation_queue == "fair"
+        else MemoryInvocationQueue()
+    )
 
     services = InvocationServices(
         model_manager=model_manager,
         events=events,
-        images=DiskImageStorage(output_folder),
-        queue=MemoryInvocationQueue(),
-        graph_execution_manager=SqliteItemStorage[GraphExecutionState](
-            filename=db_location, table_name="graph_executions"
+        images=DiskImageStorage(
+            output_folder,
+            cache_bytes=config.image_cache_mb * 2**20,
+            write_workers=config.image_write_workers,
+            codecs={
+                ImageType.RESULT: config.result_image_codec,
+                ImageType.INTERMEDIATE: config.intermediate_image_codec,
+            },
+            intermediate_bytes=config.intermediate_memory_mb * 2**20,
+        ),
+        queue=queue,
+        graph_execution_manager=graph_execution_manager,
+        processor=DefaultInvocationProcessor(
+            cpu_workers=config.cpu_workers,
+            batch_window=config.batch_window,
+            max_batch_size=config.max_batch_size,
+            profile_dir=config.profile_dir,
         ),
-        processor=DefaultInvocationProcessor(),
         restoration=RestorationServices(config),
+        invocation_cache=(
+            MemoryInvocationCache(max_size=config.invocation_cache_size)
+            if config.invocation_cache_size > 0
+            else None
+        ),
     )
 
     invoker = Invoker(services)
@@ -2,20 +2,33 @@
 
 from abc import ABC, abstractmethod
 from inspect import signature
-from typing import get_args, get_type_hints
+from typing import ClassVar, Optional, get_args, get_type_hints
 
 from pydantic import BaseModel, Field
 
+from ..services.cancellation import CancellationToken
 from ..services.invocation_services import InvocationServices
 
 
 class InvocationContext:
     services: InvocationServices
     graph_execution_state_id: str
-
-    def __init__(self, services: InvocationServices, graph_execution_state_id: str):
+    cancellation_token: CancellationToken
+
+    def __init__(
+        self,
+        services: InvocationServices,
+        graph_execution_state_id: str,
+        cancellation_token: Optional[CancellationToken] = None,
+    ):
         self.services = services
         self.graph_execution_state_id = graph_execution_state_id
+        self.cancellation_token = cancellation_token or CancellationToken()
+
+    def is_canceled(self) -> bool:
+        """Whether the invocation has been canceled. Invocations that run for a while should
+        check this (e.g. on each step) and raise CanceledException if it has."""
+        return self.cancellation_token.is_canceled
 
 
 class BaseInvocationOutput(BaseModel):
@@ -44,6 +57,12 @@ class BaseInvocation(ABC, BaseModel):
     # All invocations must include a type name like this:
     # type: Literal['your_output_name']
 
+    # Invocations that run models on the GPU should set this, so processors can schedule them separately
+    uses_gpu: ClassVar[bool] = False
+
+    # Invocations with side effects, or that are cheaper to run than to look up, should clear this
+    cacheable: ClassVar[bool] = True
+
     @classmethod
     def get_all_subclasses(cls):
         subclasses = []
@@ -72,6 +91,21 @@ class BaseInvocation(ABC, BaseModel):
     def invoke(self, context: InvocationContext) -> BaseInvocationOutput:
         """Invoke with provided context and return outputs."""
         pass
+
+    def get_batch_key(self) -> Optional[str]:
+        """Gets a key shared by invocations that can be invoked together by invoke_batch (e.g. to
+        run their model on one batch), or None if this invocation can't be batched."""
+        return None
+
+    @classmethod
+    def invoke_batch(
+        cls, invocations: list["BaseInvocation"], contexts: list[InvocationContext]
+    ) -> list[BaseInvocationOutput]:
+        """Invoke invocations with the same batch key together, returning the outputs of each."""
+        return [
+            invocation.invoke(context)
+            for invocation, context in zip(invocations, contexts)
+        ]
     
     #fmt: off
     id: str = Field(description="The id of this node. Must be unique among all nodes.")
@@ -1,7 +1,7 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
 from functools import partial
-from typing import Literal, Optional, Union
+from typing import Callable, Literal, Optional, Union
 
 import numpy as np
 from torch import Tensor
@@ -13,17 +13,38 @@ from .baseinvocation import BaseInvocation, InvocationContext
 from .image import ImageField, ImageOutput
 from ...backend.generator import Txt2Img, Img2Img, Inpaint, InvokeAIGenerator
 from ...backend.stable_diffusion import PipelineIntermediateState
-from ..util.util import diffusers_step_callback_adapter, CanceledException
+from ..util.util import diffusers_step_callback_adapter, flush_progress, CanceledException
 
 SAMPLER_NAME_VALUES = Literal[
     tuple(InvokeAIGenerator.schedulers())
 ]
 
+
+def get_batch_step_callbacks(
+    invocations: list["TextToImageInvocation"], contexts: list[InvocationContext]
+) -> list[Callable]:
+    """Gets step callbacks for a batch of invocations. Progress is only dispatched for the
+    invocations that haven't been canceled, and the batch is stopped once all of them have been."""
+
+    def step_callback(
+        invocation: "TextToImageInvocation",
+        context: InvocationContext,
+        intermediate_state: PipelineIntermediateState,
+    ) -> None:
+        if all(c.is_canceled() for c in contexts):
+            raise CanceledException
+        if not context.is_canceled():
+            invocation.dispatch_progress(context, intermediate_state)
+
+    return [partial(step_callback, i, c) for i, c in zip(invocations, contexts)]
+
+
 # Text to image
 class TextToImageInvocation(BaseInvocation):
     """Generates an image using text2img."""
 
     type: Literal["txt2img"] = "txt2img"
+    uses_gpu = True
 
     # Inputs
     # TODO: consider making prompt optional to enable providing prompt through a link
@@ -44,7 +65,7 @@ class TextToImageInvocation(BaseInvocation):
     def dispatch_progress(
         self, context: InvocationContext, intermediate_state: PipelineIntermediateState
     ) -> None:
-        if (context.services.queue.is_canceled(context.graph_execution_state_id)):
+        if context.is_canceled():
             raise CanceledException
 
         step = intermediate_state.step
@@ -82,11 +103,38 @@ class TextToImageInvocation(BaseInvocation):
         # Results are image and seed, unwrap for now and ignore the seed
         # TODO: pre-seed?
         # TODO: can this return multiple results? Should it?
+        return self.save_image(context, generate_output.image)
+
+    def get_batch_key(self) -> Optional[str]:
+        # Invocations that only differ by prompt and seed can be denoised in one batch
+        return self.json(exclude={"id", "prompt", "seed", "progress_images"})
+
+    @classmethod
+    def invoke_batch(
+        cls, invocations: list["TextToImageInvocation"], contexts: list[InvocationContext]
+    ) -> list[ImageOutput]:
+        model = contexts[0].services.model_manager.get_model()
+        outputs = Txt2Img(model).generate_batch(
+            prompts=[invocation.prompt for invocation in invocations],
+            seeds=[invocation.seed for invocation in invocations],
+            step_callbacks=get_batch_step_callbacks(invocations, contexts),
+            **invocations[0].dict(exclude={"id", "prompt", "seed"}),
+        )
+        return [
+            invocation.save_image(context, output.image)
+            for invocation, context, output in zip(invocations, contexts, outputs)
+        ]
+
+    def save_image(self, context: InvocationContext, image) -> ImageOutput:
+        """Saves a generated image as the result of this invocation"""
+        # Progress is emitted in the background, and mustn't be emitted after the result
+        flush_progress(context, self.id)
+
         image_type = ImageType.RESULT
         image_name = context.services.images.create_name(
             context.graph_execution_state_id, self.id
         )
-        context.services.images.save(image_type, image_name, generate_output.image)
+        context.services.images.save(image_type, image_name, image)
         return ImageOutput(
             image=ImageField(image_type=image_type, image_name=image_name)
         )
@@ -110,7 +158,7 @@ class ImageToImageInvocation(TextToImageInvocation):
     def dispatch_progress(
         self, context: InvocationContext, intermediate_state: PipelineIntermediateState
     ) -> None:  
-        if (context.services.queue.is_canceled(context.graph_execution_state_id)):
+        if context.is_canceled():
             raise CanceledException
 
         step = intermediate_state.step
@@ -156,14 +204,34 @@ class ImageToImageInvocation(TextToImageInvocation):
         # Results are image and seed, unwrap for now and ignore the seed
         # TODO: pre-seed?
         # TODO: can this return multiple results? Should it?
-        image_type = ImageType.RESULT
-        image_name = context.services.images.create_name(
-            context.graph_execution_state_id, self.id
-        )
-        context.services.images.save(image_type, image_name, result_image)
-        return ImageOutput(
-            image=ImageField(image_type=image_type, image_name=image_name)
+        return self.save_image(context, result_image)
+
+    def get_batch_key(self) -> Optional[str]:
+        # Images of different sizes are denoised in separate batches by the generator
+        return self.json(exclude={"id", "prompt", "seed", "progress_images", "image"})
+
+    @classmethod
+    def invoke_batch(
+        cls, invocations: list["ImageToImageInvocation"], contexts: list[InvocationContext]
+    ) -> list[ImageOutput]:
+        images = [
+            context.services.images.get(
+                invocation.image.image_type, invocation.image.image_name
+            )
+            for invocation, context in zip(invocations, contexts)
+        ]
+        model = contexts[0].services.model_manager.get_model()
+        outputs = Img2Img(model).generate_batch(
+            prompts=[invocation.prompt for invocation in invocations],
+            seeds=[invocation.seed for invocation in invocations],
+            step_callbacks=get_batch_step_callbacks(invocations, contexts),
+            init_images=images,
+            **invocations[0].dict(exclude={"id", "prompt", "seed", "image"}),
         )
+        return [
+            invocation.save_image(context, output.image)
+            for invocation, context, output in zip(invocations, contexts, outputs)
+        ]
 
 class InpaintInvocation(ImageToImageInvocation):
     """Generates an image using inpaint."""
@@ -179,10 +247,14 @@ class InpaintInvocation(ImageToImageInvocation):
         description="The amount by which to replace masked areas with latent noise",
     )
 
+    def get_batch_key(self) -> Optional[str]:
+        # Inpainting isn't batched
+        return None
+
     def dispatch_progress(
         self, context: InvocationContext, intermediate_state: PipelineIntermediateState
     ) -> None:  
-        if (context.services.queue.is_canceled(context.graph_execution_state_id)):
+        if context.is_canceled():
             raise CanceledException
 
         step = intermediate_state.step
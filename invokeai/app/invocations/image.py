@@ -72,6 +72,7 @@ class ShowImageInvocation(BaseInvocation):
     """Displays a provided image, and passes it forward in the pipeline."""
 
     type: Literal["show_image"] = "show_image"
+    cacheable = False
 
     # Inputs
     image: ImageField = Field(default=None, description="The image to show")
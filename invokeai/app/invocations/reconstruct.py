@@ -12,6 +12,7 @@ class RestoreFaceInvocation(BaseInvocation):
     """Restores faces in an image."""
     #fmt: off
     type:  Literal["restore_face"] = "restore_face"
+    uses_gpu = True
 
     # Inputs
     image: Union[ImageField, None] = Field(description="The input image")
@@ -15,6 +15,7 @@ class UpscaleInvocation(BaseInvocation):
     """Upscales an image."""
     #fmt: off
     type: Literal["upscale"] = "upscale"
+    uses_gpu = True
 
     # Inputs
     image: Union[ImageField, None] = Field(description="The input image", default=None)
@@ -0,0 +1,30 @@
+"""Moves the images stored by the node-based interfaces into the sharded directory layout.
+
+Images stored directly in outputs/results, outputs/intermediates and outputs/uploads (as they were
+before images were sharded) are moved into their shards, e.g. outputs/results/3f/a2/{name}. Image
+names don't change, so sessions that reference them still work. Images can still be read before
+they are moved, so this can be run at any time, but not while the app is running.
+"""
+import argparse
+import os
+
+from .services.image_storage import migrate_images
+
+
+def migrate_images_command():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--outdir",
+        default=os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../outputs")),
+        help="The output folder of the node-based interfaces [outputs]",
+    )
+    args = parser.parse_args()
+
+    (moved, skipped) = migrate_images(args.outdir)
+    print(f">> Moved {moved} images into shards in {args.outdir}")
+    if skipped > 0:
+        print(f">> Left {skipped} images, as images with the same names are already in their shards")
+
+
+if __name__ == "__main__":
+    migrate_images_command()
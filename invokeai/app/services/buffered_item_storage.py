@@ -0,0 +1,171 @@
+import traceback
+from threading import Event, Lock, Thread
+from typing import Optional, TypeVar
+
+from pydantic import BaseModel
+
+from .item_storage import ItemStorageABC, PaginatedResults
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class BufferedItemStorage(ItemStorageABC[T]):
+    """Buffers sets to another item storage, writing them in batches.
+
+    Items that are set are written within flush_interval seconds (or as soon as max_pending items
+    are waiting), with all of them written at once and repeated sets of an item written only once.
+    Buffered items are returned by get(), and on_changed callbacks are called when an item is set
+    rather than when it is written. Items that fail to be written stay buffered and are written
+    with the next flush. Buffered items are lost if the process exits without stop() being called.
+    """
+
+    _storage: ItemStorageABC[T]
+    _id_field: str
+    _flush_interval: float
+    _max_pending: int
+    _pending: dict[str, T]
+    _flushing: dict[str, T]
+    _lock: Lock
+    _flush_lock: Lock
+    _wake_event: Event
+    _stop_event: Event
+    _flush_thread: Optional[Thread]
+
+    def __init__(
+        self,
+        storage: ItemStorageABC[T],
+        flush_interval: float = 0.5,
+        max_pending: int = 100,
+        id_field: str = "id",
+    ):
+        super().__init__()
+        self._storage = storage
+        self._id_field = id_field
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._pending = dict()
+        self._flushing = dict()
+        self._lock = Lock()  # Guards the pending and flushing items
+        self._flush_lock = Lock()  # Held while writing to the storage
+        self._wake_event = Event()
+        self._stop_event = Event()
+        self._flush_thread = None
+
+    def start(self, invoker) -> None:
+        # The invoker may start services more than once
+        if self._flush_thread is not None:
+            return
+        self._stop_event.clear()
+        self._flush_thread = Thread(
+            name="item_storage_flush", target=self.__flush_periodically, daemon=True
+        )
+        self._flush_thread.start()
+
+    def stop(self, *args, **kwargs) -> None:
+        if self._flush_thread is None:
+            return
+        self._stop_event.set()
+        self._wake_event.set()
+        self._flush_thread.join()
+        self._flush_thread = None
+
+        # Items set from now on are written straight away
+        self.flush()
+
+    def flush(self) -> None:
+        """Writes all buffered items. If they can't be written, they stay buffered and the error is
+        raised."""
+        with self._flush_lock:
+            with self._lock:
+                if len(self._pending) == 0:
+                    return
+                self._flushing, self._pending = self._pending, dict()
+
+            # Readers still see the items being written until they have been written
+            try:
+                self._storage.set_many(list(self._flushing.values()))
+            except Exception:
+                print(f">> Failed to write {len(self._flushing)} items, which will be written with the next flush")
+                with self._lock:
+                    # Items set again since are newer
+                    self._pending = {**self._flushing, **self._pending}
+                    self._flushing = dict()
+                raise
+
+            with self._lock:
+                self._flushing = dict()
+
+    def __flush_periodically(self) -> None:
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self._flush_interval)
+            self._wake_event.clear()
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    def __get_buffered(self, item_id: str) -> Optional[T]:
+        """Gets a copy of an item that hasn't been written yet. The lock must be held."""
+        item = self._pending.get(item_id)
+        if item is None:
+            item = self._flushing.get(item_id)
+        return item.copy(deep=True) if item is not None else None
+
+    def get(self, item_id: str) -> Optional[T]:
+        with self._lock:
+            item = self.__get_buffered(str(item_id))
+        return item if item is not None else self._storage.get(item_id)
+
+    def get_many(self, item_ids: list[str]) -> list[Optional[T]]:
+        with self._lock:
+            items = [self.__get_buffered(str(item_id)) for item_id in item_ids]
+
+        missing = [item_id for item_id, item in zip(item_ids, items) if item is None]
+        stored = iter(self._storage.get_many(missing) if len(missing) > 0 else [])
+        return [item if item is not None else next(stored) for item in items]
+
+    def set(self, item: T) -> None:
+        self.set_many([item])
+
+    def set_many(self, items: list[T]) -> None:
+        with self._lock:
+            # Copied, so changes made after setting an item aren't written
+            for item in items:
+                self._pending[str(getattr(item, self._id_field))] = item.copy(deep=True)
+            is_full = len(self._pending) >= self._max_pending
+
+        if is_full or self._flush_thread is None:
+            self.flush()
+
+        for item in items:
+            self._on_changed(item)
+
+    def delete(self, item_id: str) -> None:
+        self.delete_many([item_id])
+
+    def delete_many(self, item_ids: list[str]) -> None:
+        # Wait for any write in progress, so it can't write a deleted item back
+        with self._flush_lock:
+            with self._lock:
+                for item_id in item_ids:
+                    self._pending.pop(str(item_id), None)
+            self._storage.delete_many(item_ids)
+
+        for item_id in item_ids:
+            self._on_deleted(item_id)
+
+    def list(
+        self, page: int = 0, per_page: int = 10, cursor: Optional[str] = None
+    ) -> PaginatedResults[T]:
+        self.flush()
+        return self._storage.list(page, per_page, cursor)
+
+    def search(
+        self,
+        query: str,
+        page: int = 0,
+        per_page: int = 10,
+        cursor: Optional[str] = None,
+    ) -> PaginatedResults[T]:
+        self.flush()
+        return self._storage.search(query, page, per_page, cursor)
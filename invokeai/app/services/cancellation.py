@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+from threading import Event, Lock
+from typing import Optional
+
+# How long sessions stay canceled, unless they are invoked again
+CANCELLATION_TTL = 3600.0
+
+# Max number of canceled sessions to remember
+MAX_CANCELLATIONS = 10000
+
+
+class CancellationToken:
+    """Tells a running invocation that it has been canceled. Invocations that run for a while
+    should check it (e.g. on each step) and raise CanceledException when it is canceled."""
+
+    __event: Event
+
+    def __init__(self):
+        self.__event = Event()
+
+    def cancel(self) -> None:
+        self.__event.set()
+
+    @property
+    def is_canceled(self) -> bool:
+        return self.__event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits until canceled (or the timeout passes), returning whether it was canceled"""
+        return self.__event.wait(timeout)
+
+
+class CancellationSet:
+    """The ids of canceled sessions, with when they were canceled.
+
+    Cancellations expire after ttl seconds, and only the latest max_size are kept, so the set
+    doesn't grow without bound. Lookups, additions and removals take constant (amortized) time.
+    """
+
+    __cancellations: OrderedDict[str, float]
+    __ttl: float
+    __max_size: int
+    __lock: Lock
+
+    def __init__(self, ttl: float = CANCELLATION_TTL, max_size: int = MAX_CANCELLATIONS):
+        self.__cancellations = OrderedDict()
+        self.__ttl = ttl
+        self.__max_size = max_size
+        self.__lock = Lock()
+
+    def add(self, id: str, timestamp: Optional[float] = None) -> None:
+        """Adds a cancellation, unless the id is already canceled. Cancellations are expected to
+        be added in the order they were made, so the oldest can be found first."""
+        with self.__lock:
+            self.__expire()
+            if id in self.__cancellations:
+                return
+
+            self.__cancellations[id] = timestamp if timestamp is not None else time.time()
+            while len(self.__cancellations) > self.__max_size:
+                self.__cancellations.popitem(last=False)
+
+    def discard(self, id: str) -> None:
+        with self.__lock:
+            self.__cancellations.pop(id, None)
+
+    def get(self, id: str) -> Optional[float]:
+        """Gets when an id was canceled, or None if it isn't canceled"""
+        timestamp = self.__cancellations.get(id)
+        if timestamp is None or timestamp < time.time() - self.__ttl:
+            return None
+        return timestamp
+
+    def __contains__(self, id: str) -> bool:
+        return self.get(id) is not None
+
+    def __len__(self) -> int:
+        with self.__lock:
+            self.__expire()
+            return len(self.__cancellations)
+
+    def __expire(self) -> None:
+        """Removes expired cancellations. The lock must be held."""
+        expired_before = time.time() - self.__ttl
+        while len(self.__cancellations) > 0:
+            id, timestamp = next(iter(self.__cancellations.items()))
+            if timestamp >= expired_before:
+                break
+            self.__cancellations.popitem(last=False)
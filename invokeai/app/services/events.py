@@ -1,19 +1,82 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
-from typing import Any, Dict, TypedDict
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, TypedDict
 
 ProgressImage = TypedDict(
     "ProgressImage", {"dataURL": str, "width": int, "height": int}
 )
 
+# A progress image as raw bytes, sent as a binary attachment rather than a base64 dataURL.
+# The frame is the latent preview, at 1/8 of the width and height of the generated image.
+ProgressFrame = TypedDict(
+    "ProgressFrame", {"data": bytes, "format": str, "width": int, "height": int}
+)
+
 class EventServiceBase:
     session_event: str = "session_event"
 
     """Basic event bus, to have an empty stand-in when not needed"""
 
+    progress_max_fps: Optional[float]
+    progress_frame_format: str
+    __last_progress: OrderedDict[str, float]
+    __progress_lock: threading.Lock
+
+    def __init__(
+        self, progress_max_fps: Optional[float] = None, progress_frame_format: str = "jpeg"
+    ):
+        self.progress_max_fps = progress_max_fps
+        self.progress_frame_format = progress_frame_format
+        self.__last_progress = OrderedDict()
+        self.__progress_lock = threading.Lock()
+
     def dispatch(self, event_name: str, payload: Any) -> None:
         pass
 
+    def has_subscribers(self, graph_execution_state_id: str) -> bool:
+        """Whether anyone is listening to the events of a session"""
+        return True
+
+    def should_emit_progress(
+        self, graph_execution_state_id: str, step: int, total_steps: int
+    ) -> bool:
+        """Whether progress for a step should be emitted, so previews are only rendered when they
+        will be sent. Progress isn't emitted when nobody is listening to the session, and at most
+        progress_max_fps times per second per session (see record_progress()), apart from the
+        last step."""
+        if not self.has_subscribers(graph_execution_state_id):
+            return False
+        if not self.progress_max_fps or self.progress_max_fps <= 0:
+            return True
+
+        now = time.monotonic()
+        interval = 1.0 / self.progress_max_fps
+        with self.__progress_lock:
+            # Sessions that last emitted progress longer than an interval ago may emit again, so
+            # they're forgotten (oldest first) rather than kept until the session completes
+            while len(self.__last_progress) > 0:
+                id, last = next(iter(self.__last_progress.items()))
+                if now - last < interval:
+                    break
+                self.__last_progress.popitem(last=False)
+
+            return (
+                graph_execution_state_id not in self.__last_progress
+                or step >= total_steps - 1
+            )
+
+    def record_progress(self, graph_execution_state_id: str) -> None:
+        """Records that the progress of a session is being emitted, which limits its rate"""
+        if not self.progress_max_fps or self.progress_max_fps <= 0:
+            return
+
+        with self.__progress_lock:
+            self.__last_progress[graph_execution_state_id] = time.monotonic()
+            self.__last_progress.move_to_end(graph_execution_state_id)
+
     def __emit_session_event(self, event_name: str, payload: Dict) -> None:
         self.dispatch(
             event_name=EventServiceBase.session_event,
@@ -26,7 +89,7 @@ class EventServiceBase:
         self,
         graph_execution_state_id: str,
         invocation_id: str,
-        progress_image: ProgressImage | None,
+        progress_image: ProgressImage | ProgressFrame | None,
         step: int,
         total_steps: int,
     ) -> None:
@@ -68,6 +131,19 @@ class EventServiceBase:
             ),
         )
 
+    def emit_invocation_stats(
+        self, graph_execution_state_id: str, invocation_id: str, stats: Dict
+    ) -> None:
+        """Emitted with the time and memory used by an invocation, once it has completed or errored"""
+        self.__emit_session_event(
+            event_name="invocation_stats",
+            payload=dict(
+                graph_execution_state_id=graph_execution_state_id,
+                invocation_id=invocation_id,
+                stats=stats,
+            ),
+        )
+
     def emit_invocation_started(
         self, graph_execution_state_id: str, invocation_id: str
     ) -> None:
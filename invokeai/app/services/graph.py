@@ -1,9 +1,11 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
 import copy
+import heapq
 import itertools
 import traceback
 import uuid
+from collections import deque
 from types import NoneType
 from typing import (
     Annotated,
@@ -17,7 +19,7 @@ from typing import (
 )
 
 import networkx as nx
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, PrivateAttr, validator
 from pydantic.fields import Field
 
 from ..invocations import *
@@ -27,6 +29,7 @@ from ..invocations.baseinvocation import (
     InvocationContext,
 )
 from .invocation_services import InvocationServices
+from .invocation_stats import InvocationStats
 
 
 class EdgeConnection(BaseModel):
@@ -165,6 +168,7 @@ class IterateInvocationOutput(BaseInvocationOutput):
 # TODO: Fill this out and move to invocations
 class IterateInvocation(BaseInvocation):
     type: Literal["iterate"] = "iterate"
+    cacheable = False
 
     collection: list[Any] = Field(
         description="The list of items to iterate over", default_factory=list
@@ -195,6 +199,7 @@ class CollectInvocation(BaseInvocation):
     """Collects values into a collection"""
 
     type: Literal["collect"] = "collect"
+    cacheable = False
 
     item: Any = Field(
         description="The item to collect (all inputs must be of the same type)",
@@ -747,6 +752,135 @@ class Graph(BaseModel):
         return g
 
 
+class _SourceGraphIndex:
+    """Tracks which source graph nodes are ready to be prepared.
+
+    Keeps a count of unexecuted parents for every unprepared node and a heap of ready nodes
+    ordered by their position in a topological sort of the flattened source graph, so the
+    next node to prepare can be found without re-sorting the graph on every step.
+    """
+
+    graph: nx.DiGraph
+    size: tuple[int, int]
+    order: dict[str, int]
+    pending_inputs: dict[str, int]
+    ready: list[tuple[int, str]]
+    input_edges: dict[str, list[Edge]]
+    iterator_graph: Optional[nx.DiGraph]
+
+    def __init__(self, state: "GraphExecutionState"):
+        self.graph = state.graph.nx_graph_flat()
+        self.size = (len(state.graph.nodes), len(state.graph.edges))
+        self.order = {n: i for i, n in enumerate(nx.topological_sort(self.graph))}
+        self.pending_inputs = dict()
+        self.ready = list()
+        self.iterator_graph = None
+
+        for node_path in self.graph.nodes:
+            if node_path in state.source_prepared_mapping:
+                continue
+            pending = sum(1 for p in self.graph.predecessors(node_path) if p not in state.executed)
+            self.pending_inputs[node_path] = pending
+            if pending == 0:
+                heapq.heappush(self.ready, (self.order[node_path], node_path))
+
+        # Group top-level edges by destination. Nodes inside graph invocations are looked up on demand.
+        graph_node_ids = set(n.id for n in state.graph.nodes.values() if isinstance(n, GraphInvocation))
+        self.input_edges = dict()
+        for node_path in self.graph.nodes:
+            node_id = node_path if "." not in node_path else node_path[: node_path.index(".")]
+            if node_id not in graph_node_ids:
+                self.input_edges[node_path] = list()
+        for edge in state.graph.edges:
+            if edge.destination.node_id in self.input_edges:
+                self.input_edges[edge.destination.node_id].append(edge)
+
+    def is_stale(self, graph: Graph) -> bool:
+        return self.size != (len(graph.nodes), len(graph.edges))
+
+    def peek(self) -> Optional[str]:
+        return self.ready[0][1] if len(self.ready) > 0 else None
+
+    def pop(self) -> None:
+        node_path = heapq.heappop(self.ready)[1]
+        del self.pending_inputs[node_path]
+
+    def complete(self, node_path: str) -> None:
+        """Marks a source node as executed, making any children with no other pending inputs ready"""
+        if node_path not in self.graph:
+            return
+
+        for child in self.graph.successors(node_path):
+            if child not in self.pending_inputs:
+                continue
+            self.pending_inputs[child] -= 1
+            if self.pending_inputs[child] == 0:
+                heapq.heappush(self.ready, (self.order[child], child))
+
+
+class _ExecutionGraphIndex:
+    """Tracks which prepared nodes are ready to execute.
+
+    Keeps a count of unexecuted inputs for every prepared node and a queue of ready nodes in
+    the order they became ready, so the next node can be found without sorting the execution graph.
+    """
+
+    children: dict[str, list[str]]
+    input_edges: dict[str, list[Edge]]
+    pending_inputs: dict[str, int]
+    unexecuted: dict[str, int]
+    ready: deque[str]
+
+    def __init__(self, state: "GraphExecutionState"):
+        self.children = dict()
+        self.input_edges = dict()
+        self.pending_inputs = dict()
+        self.unexecuted = dict()
+        self.ready = deque()
+
+        for edge in state.execution_graph.edges:
+            self.add_edge(edge)
+
+        for node_id in state.execution_graph.nodes:
+            self.add_node(state, node_id)
+
+    def add_edge(self, edge: Edge) -> None:
+        self.children.setdefault(edge.source.node_id, list()).append(edge.destination.node_id)
+        self.input_edges.setdefault(edge.destination.node_id, list()).append(edge)
+
+    def add_node(self, state: "GraphExecutionState", node_id: str) -> None:
+        """Adds a prepared node. All of its input edges must already have been added."""
+        if node_id in state.executed:
+            return
+
+        source_node = state.prepared_source_mapping[node_id]
+        self.unexecuted[source_node] = self.unexecuted.get(source_node, 0) + 1
+
+        pending = sum(
+            1 for e in self.input_edges.get(node_id, []) if e.source.node_id not in state.executed
+        )
+        self.pending_inputs[node_id] = pending
+        if pending == 0 and node_id not in state.executing:
+            self.ready.append(node_id)
+
+    def peek(self, executed: set[str], executing: set[str]) -> Optional[str]:
+        """Gets the first ready node that hasn't been handed out yet"""
+        while len(self.ready) > 0 and (self.ready[0] in executed or self.ready[0] in executing):
+            self.ready.popleft()
+        return self.ready[0] if len(self.ready) > 0 else None
+
+    def complete(self, node_id: str, source_node: str) -> bool:
+        """Marks a prepared node as executed. Returns True if all prepared nodes for its source node have executed."""
+        del self.pending_inputs[node_id]
+        for child in self.children.get(node_id, []):
+            self.pending_inputs[child] -= 1
+            if self.pending_inputs[child] == 0:
+                self.ready.append(child)
+
+        self.unexecuted[source_node] -= 1
+        return self.unexecuted[source_node] == 0
+
+
 class GraphExecutionState(BaseModel):
     """Tracks the state of a graph execution"""
 
@@ -772,6 +906,11 @@ class GraphExecutionState(BaseModel):
         default_factory=list,
     )
 
+    # Nodes that have been handed out by next() but not completed yet
+    executing: set[str] = Field(
+        description="The set of prepared node ids that are currently executing", default_factory=set
+    )
+
     # The results of executed nodes
     results: dict[
         str, Annotated[InvocationOutputsUnion, Field(discriminator="type")]
@@ -782,6 +921,11 @@ class GraphExecutionState(BaseModel):
         description="Errors raised when executing nodes", default_factory=dict
     )
 
+    # Time and memory used by executed nodes
+    stats: dict[str, InvocationStats] = Field(
+        description="The time and memory used by node executions", default_factory=dict
+    )
+
     # Map of prepared/executed nodes to their original nodes
     prepared_source_mapping: dict[str, str] = Field(
         description="The map of prepared nodes to original graph nodes",
@@ -805,18 +949,22 @@ class GraphExecutionState(BaseModel):
                 'execution_graph',
                 'executed',
                 'executed_history',
+                'executing',
                 'results',
                 'errors',
+                'stats',
                 'prepared_source_mapping',
                 'source_prepared_mapping',
             ]
         }
 
-    def next(self) -> BaseInvocation | None:
-        """Gets the next node ready to execute."""
+    # Scheduling indexes, built on demand from the fields above (they are never serialized)
+    _source_index: Optional[_SourceGraphIndex] = PrivateAttr(default=None)
+    _execution_index: Optional[_ExecutionGraphIndex] = PrivateAttr(default=None)
 
-        # TODO: enable multiple nodes to execute simultaneously by tracking currently executing nodes
-        #       possibly with a timeout?
+    def next(self) -> BaseInvocation | None:
+        """Gets the next node ready to execute and marks it as executing.
+        Executing nodes are not returned again, so every ready node can be handed out to run at once."""
 
         # If there are no prepared nodes, prepare some nodes
         next_node = self._get_next_node()
@@ -833,6 +981,7 @@ class GraphExecutionState(BaseModel):
         # Get values from edges
         if next_node is not None:
             self._prepare_inputs(next_node)
+            self.executing.add(next_node.id)
 
         # If next is still none, there's no next node, return None
         return next_node
@@ -843,22 +992,41 @@ class GraphExecutionState(BaseModel):
         if node_id not in self.execution_graph.nodes:
             return  # TODO: log error?
 
+        self.executing.discard(node_id)
+
+        if node_id in self.executed:
+            self.results[node_id] = output
+            return
+
+        # Build the index before marking the node as executed so it sees the node as pending
+        execution_index = self._get_execution_index()
+
         # Mark node as executed
         self.executed.add(node_id)
         self.results[node_id] = output
 
         # Check if source node is complete (all prepared nodes are complete)
         source_node = self.prepared_source_mapping[node_id]
-        prepared_nodes = self.source_prepared_mapping[source_node]
-
-        if all([n in self.executed for n in prepared_nodes]):
+        if execution_index.complete(node_id, source_node):
             self.executed.add(source_node)
             self.executed_history.append(source_node)
+            if self._source_index is not None:
+                self._source_index.complete(source_node)
 
     def set_node_error(self, node_id: str, error: str):
         """Marks a node as errored"""
+        self.executing.discard(node_id)
         self.errors[node_id] = error
 
+    def set_node_stats(self, node_id: str, stats: InvocationStats):
+        """Records the time and memory used to execute a node"""
+        self.stats[node_id] = stats
+
+    def release_executing(self) -> None:
+        """Returns all executing nodes to the ready set, e.g. after their invocations were canceled"""
+        self.executing.clear()
+        self._execution_index = None
+
     def is_complete(self) -> bool:
         """Returns true if the graph is complete"""
         return self.has_error() or all((k in self.executed for k in self.graph.nodes))
@@ -873,6 +1041,10 @@ class GraphExecutionState(BaseModel):
         """Prepares an iteration node and connects all edges, returning the new node id"""
 
         node = self.graph.get_node(node_path)
+        execution_index = self._get_execution_index()
+
+        # Get all input edges
+        input_edges = self._get_source_input_edges(node_path)
 
         self_iteration_count = -1
 
@@ -880,7 +1052,7 @@ class GraphExecutionState(BaseModel):
         if isinstance(node, IterateInvocation):
             # Get input collection edge (should error if there are no inputs)
             input_collection_edge = next(
-                iter(self.graph._get_input_edges(node_path, "collection"))
+                e for e in input_edges if e.destination.field == "collection"
             )
             input_collection_prepared_node_id = next(
                 n[1]
@@ -900,9 +1072,6 @@ class GraphExecutionState(BaseModel):
             # TODO: should this raise a warning? It might just happen if an empty collection is input, and should be valid.
             return new_nodes
 
-        # Get all input edges
-        input_edges = self.graph._get_input_edges(node_path)
-
         # Create new edges for this iteration
         # For collect nodes, this may contain multiple inputs to the same field
         new_edges = list()
@@ -936,17 +1105,40 @@ class GraphExecutionState(BaseModel):
             self.source_prepared_mapping[node_path].add(new_node.id)
 
             # Add new edges to execution graph
+            # These mirror source graph edges that have already been validated, so they are added
+            # directly rather than through add_edge (which re-checks the whole graph for cycles)
             for edge in new_edges:
                 new_edge = Edge(
                     source=edge.source,
                     destination=EdgeConnection(node_id=new_node.id, field=edge.destination.field),
                 )
-                self.execution_graph.add_edge(new_edge)
+                self.execution_graph.edges.append(new_edge)
+                execution_index.add_edge(new_edge)
 
+            execution_index.add_node(self, new_node.id)
             new_nodes.append(new_node.id)
 
         return new_nodes
 
+    def _get_source_index(self) -> _SourceGraphIndex:
+        """Gets the source graph scheduling index, rebuilding it if the source graph has changed"""
+        if self._source_index is None or self._source_index.is_stale(self.graph):
+            self._source_index = _SourceGraphIndex(self)
+        return self._source_index
+
+    def _get_execution_index(self) -> _ExecutionGraphIndex:
+        """Gets the execution graph scheduling index"""
+        if self._execution_index is None:
+            self._execution_index = _ExecutionGraphIndex(self)
+        return self._execution_index
+
+    def _get_source_input_edges(self, node_path: str) -> list[Edge]:
+        """Gets all input edges for a source graph node"""
+        source_index = self._get_source_index()
+        if node_path not in source_index.input_edges:
+            source_index.input_edges[node_path] = self.graph._get_input_edges(node_path)
+        return source_index.input_edges[node_path]
+
     def _iterator_graph(self) -> nx.DiGraph:
         """Gets a DiGraph with edges to collectors removed so an ancestor search produces all active iterators for any node"""
         g = self.graph.nx_graph()
@@ -961,7 +1153,10 @@ class GraphExecutionState(BaseModel):
 
     def _get_node_iterators(self, node_id: str) -> list[str]:
         """Gets iterators for a node"""
-        g = self._iterator_graph()
+        source_index = self._get_source_index()
+        if source_index.iterator_graph is None:
+            source_index.iterator_graph = self._iterator_graph()
+        g = source_index.iterator_graph
         iterators = [
             n
             for n in nx.ancestors(g, node_id)
@@ -971,19 +1166,11 @@ class GraphExecutionState(BaseModel):
 
     def _prepare(self) -> Optional[str]:
         # Get flattened source graph
-        g = self.graph.nx_graph_flat()
+        source_index = self._get_source_index()
+        g = source_index.graph
 
         # Find next unprepared node where all source nodes are executed
-        sorted_nodes = nx.topological_sort(g)
-        next_node_id = next(
-            (
-                n
-                for n in sorted_nodes
-                if n not in self.source_prepared_mapping
-                and all((e[0] in self.executed for e in g.in_edges(n)))
-            ),
-            None,
-        )
+        next_node_id = source_index.peek()
 
         if next_node_id == None:
             return None
@@ -1024,7 +1211,7 @@ class GraphExecutionState(BaseModel):
             # Select the correct prepared parents for each iteration
             # For every iterator, the parent must either not be a child of that iterator, or must match the prepared iteration for that iterator
             # TODO: Handle a node mapping to none
-            eg = self.execution_graph.nx_graph_flat()
+            eg = self.execution_graph.nx_graph_flat() if len(iterator_nodes) > 0 else None
             prepared_parent_mappings = [[(n, self._get_iteration_node(n, g, eg, it)) for n in next_node_parents] for it in iterator_node_prepared_combinations]  # type: ignore
 
             # Create execution node for each iteration
@@ -1033,6 +1220,9 @@ class GraphExecutionState(BaseModel):
                 if create_results is not None:
                     new_node_ids.extend(create_results)
 
+        if next_node_id in self.source_prepared_mapping:
+            source_index.pop()
+
         return next(iter(new_node_ids), None)
 
     def _get_iteration_node(
@@ -1049,7 +1239,7 @@ class GraphExecutionState(BaseModel):
 
         # Check if the requested node is an iterator
         prepared_iterator = next(
-            (n for n in prepared_nodes if n in prepared_iterator_nodes), None
+            (n for n in prepared_iterator_nodes if n in prepared_nodes), None
         )
         if prepared_iterator is not None:
             return prepared_iterator
@@ -1078,16 +1268,14 @@ class GraphExecutionState(BaseModel):
         )
 
     def _get_next_node(self) -> Optional[BaseInvocation]:
-        g = self.execution_graph.nx_graph()
-        sorted_nodes = nx.topological_sort(g)
-        next_node = next((n for n in sorted_nodes if n not in self.executed), None)
+        next_node = self._get_execution_index().peek(self.executed, self.executing)
         if next_node is None:
             return None
 
         return self.execution_graph.nodes[next_node]
 
     def _prepare_inputs(self, node: BaseInvocation):
-        input_edges = [e for e in self.execution_graph.edges if e.destination.node_id == node.id]
+        input_edges = self._get_execution_index().input_edges.get(node.id, [])
         if isinstance(node, CollectInvocation):
             output_collection = [
                 getattr(self.results[edge.source.node_id], edge.source.field)
@@ -1118,6 +1306,7 @@ class GraphExecutionState(BaseModel):
 
     def add_node(self, node: BaseInvocation) -> None:
         self.graph.add_node(node)
+        self._source_index = None
 
     def update_node(self, node_path: str, new_node: BaseInvocation) -> None:
         if not self._is_node_updatable(node_path):
@@ -1125,6 +1314,7 @@ class GraphExecutionState(BaseModel):
                 f"Node {node_path} has already been prepared or executed and cannot be updated"
             )
         self.graph.update_node(node_path, new_node)
+        self._source_index = None
 
     def delete_node(self, node_path: str) -> None:
         if not self._is_node_updatable(node_path):
@@ -1132,6 +1322,7 @@ class GraphExecutionState(BaseModel):
                 f"Node {node_path} has already been prepared or executed and cannot be deleted"
             )
         self.graph.delete_node(node_path)
+        self._source_index = None
 
     def add_edge(self, edge: Edge) -> None:
         if not self._is_node_updatable(edge.destination.node_id):
@@ -1139,6 +1330,7 @@ class GraphExecutionState(BaseModel):
                 f"Destination node {edge.destination.node_id} has already been prepared or executed and cannot be linked to"
             )
         self.graph.add_edge(edge)
+        self._source_index = None
 
     def delete_edge(self, edge: Edge) -> None:
         if not self._is_node_updatable(edge.destination.node_id):
@@ -1146,6 +1338,7 @@ class GraphExecutionState(BaseModel):
                 f"Destination node {edge.destination.node_id} has already been prepared or executed and cannot have a source edge deleted"
             )
         self.graph.delete_edge(edge)
+        self._source_index = None
 
 
 GraphInvocation.update_forward_refs()
@@ -0,0 +1,316 @@
+import json
+import sqlite3
+from collections import OrderedDict
+from typing import Annotated, Any, Optional, Union
+
+from pydantic import Field, parse_raw_as
+
+from .graph import (
+    Edge,
+    Graph,
+    GraphExecutionState,
+    InvocationOutputsUnion,
+    InvocationsUnion,
+)
+from .invocation_stats import InvocationStats
+from .item_codec import ItemCodec
+from .sqlite import SqliteItemStorage
+
+# Max number of sessions to remember the persisted contents of. Sessions that are forgotten
+# are written in full the next time they are set.
+MAX_TRACKED_SESSIONS = 256
+
+# Fields of graph execution states that can be listed without parsing the states
+SESSION_STATUS_FIELDS = ["executed", "executed_history", "executing", "errors"]
+
+_NodeType = Annotated[InvocationsUnion, Field(discriminator="type")]
+_OutputType = Annotated[InvocationOutputsUnion, Field(discriminator="type")]
+
+# (kind, key, value) changes to a state, in the order they were made
+_Deltas = list[tuple[str, Optional[str], Optional[str]]]
+
+
+class _PersistedSession:
+    """What has been written for a session, so changes since then can be found"""
+
+    graph: str
+    nodes: set[str]
+    edge_count: int
+    executed: set[str]
+    history_length: int
+    executing: set[str]
+    results: set[str]
+    errors: set[str]
+    stats: set[str]
+    prepared: set[str]
+    snapshot_size: int
+    delta_size: int
+
+    def __init__(self, state: GraphExecutionState, graph: str, snapshot_size: int):
+        self.update(state, graph)
+        self.snapshot_size = snapshot_size
+        self.delta_size = 0
+
+    def update(self, state: GraphExecutionState, graph: str) -> None:
+        self.graph = graph
+        self.nodes = set(state.execution_graph.nodes)
+        self.edge_count = len(state.execution_graph.edges)
+        self.executed = set(state.executed)
+        self.history_length = len(state.executed_history)
+        self.executing = set(state.executing)
+        self.results = set(state.results)
+        self.errors = set(state.errors)
+        self.stats = set(state.stats)
+        self.prepared = set(state.prepared_source_mapping)
+
+
+class SqliteGraphExecutionStorage(SqliteItemStorage[GraphExecutionState]):
+    """Stores graph execution states as a snapshot plus a log of changes made since.
+
+    Saving a whole state on every node completion writes the full execution graph and all results
+    each time, which grows quadratically with the size of iterated graphs. Instead, this appends
+    the nodes, edges, results and status changes since the last save to a deltas table, and
+    applies them to the snapshot when the state is read.
+
+    The deltas are compacted into a new snapshot once they have grown larger than the snapshot
+    (so the total written stays linear), when the session completes, or when a change can't be
+    expressed as a delta (e.g. when a stale copy of a state is saved).
+    """
+
+    _deltas_table_name: str
+    _persisted: OrderedDict[str, _PersistedSession]
+
+    def __init__(
+        self,
+        filename: str,
+        table_name: str,
+        id_field: str = "id",
+        pragmas: Optional[dict[str, Any]] = None,
+        codec: Optional[ItemCodec] = None,
+        status_fields: Optional[list[str]] = None,
+    ):
+        self._deltas_table_name = f"{table_name}_deltas"
+        self._persisted = OrderedDict()
+        super().__init__(filename, table_name, id_field, pragmas, codec, status_fields)
+
+    def _create_table(self):
+        super()._create_table()
+        with self._writing() as cursor:
+            cursor.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self._deltas_table_name} (
+                seq INTEGER PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                key TEXT,
+                value TEXT);"""
+            )
+            cursor.execute(
+                f"""CREATE INDEX IF NOT EXISTS {self._deltas_table_name}_session_id ON {self._deltas_table_name}(session_id);"""
+            )
+
+    def set(self, item: GraphExecutionState):
+        self.set_many([item])
+
+    def get(self, id: str) -> Union[GraphExecutionState, None]:
+        with self._reading() as cursor:
+            cursor.execute(
+                f"""SELECT item, codec, data FROM {self._table_name} WHERE id = ?;""",
+                (str(id),),
+            )
+            result = cursor.fetchone()
+            deltas = self._read_deltas(cursor, str(id)) if result else None
+
+        if not result:
+            return None
+
+        return self._parse_row(result, deltas)
+
+    def delete(self, id: str):
+        self.delete_many([id])
+
+    def set_many(self, items: list[GraphExecutionState]) -> None:
+        with self._writing() as cursor:
+            try:
+                for item in items:
+                    self._set(cursor, item)
+            except BaseException:
+                # The writes are rolled back, so what was persisted is no longer known
+                for item in items:
+                    self._persisted.pop(str(item.id), None)
+                raise
+        for item in items:
+            self._on_changed(item)
+
+    def delete_many(self, ids: list[str]) -> None:
+        with self._writing() as cursor:
+            for id in ids:
+                self._delete_item(cursor, str(id))
+                cursor.execute(
+                    f"""DELETE FROM {self._deltas_table_name} WHERE session_id = ?;""",
+                    (str(id),),
+                )
+                self._persisted.pop(str(id), None)
+        for id in ids:
+            self._on_deleted(id)
+
+    def compact(self, id: str) -> None:
+        """Writes a session's current state as a single snapshot, removing its deltas"""
+        state = self.get(id)
+        if state is None:
+            return
+        with self._writing() as cursor:
+            self._write_snapshot(cursor, state, state.graph.json())
+
+    def _set(self, cursor: sqlite3.Cursor, item: GraphExecutionState) -> None:
+        graph = item.graph.json()
+        persisted = self._persisted.get(str(item.id))
+        deltas = (
+            self._get_deltas(item, graph, persisted) if persisted is not None else None
+        )
+
+        if deltas is None or item.is_complete():
+            self._write_snapshot(cursor, item, graph)
+        elif len(deltas) > 0:
+            delta_size = sum(len(v or "") for _, _, v in deltas)
+            if persisted.delta_size + delta_size > persisted.snapshot_size:
+                self._write_snapshot(cursor, item, graph)
+            else:
+                cursor.executemany(
+                    f"""INSERT INTO {self._deltas_table_name} (session_id, kind, key, value) VALUES (?, ?, ?, ?);""",
+                    ((str(item.id), kind, key, value) for kind, key, value in deltas),
+                )
+                persisted.update(item, graph)
+                persisted.delta_size += delta_size
+                self._persisted.move_to_end(str(item.id))
+
+    def _write_snapshot(
+        self, cursor: sqlite3.Cursor, item: GraphExecutionState, graph: str
+    ) -> None:
+        """Writes a full state and clears its deltas"""
+        snapshot_size = self._write_item(cursor, item)
+        cursor.execute(
+            f"""DELETE FROM {self._deltas_table_name} WHERE session_id = ?;""",
+            (str(item.id),),
+        )
+
+        self._persisted[str(item.id)] = _PersistedSession(item, graph, snapshot_size)
+        self._persisted.move_to_end(str(item.id))
+        while len(self._persisted) > MAX_TRACKED_SESSIONS:
+            self._persisted.popitem(last=False)
+
+    def _get_deltas(
+        self, item: GraphExecutionState, graph: str, persisted: _PersistedSession
+    ) -> Optional[_Deltas]:
+        """Gets the changes to a state since it was persisted, or None if they can't be
+        expressed as deltas (anything was removed)"""
+        nodes = item.execution_graph.nodes
+        edges = item.execution_graph.edges
+        if (
+            not persisted.nodes.issubset(nodes)
+            or len(edges) < persisted.edge_count
+            or not persisted.executed.issubset(item.executed)
+            or len(item.executed_history) < persisted.history_length
+            or not persisted.results.issubset(item.results)
+            or not persisted.errors.issubset(item.errors)
+            or not persisted.stats.issubset(item.stats)
+            or not persisted.prepared.issubset(item.prepared_source_mapping)
+        ):
+            return None
+
+        deltas = list()
+        if graph != persisted.graph:
+            deltas.append(("graph", None, graph))
+
+        # Nodes are written again when they start executing (their inputs are set then) and
+        # when they finish (so a result or error written again after completion isn't missed)
+        started = item.executing - persisted.executing
+        finished = persisted.executing - item.executing
+        for node_id in nodes.keys() - persisted.nodes | started:
+            deltas.append(("node", node_id, nodes[node_id].json()))
+        for edge in edges[persisted.edge_count :]:
+            deltas.append(("edge", None, edge.json()))
+
+        for node_id in item.prepared_source_mapping.keys() - persisted.prepared:
+            deltas.append(("prepared", node_id, item.prepared_source_mapping[node_id]))
+        for node_id in item.results.keys() - persisted.results | (finished & item.results.keys()):
+            deltas.append(("result", node_id, item.results[node_id].json()))
+        for node_id in item.errors.keys() - persisted.errors | (finished & item.errors.keys()):
+            deltas.append(("error", node_id, item.errors[node_id]))
+        for node_id in item.stats.keys() - persisted.stats | (finished & item.stats.keys()):
+            deltas.append(("stats", node_id, item.stats[node_id].json()))
+        for node_id in item.executed - persisted.executed:
+            deltas.append(("executed", node_id, None))
+        for node_id in item.executed_history[persisted.history_length :]:
+            deltas.append(("history", node_id, None))
+
+        if started or finished:
+            deltas.append(("executing", None, json.dumps(sorted(item.executing))))
+
+        return deltas
+
+    def _get_search_filter(self, query: str) -> tuple[str, tuple]:
+        where, parameters = super()._get_search_filter(query)
+        if where == "":
+            return (where, parameters)
+
+        # Changes that haven't been compacted yet aren't indexed, so they are scanned instead
+        return (
+            f"""({where} OR id IN (SELECT session_id FROM {self._deltas_table_name} WHERE value LIKE ?))""",
+            parameters + (f"%{query}%",),
+        )
+
+    def _read_related(self, cursor: sqlite3.Cursor, ids: list[str]) -> list[_Deltas]:
+        return [self._read_deltas(cursor, id) for id in ids]
+
+    def _parse_row(self, row: tuple, related: _Deltas) -> GraphExecutionState:
+        return self._apply_deltas(self._parse_item(self._decode_row(row)), related)
+
+    def _parse_status_row(self, row: tuple, related: _Deltas) -> dict[str, Any]:
+        status = super()._parse_status_row(row, related)
+        for kind, key, value in related:
+            if kind == "executed" and status.get("executed") is not None:
+                status["executed"].append(key)
+            elif kind == "history" and status.get("executed_history") is not None:
+                status["executed_history"].append(key)
+            elif kind == "executing" and "executing" in status:
+                status["executing"] = json.loads(value)
+            elif kind == "error" and status.get("errors") is not None:
+                status["errors"][key] = value
+        return status
+
+    def _read_deltas(self, cursor: sqlite3.Cursor, id: str) -> _Deltas:
+        """Reads a session's deltas in the order they were written"""
+        cursor.execute(
+            f"""SELECT kind, key, value FROM {self._deltas_table_name} WHERE session_id = ? ORDER BY seq;""",
+            (id,),
+        )
+        return cursor.fetchall()
+
+    def _apply_deltas(
+        self,
+        state: GraphExecutionState,
+        deltas: _Deltas,
+    ) -> GraphExecutionState:
+        for kind, key, value in deltas:
+            if kind == "graph":
+                state.graph = Graph.parse_raw(value)
+            elif kind == "node":
+                state.execution_graph.nodes[key] = parse_raw_as(_NodeType, value)
+            elif kind == "edge":
+                state.execution_graph.edges.append(Edge.parse_raw(value))
+            elif kind == "prepared":
+                state.prepared_source_mapping[key] = value
+                state.source_prepared_mapping.setdefault(value, set()).add(key)
+            elif kind == "result":
+                state.results[key] = parse_raw_as(_OutputType, value)
+            elif kind == "error":
+                state.errors[key] = value
+            elif kind == "stats":
+                state.stats[key] = InvocationStats.parse_raw(value)
+            elif kind == "executed":
+                state.executed.add(key)
+            elif kind == "history":
+                state.executed_history.append(key)
+            elif kind == "executing":
+                state.executing = set(json.loads(value))
+        return state
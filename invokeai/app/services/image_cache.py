@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+from PIL.Image import Image
+
+# Bytes per pixel of decoded images of modes that don't take 4 bytes (PIL pads RGB, LA, etc. to 4)
+_BYTES_PER_PIXEL = {"1": 1, "L": 1, "P": 1, "I;16": 2, "I;16L": 2, "I;16B": 2, "I;16N": 2}
+
+
+def get_image_bytes(image: Image) -> int:
+    """Gets the bytes of memory used by the pixels of a decoded image"""
+    return image.width * image.height * _BYTES_PER_PIXEL.get(image.mode, 4)
+
+
+class ImageCache:
+    """Keeps decoded images in memory up to max_bytes, evicting the least recently used.
+
+    Images are decoded when they are added, so they are never decoded lazily by whichever thread
+    happens to use them first. Cached images are shared by everything that gets them, so they
+    mustn't be modified. Images bigger than the whole budget aren't cached.
+    """
+
+    __images: OrderedDict[str, tuple[Image, int]]
+    __max_bytes: int
+    __lock: Lock
+
+    bytes: int
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, max_bytes: int):
+        self.__images = OrderedDict()
+        self.__max_bytes = max(0, max_bytes)
+        self.__lock = Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self.__max_bytes
+
+    def __len__(self) -> int:
+        return len(self.__images)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__images
+
+    def get(self, key: str) -> Optional[Image]:
+        """Gets a cached image, or None if it isn't cached"""
+        with self.__lock:
+            entry = self.__images.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__images.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, image: Image) -> Image:
+        """Decodes an image (if it hasn't been yet) and caches it"""
+        image.load()
+        size = get_image_bytes(image)
+        with self.__lock:
+            self.__remove(key)
+            if size > self.__max_bytes:
+                return image
+
+            self.__images[key] = (image, size)
+            self.bytes += size
+            while self.bytes > self.__max_bytes:
+                self.__remove(next(iter(self.__images)))
+                self.evictions += 1
+        return image
+
+    def delete(self, key: str) -> None:
+        with self.__lock:
+            self.__remove(key)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__images.clear()
+            self.bytes = 0
+
+    def __remove(self, key: str) -> None:
+        entry = self.__images.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
@@ -0,0 +1,132 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import BinaryIO, Optional
+
+import numpy as np
+import PIL.Image
+from PIL import PngImagePlugin
+from PIL.Image import Image
+
+# The first bytes of files in each format, by which stored images are decoded
+_NPY_MAGIC = b"\x93NUMPY"
+_MEDIA_TYPES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"RIFF", "image/webp"),
+]
+
+# Modes that numpy arrays can be converted back to
+_NPY_MODES = {"1", "L", "LA", "RGB", "RGBA", "I", "F"}
+
+
+class ImageCodec(ABC):
+    """Encodes images for storage.
+
+    Every format can be told apart by its first bytes, so images are decoded by read_image()
+    whatever codec they were written with, and changing the codec used for a type of image
+    doesn't break images already stored.
+    """
+
+    name: str
+
+    @abstractmethod
+    def write(self, image: Image, file: BinaryIO) -> None:
+        pass
+
+
+class PngImageCodec(ImageCodec):
+    """Lossless, and readable by anything. Lower compress levels are much faster to encode, and
+    make bigger files."""
+
+    _compress_level: int
+
+    def __init__(self, name: str, compress_level: int):
+        self.name = name
+        self._compress_level = compress_level
+
+    def write(self, image: Image, file: BinaryIO) -> None:
+        info = PngImagePlugin.PngInfo()
+        info.add_text("Dream", "")
+        image.save(file, "PNG", pnginfo=info, compress_level=self._compress_level)
+
+
+class WebpImageCodec(ImageCodec):
+    """Much smaller than PNG, lossless or not"""
+
+    _lossless: bool
+
+    def __init__(self, name: str, lossless: bool):
+        self.name = name
+        self._lossless = lossless
+
+    def write(self, image: Image, file: BinaryIO) -> None:
+        if self._lossless:
+            image.save(file, "WEBP", lossless=True, quality=0, method=0)
+        else:
+            image.save(file, "WEBP", quality=90)
+
+
+class JpegImageCodec(ImageCodec):
+    """The smallest and fastest to encode, but lossy, and transparency is lost"""
+
+    name = "jpeg"
+
+    def write(self, image: Image, file: BinaryIO) -> None:
+        if image.mode not in ("L", "RGB", "CMYK"):
+            image = image.convert("RGB")
+        image.save(file, "JPEG", quality=95)
+
+
+class NpyImageCodec(ImageCodec):
+    """Uncompressed pixels, which are memory-mapped rather than decoded when read. Only for images
+    that aren't served, as nothing else can display them."""
+
+    name = "npy"
+
+    def write(self, image: Image, file: BinaryIO) -> None:
+        if image.mode not in _NPY_MODES:
+            image = image.convert("RGBA" if image.mode in ("P", "PA") else "RGB")
+        np.save(file, np.asarray(image), allow_pickle=False)
+
+
+_codecs = {
+    c.name: c
+    for c in [
+        PngImageCodec("png", 6),
+        PngImageCodec("png-fast", 1),
+        PngImageCodec("png-uncompressed", 0),
+        WebpImageCodec("webp-lossless", True),
+        WebpImageCodec("webp", False),
+        JpegImageCodec(),
+        NpyImageCodec(),
+    ]
+}
+
+IMAGE_CODEC_NAMES = list(_codecs)
+
+
+@lru_cache(maxsize=None)
+def get_image_codec(name: str) -> ImageCodec:
+    if name not in _codecs:
+        raise ValueError(f"Unknown image codec {name}")
+    return _codecs[name]
+
+
+def read_image(path: str) -> Image:
+    """Reads an image written by any codec, without decoding it yet (see Image.load())"""
+    with open(path, "rb") as f:
+        is_npy = f.read(len(_NPY_MAGIC)) == _NPY_MAGIC
+    if is_npy:
+        # Images of modes stored as they are in memory (e.g. L and RGBA) share the mapped pixels
+        return PIL.Image.fromarray(np.load(path, mmap_mode="r", allow_pickle=False))
+    return PIL.Image.open(path)
+
+
+def get_media_type(path: str) -> Optional[str]:
+    """Gets the media type of a stored image, or None if it can't be served as it is"""
+    with open(path, "rb") as f:
+        header = f.read(12)
+    for magic, media_type in _MEDIA_TYPES:
+        if header.startswith(magic):
+            return media_type
+    return None
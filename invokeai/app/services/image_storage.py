@@ -1,16 +1,28 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
-import datetime
+import hashlib
 import os
+import time
+import traceback
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from enum import Enum
 from pathlib import Path
-from queue import Queue
-from typing import Dict
+from threading import BoundedSemaphore, Lock
+from typing import Optional
 
 from PIL.Image import Image
 
-from invokeai.backend.image_util import PngWriter
+from .image_cache import ImageCache, get_image_bytes
+from .image_codec import ImageCodec, get_image_codec, read_image
+from .invocation_stats import timed_image_io
+
+# Bytes of decoded images kept in memory by default
+DEFAULT_IMAGE_CACHE_BYTES = 256 * 2**20
+
+# Images saved but not yet written per background writer, before save() waits for writes to finish
+PENDING_WRITES_PER_WORKER = 4
 
 
 class ImageType(str, Enum):
@@ -19,6 +31,35 @@ class ImageType(str, Enum):
     UPLOAD = "uploads"
 
 
+# Codecs images of each type are written with by default. Intermediates are only read by the next
+# nodes, so they are compressed less, which is much faster.
+DEFAULT_IMAGE_CODECS = {
+    ImageType.RESULT: "png",
+    ImageType.INTERMEDIATE: "png-fast",
+    ImageType.UPLOAD: "png",
+}
+
+
+def get_image_subpath(image_type: ImageType, image_name: str) -> str:
+    """Gets the path of an image relative to the output folder. Images of each type are spread
+    across two levels of directories, named by the start of the hash of the image name, so no
+    directory grows too big to list quickly."""
+    digest = hashlib.md5(image_name.encode()).hexdigest()
+    return os.path.join(image_type, digest[:2], digest[2:4], image_name)
+
+
+_name_lock = Lock()
+_last_name_time = 0
+
+
+def _get_name_time() -> int:
+    """Microseconds since the epoch, increasing at every call, so names are never reused"""
+    global _last_name_time
+    with _name_lock:
+        _last_name_time = max(_last_name_time + 1, time.time_ns() // 1000)
+        return _last_name_time
+
+
 class ImageStorageBase(ABC):
     """Responsible for storing and retrieving images."""
 
@@ -39,25 +80,94 @@ class ImageStorageBase(ABC):
     def delete(self, image_type: ImageType, image_name: str) -> None:
         pass
 
+    def exists(self, image_type: ImageType, image_name: str) -> bool:
+        return os.path.exists(self.get_path(image_type, image_name))
+
+    def persist(self, image_type: ImageType, image_name: str) -> None:
+        """Writes an image that is only kept in memory, if it is"""
+        pass
+
     def create_name(self, context_id: str, node_id: str) -> str:
-        return f"{context_id}_{node_id}_{str(int(datetime.datetime.now(datetime.timezone.utc).timestamp()))}.png"
+        return f"{context_id}_{node_id}_{_get_name_time()}.png"
+
+
+def _share(image: Image) -> Image:
+    """A read-only image sharing the pixels of another, which copies them if it is modified"""
+    shared = image._new(image.im)
+    shared.readonly = 1
+    return shared
+
+
+class _PendingWrite:
+    """An image being written in the background"""
+
+    image: Image
+    future: Future
+
+    def __init__(self, image: Image):
+        self.image = image
 
 
 class DiskImageStorage(ImageStorageBase):
-    """Stores images on disk"""
+    """Stores images on disk, keeping recently saved and loaded images in memory (see ImageCache).
+
+    With write workers, save() returns as soon as the image is cached, and the image is encoded and
+    written on a background thread (to a temporary file that is synced, then renamed, so the file is
+    never seen half-written). Until then, get() returns the image from memory, and get_path() and
+    delete() wait for it to be written. Saved images mustn't be modified. stop() (or flush()) waits
+    for all writes to finish; images saved after stopping are written right away.
+
+    Images are stored in shards (see get_image_subpath). Images stored before that, directly in
+    the directory of their type, can still be read until they are moved into their shards (see
+    migrate_images).
+
+    Each type of image is written with its own codec (see image_codec), keeping the name it is
+    saved with whatever the format, and get() decodes images of any format.
+
+    With intermediate_bytes, intermediate images are only kept in memory until they are persisted
+    (by persist(), get_path() or stop()), so nodes that use them get the pixels that were saved
+    without copying them. The images they get are read-only, so PIL copies the pixels before
+    modifying them in place. When intermediates take more than intermediate_bytes, the least
+    recently saved are written.
+    """
 
     __output_folder: str
-    __pngWriter: PngWriter
-    __cache_ids: Queue  # TODO: this is an incredibly naive cache
-    __cache: Dict[str, Image]
-    __max_cache_size: int
+    __codecs: dict[ImageType, ImageCodec]
+    __cache: ImageCache
+    __write_executor: Optional[ThreadPoolExecutor]
+    __write_slots: Optional[BoundedSemaphore]
+    __pending_writes: dict[str, _PendingWrite]
+    __write_lock: Lock
+    __intermediates: OrderedDict[str, tuple[Image, int]]
+    __intermediate_bytes: int
+    __max_intermediate_bytes: int
 
-    def __init__(self, output_folder: str):
+    def __init__(
+        self,
+        output_folder: str,
+        cache_bytes: int = DEFAULT_IMAGE_CACHE_BYTES,
+        write_workers: int = 0,
+        codecs: Optional[dict[ImageType, str]] = None,
+        intermediate_bytes: int = 0,
+    ):
         self.__output_folder = output_folder
-        self.__pngWriter = PngWriter(output_folder)
-        self.__cache = dict()
-        self.__cache_ids = Queue()
-        self.__max_cache_size = 10  # TODO: get this from config
+        self.__codecs = {
+            image_type: get_image_codec(name)
+            for image_type, name in {**DEFAULT_IMAGE_CODECS, **(codecs or dict())}.items()
+        }
+        self.__cache = ImageCache(cache_bytes)
+        self.__write_executor = None
+        self.__write_slots = None
+        if write_workers > 0:
+            self.__write_executor = ThreadPoolExecutor(
+                max_workers=write_workers, thread_name_prefix="image_writer"
+            )
+            self.__write_slots = BoundedSemaphore(write_workers * PENDING_WRITES_PER_WORKER)
+        self.__pending_writes = dict()
+        self.__write_lock = Lock()
+        self.__intermediates = OrderedDict()
+        self.__intermediate_bytes = 0
+        self.__max_intermediate_bytes = max(0, intermediate_bytes)
 
         Path(output_folder).mkdir(parents=True, exist_ok=True)
 
@@ -67,47 +177,219 @@ class DiskImageStorage(ImageStorageBase):
                 parents=True, exist_ok=True
             )
 
+    @property
+    def cache(self) -> ImageCache:
+        return self.__cache
+
     def get(self, image_type: ImageType, image_name: str) -> Image:
-        image_path = self.get_path(image_type, image_name)
-        cache_item = self.__get_cache(image_path)
-        if cache_item:
-            return cache_item
+        image_path = self.__get_image_path(image_type, image_name)
+        with self.__write_lock:
+            intermediate = self.__intermediates.get(image_path)
+        if intermediate is not None:
+            return _share(intermediate[0])
 
-        image = Image.open(image_path)
-        self.__set_cache(image_path, image)
-        return image
+        image = self.__cache.get(image_path)
+        if image is not None:
+            return image
+
+        # Not written yet, and evicted from the cache
+        with self.__write_lock:
+            pending = self.__pending_writes.get(image_path)
+        if pending is not None:
+            return pending.image
+
+        # Decoded here, rather than by whichever thread uses it first
+        with timed_image_io():
+            image = read_image(self.__find_on_disk(image_type, image_name, image_path))
+            image.load()
+        return self.__cache.put(image_path, image)
 
     # TODO: make this a bit more flexible for e.g. cloud storage
     def get_path(self, image_type: ImageType, image_name: str) -> str:
-        path = os.path.join(self.__output_folder, image_type, image_name)
-        return path
+        """Gets the path of an image, writing it if it is only in memory, or waiting for it to be
+        written if it is being written"""
+        self.persist(image_type, image_name)
+        path = self.__get_image_path(image_type, image_name)
+        self.__wait_for_write(path)
+        return self.__find_on_disk(image_type, image_name, path)
+
+    def exists(self, image_type: ImageType, image_name: str) -> bool:
+        path = self.__get_image_path(image_type, image_name)
+        with self.__write_lock:
+            if path in self.__intermediates or path in self.__pending_writes:
+                return True
+        return os.path.exists(self.__find_on_disk(image_type, image_name, path))
 
     def save(self, image_type: ImageType, image_name: str, image: Image) -> None:
-        image_subpath = os.path.join(image_type, image_name)
-        self.__pngWriter.save_image_and_prompt_to_png(
-            image, "", image_subpath, None
-        )  # TODO: just pass full path to png writer
+        image_path = self.__get_image_path(image_type, image_name)
+        codec = self.__codecs[image_type]
+        if image_type == ImageType.INTERMEDIATE and self.__keep_intermediate(image_path, image):
+            return
+
+        with self.__write_lock:
+            self.__remove_intermediate(image_path)
+        self.__write(image_path, codec, image)
 
-        image_path = self.get_path(image_type, image_name)
-        self.__set_cache(image_path, image)
+    def persist(self, image_type: ImageType, image_name: str) -> None:
+        image_path = self.__get_image_path(image_type, image_name)
+        with self.__write_lock:
+            image = self.__remove_intermediate(image_path)
+        if image is not None:
+            self.__write(image_path, self.__codecs[image_type], image)
 
     def delete(self, image_type: ImageType, image_name: str) -> None:
-        image_path = self.get_path(image_type, image_name)
-        if os.path.exists(image_path):
-            os.remove(image_path)
-
-        if image_path in self.__cache:
-            del self.__cache[image_path]
-
-    def __get_cache(self, image_name: str) -> Image:
-        return None if image_name not in self.__cache else self.__cache[image_name]
-
-    def __set_cache(self, image_name: str, image: Image):
-        if not image_name in self.__cache:
-            self.__cache[image_name] = image
-            self.__cache_ids.put(
-                image_name
-            )  # TODO: this should refresh position for LRU cache
-            if len(self.__cache) > self.__max_cache_size:
-                cache_id = self.__cache_ids.get()
-                del self.__cache[cache_id]
+        image_path = self.__get_image_path(image_type, image_name)
+        with self.__write_lock:
+            self.__remove_intermediate(image_path)
+        stored_path = self.get_path(image_type, image_name)
+        if os.path.exists(stored_path):
+            os.remove(stored_path)
+
+        self.__cache.delete(image_path)
+
+    def flush(self) -> None:
+        """Waits for the images being written in the background to be written"""
+        with self.__write_lock:
+            futures = [p.future for p in self.__pending_writes.values()]
+        wait(futures)
+
+    def stop(self, *args, **kwargs) -> None:
+        """Writes the images only kept in memory and being written in the background, and stops
+        the writers"""
+        with self.__write_lock:
+            intermediates = [(p, self.__remove_intermediate(p)) for p in list(self.__intermediates)]
+        for path, image in intermediates:
+            self.__write(path, self.__codecs[ImageType.INTERMEDIATE], image)
+
+        with self.__write_lock:
+            executor, self.__write_executor = self.__write_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def __keep_intermediate(self, image_path: str, image: Image) -> bool:
+        """Keeps an intermediate image in memory, writing the least recently saved ones over the
+        budget. Returns False if the image doesn't fit."""
+        if self.__max_intermediate_bytes == 0:
+            return False
+        image.load()
+        size = get_image_bytes(image)
+        if size > self.__max_intermediate_bytes:
+            return False
+
+        self.__cache.delete(image_path)
+        spilled = list()
+        with self.__write_lock:
+            self.__remove_intermediate(image_path)
+            self.__intermediates[image_path] = (image, size)
+            self.__intermediate_bytes += size
+            while self.__intermediate_bytes > self.__max_intermediate_bytes:
+                path = next(iter(self.__intermediates))
+                spilled.append((path, self.__remove_intermediate(path)))
+
+        for path, spilled_image in spilled:
+            self.__write(path, self.__codecs[ImageType.INTERMEDIATE], spilled_image)
+        return True
+
+    def __get_image_path(self, image_type: ImageType, image_name: str) -> str:
+        return os.path.join(self.__output_folder, get_image_subpath(image_type, image_name))
+
+    def __find_on_disk(self, image_type: ImageType, image_name: str, image_path: str) -> str:
+        """Gets the path an image was stored at before images were sharded, if it hasn't been
+        moved into its shard"""
+        if not os.path.exists(image_path):
+            unsharded_path = os.path.join(self.__output_folder, image_type, image_name)
+            if os.path.exists(unsharded_path):
+                return unsharded_path
+        return image_path
+
+    def __remove_intermediate(self, image_path: str) -> Optional[Image]:
+        entry = self.__intermediates.pop(image_path, None)
+        if entry is None:
+            return None
+        self.__intermediate_bytes -= entry[1]
+        return entry[0]
+
+    def __write(self, image_path: str, codec: ImageCodec, image: Image) -> None:
+        """Writes an image, in the background if there are write workers"""
+        self.__cache.put(image_path, image)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+
+        if self.__write_slots is not None:
+            # Waits for earlier writes when too many images are waiting to be written
+            self.__write_slots.acquire()
+            with self.__write_lock:
+                if self.__write_executor is not None:
+                    pending = _PendingWrite(image)
+                    previous = self.__pending_writes.get(image_path)
+                    pending.future = self.__write_executor.submit(
+                        self.__write_behind, image_path, codec, pending, previous
+                    )
+                    self.__pending_writes[image_path] = pending
+                    return
+            self.__write_slots.release()
+
+        with timed_image_io():
+            with open(image_path, "wb") as f:
+                codec.write(image, f)
+
+    def __wait_for_write(self, image_path: str) -> None:
+        with self.__write_lock:
+            pending = self.__pending_writes.get(image_path)
+        if pending is not None:
+            wait([pending.future])
+
+    def __write_behind(
+        self,
+        image_path: str,
+        codec: ImageCodec,
+        pending: _PendingWrite,
+        previous: Optional[_PendingWrite],
+    ) -> None:
+        temp_path = f"{image_path}.{id(pending)}.tmp"
+        try:
+            # An earlier image saved with the same name mustn't be written over this one
+            if previous is not None:
+                wait([previous.future])
+
+            with open(temp_path, "wb") as f:
+                codec.write(pending.image, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, image_path)
+
+        except Exception:
+            # The image is still cached, but may be lost once it is evicted
+            print(f">> Failed to write image {image_path}")
+            traceback.print_exc()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        finally:
+            with self.__write_lock:
+                if self.__pending_writes.get(image_path) is pending:
+                    del self.__pending_writes[image_path]
+            self.__write_slots.release()
+
+
+def migrate_images(output_folder: str) -> tuple[int, int]:
+    """Moves images stored directly in the directory of their type into their shards. Returns the
+    number of images moved, and the number left where they are because an image with the same name
+    is already in its shard."""
+    moved = 0
+    skipped = 0
+    for image_type in ImageType:
+        type_folder = os.path.join(output_folder, image_type)
+        if not os.path.isdir(type_folder):
+            continue
+
+        for entry in os.scandir(type_folder):
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+            image_path = os.path.join(output_folder, get_image_subpath(image_type, entry.name))
+            if os.path.exists(image_path):
+                skipped += 1
+                continue
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            os.replace(entry.path, image_path)
+            moved += 1
+    return (moved, skipped)
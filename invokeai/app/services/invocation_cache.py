@@ -0,0 +1,136 @@
+import hashlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from ..invocations.baseinvocation import BaseInvocation, BaseInvocationOutput
+from ..invocations.image import ImageField
+from .invocation_services import InvocationServices
+
+
+def get_output_images(value: Any) -> list[ImageField]:
+    """Gets all images referenced by an invocation output (or any value inside of one)"""
+    if isinstance(value, ImageField):
+        return [value]
+    if isinstance(value, BaseModel):
+        return [i for v in value.__dict__.values() for i in get_output_images(v)]
+    if isinstance(value, (list, tuple, set)):
+        return [i for v in value for i in get_output_images(v)]
+    if isinstance(value, dict):
+        return [i for v in value.values() for i in get_output_images(v)]
+    return []
+
+
+class InvocationCacheBase(ABC):
+    """Stores invocation outputs, keyed on everything that determines them"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[BaseInvocationOutput]:
+        """Gets the output stored for a key, or None if there is none"""
+        pass
+
+    @abstractmethod
+    def save(self, key: str, output: BaseInvocationOutput) -> None:
+        """Stores the output for a key"""
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+    def create_key(
+        self, invocation: BaseInvocation, services: InvocationServices
+    ) -> Optional[str]:
+        """Creates a key from an invocation's type and resolved inputs (so this must be called after its
+        inputs are set from its edges), or returns None if the invocation's output can't be cached.
+        Invocations with a random seed (-1) are never cached.
+        """
+        if not invocation.cacheable or getattr(invocation, "seed", None) == -1:
+            return None
+
+        key_data = invocation.json(exclude={"id"}, sort_keys=True)
+
+        # Outputs of invocations that run a model also depend on the model
+        if "model" in invocation.__fields__:
+            model_manager = services.model_manager
+            model_name = (
+                getattr(invocation, "model")
+                or model_manager.current_model
+                or model_manager.default_model()
+            )
+            if model_name not in model_manager.models:
+                return None  # The model hash isn't known until it is loaded
+            key_data += f"|{model_name}|{model_manager.models[model_name]['hash']}"
+
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+class MemoryInvocationCache(InvocationCacheBase):
+    """Keeps up to max_size invocation outputs in memory, evicting the least recently used"""
+
+    __cache: OrderedDict[str, tuple[BaseInvocationOutput, list[ImageField]]]
+    __max_size: int
+    __lock: Lock
+    __services: Optional[InvocationServices]
+
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int = 512):
+        self.__cache = OrderedDict()
+        self.__max_size = max_size
+        self.__lock = Lock()
+        self.__services = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, invoker) -> None:
+        self.__services = invoker.services
+
+    def get(self, key: str) -> Optional[BaseInvocationOutput]:
+        with self.__lock:
+            entry = self.__cache.get(key)
+            if entry is not None:
+                self.__cache.move_to_end(key)
+
+        if entry is not None and not self.__images_exist(entry[1]):
+            self.delete(key)
+            entry = None
+
+        with self.__lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        # Callers may modify the output, so don't hand out the stored one
+        return entry[0].copy(deep=True)
+
+    def save(self, key: str, output: BaseInvocationOutput) -> None:
+        entry = (output.copy(deep=True), get_output_images(output))
+        with self.__lock:
+            self.__cache[key] = entry
+            self.__cache.move_to_end(key)
+            while len(self.__cache) > self.__max_size:
+                self.__cache.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self.__lock:
+            self.__cache.pop(key, None)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__cache.clear()
+
+    def __images_exist(self, images: list[ImageField]) -> bool:
+        """Checks that images referenced by a cached output haven't been deleted"""
+        if self.__services is None or self.__services.images is None:
+            return True
+        return all(self.__services.images.exists(i.image_type, i.image_name) for i in images)
@@ -1,81 +1,671 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
-from abc import ABC, abstractmethod
-from queue import Queue
+import heapq
+import sqlite3
 import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field
+
+from .cancellation import CANCELLATION_TTL, CancellationSet
+from .sqlite import get_pragmas, sqlite_connect
+
+# Seconds between checks for items added (or leases expired) by other processes
+QUEUE_POLL_INTERVAL = 1.0
+
+# Interactive invocations (single steps) are handed out before bulk (invoke all) ones
+INTERACTIVE_PRIORITY = 1
+BULK_PRIORITY = 0
+
+# Number of recently handed out items that wait times are reported for
+RECENT_WAIT_COUNT = 100
+
+
+class InvocationQueueItem(BaseModel):
+    id: str = Field(description="The id of the queue item", default_factory=lambda: uuid.uuid4().hex)
+    graph_execution_state_id: str = Field(description="The id of the execution state to invoke")
+    invocation_id: str = Field(description="The id of the prepared node to invoke")
+    invoke_all: bool = Field(default=False, description="Whether to invoke the rest of the graph once done")
+    timestamp: float = Field(description="When the item was created", default_factory=time.time)
+    priority: int = Field(default=BULK_PRIORITY, description="Items with higher priorities are handed out first")
+    owner: Optional[str] = Field(default=None, description="Who the item is queued for, to share turns between fairly (the execution state by default)")
+    batch_key: Optional[str] = Field(default=None, description="Items with the same batch key can be invoked together (see BaseInvocation.get_batch_key)")
+    uses_gpu: bool = Field(default=False, description="Whether the invocation runs on the GPU (see BaseInvocation.uses_gpu)")
+
+    @property
+    def fair_share_key(self) -> str:
+        return self.owner or self.graph_execution_state_id
+
+
+class InvocationQueueStats(BaseModel):
+    depth: int = Field(description="The number of items waiting")
+    depth_by_priority: dict[int, int] = Field(description="The number of items waiting at each priority")
+    oldest_wait: float = Field(description="Seconds the longest waiting item has waited")
+    recent_wait_mean: float = Field(description="Mean seconds recently handed out items waited")
+    recent_wait_max: float = Field(description="Max seconds recently handed out items waited")
+
 
+class FairShare:
+    """Weighted fair queuing across keys (owners or sessions).
 
-# TODO: make this serializable
-class InvocationQueueItem:
-    # session_id: str
-    graph_execution_state_id: str
-    invocation_id: str
-    invoke_all: bool
-    timestamp: float
+    Each item is given a virtual finish time when it is queued: one turn (divided by its key's
+    weight) after the later of the current virtual time and the finish time of the key's previous
+    item. Handing items out in order of finish time takes turns between the keys with items
+    waiting, so a key that queues many items at once doesn't hold up keys that queue a few.
+    """
+
+    __weights: dict[str, float]
+    __finish_times: dict[str, float]
+    __virtual_time: float
 
     def __init__(
         self,
-        # session_id: str,
-        graph_execution_state_id: str,
-        invocation_id: str,
-        invoke_all: bool = False,
+        weights: Optional[dict[str, float]] = None,
+        finish_times: Optional[dict[str, float]] = None,
+        virtual_time: float = 0.0,
     ):
-        # self.session_id = session_id
-        self.graph_execution_state_id = graph_execution_state_id
-        self.invocation_id = invocation_id
-        self.invoke_all = invoke_all
-        self.timestamp = time.time()
+        self.__weights = weights or dict()
+        self.__finish_times = finish_times or dict()
+        self.__virtual_time = virtual_time
+
+    def get_finish_time(self, key: str) -> float:
+        """Gets the finish time of an item being queued for a key"""
+        start = max(self.__virtual_time, self.__finish_times.get(key, 0.0))
+        finish = start + 1.0 / self.__weights.get(key, 1.0)
+        self.__finish_times[key] = finish
+        return finish
+
+    def take(self, finish_time: float) -> None:
+        """Advances the virtual time when an item is handed out"""
+        self.__virtual_time = max(self.__virtual_time, finish_time)
+
+        # Keys with nothing left waiting start again from the virtual time
+        self.__finish_times = {
+            k: v for k, v in self.__finish_times.items() if v > self.__virtual_time
+        }
+
+
+class _WaitTimes:
+    """The times that recently handed out items waited"""
+
+    __waits: deque[float]
+
+    def __init__(self):
+        self.__waits = deque(maxlen=RECENT_WAIT_COUNT)
+
+    def add(self, item: InvocationQueueItem) -> None:
+        self.__waits.append(max(0.0, time.time() - item.timestamp))
+
+    def get_stats(self, items: list[InvocationQueueItem]) -> InvocationQueueStats:
+        """Gets stats for the given waiting items"""
+        depth_by_priority = dict()
+        for item in items:
+            depth_by_priority[item.priority] = depth_by_priority.get(item.priority, 0) + 1
+        waits = list(self.__waits)
+        return InvocationQueueStats(
+            depth=len(items),
+            depth_by_priority=depth_by_priority,
+            oldest_wait=max((time.time() - min(i.timestamp for i in items)) if items else 0.0, 0.0),
+            recent_wait_mean=sum(waits) / len(waits) if waits else 0.0,
+            recent_wait_max=max(waits, default=0.0),
+        )
+
+
+class _PendingItems:
+    """Items waiting in a queue, in order of their sort keys (then the order they were added).
+
+    GPU and CPU items are kept in separate heaps, so the first item of either can be taken.
+    Items are indexed by session and by batch key, so a session's items can be removed (or a
+    batch's items taken) without searching the queue. Removed items are marked as removed and
+    skipped when they reach the front.
+    """
+
+    __heaps: dict[bool, list[list]]
+    __by_session: dict[str, dict[str, list]]
+    __by_batch_key: dict[str, dict[str, list]]
+    __count: int
+    __seq: int
+
+    def __init__(self):
+        self.__heaps = {True: list(), False: list()}
+        self.__by_session = dict()
+        self.__by_batch_key = dict()
+        self.__count = 0
+        self.__seq = 0
+
+    def push(self, key: tuple, item: InvocationQueueItem) -> None:
+        entry = [key, self.__seq, item]
+        self.__seq += 1
+        heapq.heappush(self.__heaps[item.uses_gpu], entry)
+        self.__by_session.setdefault(item.graph_execution_state_id, dict())[item.id] = entry
+        if item.batch_key is not None:
+            self.__by_batch_key.setdefault(item.batch_key, dict())[item.id] = entry
+        self.__count += 1
+
+    def pop(self, uses_gpu: Optional[bool] = None) -> Optional[tuple[tuple, InvocationQueueItem]]:
+        """Removes and returns the first (key, item), or None if there are none. If uses_gpu is
+        given, only items that do (or don't) use the GPU are taken."""
+        heaps = list(self.__heaps.values()) if uses_gpu is None else [self.__heaps[uses_gpu]]
+        for heap in heaps:
+            while len(heap) > 0 and heap[0][2] is None:
+                heapq.heappop(heap)
+
+        heaps = [heap for heap in heaps if len(heap) > 0]
+        if len(heaps) == 0:
+            return None
+        key, _, item = heapq.heappop(min(heaps, key=lambda h: h[0][:2]))
+        self.__forget(item)
+        return (key, item)
+
+    def pop_batch(self, batch_key: str, max_count: int) -> list[tuple[tuple, InvocationQueueItem]]:
+        """Removes and returns the first (key, item)s with a batch key, up to max_count of them"""
+        entries = sorted(
+            self.__by_batch_key.get(batch_key, dict()).values(), key=lambda e: e[:2]
+        )[:max_count]
+        taken = list()
+        for entry in entries:
+            key, _, item = entry
+            self.__forget(item)
+            entry[2] = None
+            taken.append((key, item))
+        return taken
+
+    def remove_session(self, graph_execution_state_id: str) -> int:
+        """Removes all of a session's items, returning how many were removed"""
+        entries = self.__by_session.pop(graph_execution_state_id, dict())
+        for entry in entries.values():
+            self.__forget_batch_key(entry[2])
+            entry[2] = None
+        self.__count -= len(entries)
+        return len(entries)
+
+    def items(self) -> list[InvocationQueueItem]:
+        return [
+            entry[2] for heap in self.__heaps.values() for entry in heap if entry[2] is not None
+        ]
+
+    def sessions(self) -> set[str]:
+        return set(self.__by_session)
+
+    def __forget(self, item: InvocationQueueItem) -> None:
+        entries = self.__by_session[item.graph_execution_state_id]
+        del entries[item.id]
+        if len(entries) == 0:
+            del self.__by_session[item.graph_execution_state_id]
+        self.__forget_batch_key(item)
+        self.__count -= 1
+
+    def __forget_batch_key(self, item: InvocationQueueItem) -> None:
+        if item.batch_key is None:
+            return
+        entries = self.__by_batch_key[item.batch_key]
+        del entries[item.id]
+        if len(entries) == 0:
+            del self.__by_batch_key[item.batch_key]
+
+    def __len__(self) -> int:
+        return self.__count
 
 
 class InvocationQueueABC(ABC):
     """Abstract base class for all invocation queues"""
 
     @abstractmethod
-    def get(self) -> InvocationQueueItem:
+    def get(
+        self, uses_gpu: Optional[bool] = None, timeout: Optional[float] = None
+    ) -> InvocationQueueItem | None:
+        """Takes the next item, waiting for one to be queued. If uses_gpu is given, only items
+        that do (or don't) use the GPU are taken. Returns None if woken up by put(None), or if no
+        item was queued within timeout seconds."""
         pass
 
     @abstractmethod
     def put(self, item: InvocationQueueItem | None) -> None:
+        """Queues an item, or wakes up one get() with None. Queuing an item for a canceled
+        session clears the cancellation (the session is being invoked again)."""
         pass
 
     @abstractmethod
     def cancel(self, graph_execution_state_id: str) -> None:
+        """Cancels a session, removing any of its items that are waiting"""
         pass
 
     @abstractmethod
     def is_canceled(self, graph_execution_state_id: str) -> bool:
+        """Whether a session was canceled (and hasn't been invoked again or expired since)"""
+        pass
+
+    @abstractmethod
+    def get_stats(self) -> InvocationQueueStats:
+        pass
+
+    @abstractmethod
+    def get_queued_sessions(self) -> set[str]:
+        """The sessions with items waiting, or (for queues that survive restarts) being processed"""
+        pass
+
+    def get_batch(self, batch_key: str, max_count: int) -> list[InvocationQueueItem]:
+        """Takes up to max_count waiting items with a batch key, in the order they would be gotten,
+        without waiting for more to be queued. Items taken must be completed like gotten ones.
+        Queues that can't find items by batch key return none."""
+        return []
+
+    def complete(self, item: InvocationQueueItem) -> None:
+        """Called when an item that was gotten has been processed (whether or not it succeeded)"""
         pass
 
 
 class MemoryInvocationQueue(InvocationQueueABC):
-    __queue: Queue
-    __cancellations: dict[str, float]
+    """Hands out items in the order they were queued"""
+
+    __lock: Lock
+    __available: Condition
+    __pending: _PendingItems
+    __wakeups: int
+    __cancellations: CancellationSet
+    __wait_times: _WaitTimes
 
     def __init__(self):
-        self.__queue = Queue()
-        self.__cancellations = dict()
+        self.__lock = Lock()
+        self.__available = Condition(self.__lock)
+        self.__pending = _PendingItems()
+        self.__wakeups = 0
+        self.__cancellations = CancellationSet()
+        self.__wait_times = _WaitTimes()
+
+    def _get_sort_key(self, item: InvocationQueueItem) -> tuple:
+        """Gets the key that items are handed out in order of"""
+        return ()
 
-    def get(self) -> InvocationQueueItem:
-        item = self.__queue.get()
+    def _on_taken(self, key: tuple) -> None:
+        """Called (with the lock held) when an item is handed out"""
+        pass
+
+    def get(
+        self, uses_gpu: Optional[bool] = None, timeout: Optional[float] = None
+    ) -> InvocationQueueItem | None:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.__available:
+            while True:
+                # Each None that was put wakes up one get()
+                if self.__wakeups > 0:
+                    self.__wakeups -= 1
+                    return None
 
-        while isinstance(item, InvocationQueueItem) \
-            and item.graph_execution_state_id in self.__cancellations \
-            and self.__cancellations[item.graph_execution_state_id] > item.timestamp:
-            item = self.__queue.get()
+                taken = self.__pending.pop(uses_gpu)
+                if taken is None:
+                    if deadline is None:
+                        self.__available.wait()
+                    elif not self.__available.wait(max(0.0, deadline - time.monotonic())):
+                        return None
+                    continue
 
-        # Clear old items
-        for graph_execution_state_id in list(self.__cancellations.keys()):
-            if self.__cancellations[graph_execution_state_id] < item.timestamp:
-                del self.__cancellations[graph_execution_state_id]
+                key, item = taken
+                self._on_taken(key)
+                self.__wait_times.add(item)
+                return item
 
-        return item
+    def get_batch(self, batch_key: str, max_count: int) -> list[InvocationQueueItem]:
+        with self.__lock:
+            taken = self.__pending.pop_batch(batch_key, max_count)
+            for key, item in taken:
+                self._on_taken(key)
+                self.__wait_times.add(item)
+        return [item for _, item in taken]
 
     def put(self, item: InvocationQueueItem | None) -> None:
-        self.__queue.put(item)
+        with self.__available:
+            if item is None:
+                self.__wakeups += 1
+            else:
+                self.__cancellations.discard(item.graph_execution_state_id)
+                self.__pending.push(self._get_sort_key(item), item)
+            self.__available.notify()
 
     def cancel(self, graph_execution_state_id: str) -> None:
-        if graph_execution_state_id not in self.__cancellations:
-            self.__cancellations[graph_execution_state_id] = time.time()
+        with self.__lock:
+            self.__cancellations.add(graph_execution_state_id)
+            self.__pending.remove_session(graph_execution_state_id)
 
     def is_canceled(self, graph_execution_state_id: str) -> bool:
         return graph_execution_state_id in self.__cancellations
+
+    def get_stats(self) -> InvocationQueueStats:
+        with self.__lock:
+            items = self.__pending.items()
+        return self.__wait_times.get_stats(items)
+
+    def get_queued_sessions(self) -> set[str]:
+        with self.__lock:
+            return self.__pending.sessions()
+
+
+class FairInvocationQueue(MemoryInvocationQueue):
+    """Hands out items by priority, and shares turns fairly between owners (or sessions) of the
+    same priority (see FairShare). Owners can be given weights, to get more turns than others."""
+
+    __fair_share: FairShare
+
+    def __init__(self, weights: Optional[dict[str, float]] = None):
+        super().__init__()
+        self.__fair_share = FairShare(weights)
+
+    def _get_sort_key(self, item: InvocationQueueItem) -> tuple:
+        return (-item.priority, self.__fair_share.get_finish_time(item.fair_share_key))
+
+    def _on_taken(self, key: tuple) -> None:
+        self.__fair_share.take(key[1])
+
+
+class SqliteInvocationQueue(InvocationQueueABC):
+    """Stores queued invocations in a SQLite table, so they survive restarts.
+
+    Items are leased rather than removed when they are gotten, and are removed once they are
+    completed. Leases are renewed while items are processed, and expire visibility_timeout seconds
+    after the process holding them stops renewing them (e.g. because it died), after which the
+    items are handed out again. Leases still held when the queue is stopped are released, so their
+    items are handed out again as soon as the queue is started.
+
+    Items are handed out by priority, and shared fairly between owners (see FairShare).
+    Cancellations are stored as well, so canceled sessions stay canceled across restarts.
+    """
+
+    __table_name: str
+    __cancellations_table_name: str
+    __visibility_timeout: float
+    __conn: sqlite3.Connection
+    __cursor: sqlite3.Cursor
+    __lock: Lock
+    __available: Condition
+    __wakeups: int
+    __leased: dict[str, InvocationQueueItem]
+    __cancellations: CancellationSet
+    __fair_share: FairShare
+    __wait_times: _WaitTimes
+    __stop_event: Event
+    __renew_thread: Optional[Thread]
+
+    def __init__(
+        self,
+        filename: str,
+        table_name: str = "invocation_queue",
+        visibility_timeout: float = 30.0,
+        pragmas: Optional[dict[str, Any]] = None,
+        weights: Optional[dict[str, float]] = None,
+    ):
+        self.__table_name = table_name
+        self.__cancellations_table_name = f"{table_name}_cancellations"
+        self.__visibility_timeout = visibility_timeout
+        self.__conn = sqlite_connect(filename, get_pragmas(pragmas))
+        self.__cursor = self.__conn.cursor()
+        self.__lock = Lock()
+        self.__available = Condition(self.__lock)
+        self.__wakeups = 0
+        self.__leased = dict()
+        self.__wait_times = _WaitTimes()
+        self.__stop_event = Event()
+        self.__renew_thread = None
+
+        with self.__lock:
+            self.__create_tables()
+            self.__cancellations = self.__read_cancellations()
+            self.__fair_share = self.__read_fair_share(weights)
+
+    def __create_tables(self) -> None:
+        self.__cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self.__table_name} (
+            seq INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            graph_execution_state_id TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            priority INTEGER NOT NULL,
+            fair_share_key TEXT NOT NULL,
+            finish_time REAL NOT NULL,
+            lease_expires REAL,
+            batch_key TEXT,
+            uses_gpu INTEGER NOT NULL DEFAULT 0,
+            item TEXT NOT NULL);"""
+        )
+
+        # Tables created before items had batch keys, or were split by whether they use the GPU
+        self.__cursor.execute(f"""PRAGMA table_info({self.__table_name});""")
+        columns = [row[1] for row in self.__cursor.fetchall()]
+        if "batch_key" not in columns:
+            self.__cursor.execute(
+                f"""ALTER TABLE {self.__table_name} ADD COLUMN batch_key TEXT;"""
+            )
+        if "uses_gpu" not in columns:
+            self.__cursor.execute(
+                f"""ALTER TABLE {self.__table_name} ADD COLUMN uses_gpu INTEGER NOT NULL DEFAULT 0;"""
+            )
+
+        self.__cursor.execute(
+            f"""CREATE INDEX IF NOT EXISTS {self.__table_name}_graph_execution_state_id ON {self.__table_name}(graph_execution_state_id);"""
+        )
+        self.__cursor.execute(
+            f"""CREATE INDEX IF NOT EXISTS {self.__table_name}_batch_key ON {self.__table_name}(batch_key) WHERE batch_key IS NOT NULL;"""
+        )
+        self.__cursor.execute(
+            f"""CREATE INDEX IF NOT EXISTS {self.__table_name}_order ON {self.__table_name}(priority DESC, finish_time, seq);"""
+        )
+        self.__cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self.__cancellations_table_name} (
+            graph_execution_state_id TEXT PRIMARY KEY,
+            timestamp REAL NOT NULL);"""
+        )
+        self.__conn.commit()
+
+    def __read_cancellations(self) -> CancellationSet:
+        self.__cursor.execute(
+            f"""DELETE FROM {self.__cancellations_table_name} WHERE timestamp < ?;""",
+            (time.time() - CANCELLATION_TTL,),
+        )
+        self.__conn.commit()
+        self.__cursor.execute(
+            f"""SELECT graph_execution_state_id, timestamp FROM {self.__cancellations_table_name} ORDER BY timestamp;"""
+        )
+        cancellations = CancellationSet()
+        for graph_execution_state_id, timestamp in self.__cursor.fetchall():
+            cancellations.add(graph_execution_state_id, timestamp)
+        return cancellations
+
+    def __read_fair_share(self, weights: Optional[dict[str, float]]) -> FairShare:
+        """Continues fair sharing from the finish times of the items that are still queued"""
+        self.__cursor.execute(
+            f"""SELECT fair_share_key, max(finish_time) FROM {self.__table_name} GROUP BY fair_share_key;"""
+        )
+        finish_times = dict(self.__cursor.fetchall())
+        self.__cursor.execute(f"""SELECT min(finish_time) FROM {self.__table_name};""")
+        virtual_time = self.__cursor.fetchone()[0] or 0.0
+        return FairShare(weights, finish_times, virtual_time)
+
+    def start(self, invoker) -> None:
+        # The invoker may start services more than once
+        if self.__renew_thread is not None:
+            return
+        self.__stop_event.clear()
+        self.__renew_thread = Thread(
+            name="invocation_queue_leases", target=self.__renew_leases, daemon=True
+        )
+        self.__renew_thread.start()
+
+    def stop(self, *args, **kwargs) -> None:
+        if self.__renew_thread is None:
+            return
+        self.__stop_event.set()
+        self.__renew_thread.join()
+        self.__renew_thread = None
+
+        # Items that weren't completed are handed out again when the queue is next started
+        with self.__lock:
+            self.__cursor.executemany(
+                f"""UPDATE {self.__table_name} SET lease_expires = NULL WHERE id = ?;""",
+                [(id,) for id in self.__leased],
+            )
+            self.__conn.commit()
+            self.__leased.clear()
+
+    def __renew_leases(self) -> None:
+        while not self.__stop_event.wait(self.__visibility_timeout / 3):
+            with self.__lock:
+                self.__cursor.executemany(
+                    f"""UPDATE {self.__table_name} SET lease_expires = ? WHERE id = ?;""",
+                    [(time.time() + self.__visibility_timeout, id) for id in self.__leased],
+                )
+                self.__conn.commit()
+
+                # Pick up sessions canceled by other processes
+                self.__cancellations = self.__read_cancellations()
+
+    def __lease(
+        self, max_count: int, batch_key: Optional[str] = None, uses_gpu: Optional[bool] = None
+    ) -> list[InvocationQueueItem]:
+        """Leases up to max_count items that aren't leased, in order (only items with the batch
+        key, and that do or don't use the GPU, if given). The lock must be held."""
+        conditions = ""
+        params = []
+        if batch_key is not None:
+            conditions += " AND batch_key = ?"
+            params.append(batch_key)
+        if uses_gpu is not None:
+            conditions += " AND uses_gpu = ?"
+            params.append(int(uses_gpu))
+
+        leased = list()
+        while len(leased) < max_count:
+            now = time.time()
+            self.__cursor.execute(
+                f"""SELECT item, finish_time FROM {self.__table_name} WHERE (lease_expires IS NULL OR lease_expires < ?){conditions}
+                ORDER BY priority DESC, finish_time, seq LIMIT ?;""",
+                (now, *params, max_count - len(leased)),
+            )
+            rows = self.__cursor.fetchall()
+            if len(rows) == 0:
+                break
+
+            for row in rows:
+                item = InvocationQueueItem.parse_raw(row[0])
+                self.__fair_share.take(row[1])
+                canceled_at = self.__cancellations.get(item.graph_execution_state_id)
+                if canceled_at is not None and canceled_at > item.timestamp:
+                    self.__cursor.execute(
+                        f"""DELETE FROM {self.__table_name} WHERE id = ?;""", (item.id,)
+                    )
+                    continue
+
+                self.__cursor.execute(
+                    f"""UPDATE {self.__table_name} SET lease_expires = ? WHERE id = ?;""",
+                    (now + self.__visibility_timeout, item.id),
+                )
+                self.__leased[item.id] = item
+                self.__wait_times.add(item)
+                leased.append(item)
+
+            self.__conn.commit()
+        return leased
+
+    def get(
+        self, uses_gpu: Optional[bool] = None, timeout: Optional[float] = None
+    ) -> InvocationQueueItem | None:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.__available:
+            while True:
+                # Each None that was put wakes up one get()
+                if self.__wakeups > 0:
+                    self.__wakeups -= 1
+                    return None
+
+                items = self.__lease(1, uses_gpu=uses_gpu)
+                if len(items) > 0:
+                    return items[0]
+
+                wait = QUEUE_POLL_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        return None
+                self.__available.wait(wait)
+
+    def get_batch(self, batch_key: str, max_count: int) -> list[InvocationQueueItem]:
+        with self.__lock:
+            return self.__lease(max_count, batch_key)
+
+    def put(self, item: InvocationQueueItem | None) -> None:
+        with self.__available:
+            if item is None:
+                self.__wakeups += 1
+            else:
+                self.__cancellations.discard(item.graph_execution_state_id)
+                self.__cursor.execute(
+                    f"""DELETE FROM {self.__cancellations_table_name} WHERE graph_execution_state_id = ?;""",
+                    (item.graph_execution_state_id,),
+                )
+                finish_time = self.__fair_share.get_finish_time(item.fair_share_key)
+                self.__cursor.execute(
+                    f"""INSERT INTO {self.__table_name} (id, graph_execution_state_id, timestamp, priority, fair_share_key, finish_time, batch_key, uses_gpu, item)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);""",
+                    (
+                        item.id,
+                        item.graph_execution_state_id,
+                        item.timestamp,
+                        item.priority,
+                        item.fair_share_key,
+                        finish_time,
+                        item.batch_key,
+                        int(item.uses_gpu),
+                        item.json(),
+                    ),
+                )
+                self.__conn.commit()
+            self.__available.notify()
+
+    def complete(self, item: InvocationQueueItem) -> None:
+        with self.__lock:
+            self.__cursor.execute(
+                f"""DELETE FROM {self.__table_name} WHERE id = ?;""", (item.id,)
+            )
+            self.__conn.commit()
+            self.__leased.pop(item.id, None)
+
+    def cancel(self, graph_execution_state_id: str) -> None:
+        with self.__lock:
+            if graph_execution_state_id in self.__cancellations:
+                return
+
+            timestamp = time.time()
+            self.__cursor.execute(
+                f"""INSERT OR REPLACE INTO {self.__cancellations_table_name} (graph_execution_state_id, timestamp) VALUES (?, ?);""",
+                (graph_execution_state_id, timestamp),
+            )
+
+            # Items that are being processed are left to be completed
+            self.__cursor.execute(
+                f"""DELETE FROM {self.__table_name} WHERE graph_execution_state_id = ?
+                AND (lease_expires IS NULL OR lease_expires < ?);""",
+                (graph_execution_state_id, timestamp),
+            )
+            self.__conn.commit()
+            self.__cancellations.add(graph_execution_state_id, timestamp)
+
+    def is_canceled(self, graph_execution_state_id: str) -> bool:
+        return graph_execution_state_id in self.__cancellations
+
+    def get_stats(self) -> InvocationQueueStats:
+        with self.__lock:
+            self.__cursor.execute(
+                f"""SELECT item FROM {self.__table_name} WHERE lease_expires IS NULL OR lease_expires < ?;""",
+                (time.time(),),
+            )
+            items = [InvocationQueueItem.parse_raw(r[0]) for r in self.__cursor.fetchall()]
+        return self.__wait_times.get_stats(items)
+
+    def get_queued_sessions(self) -> set[str]:
+        with self.__lock:
+            self.__cursor.execute(
+                f"""SELECT DISTINCT graph_execution_state_id FROM {self.__table_name};"""
+            )
+            return {r[0] for r in self.__cursor.fetchall()}
@@ -1,4 +1,6 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
+from typing import Optional
+
 from invokeai.backend import ModelManager
 
 from .events import EventServiceBase
@@ -19,6 +21,7 @@ class InvocationServices:
     # NOTE: we must forward-declare any types that include invocations, since invocations can use services
     graph_execution_manager: ItemStorageABC["GraphExecutionState"]
     processor: "InvocationProcessorABC"
+    invocation_cache: Optional["InvocationCacheBase"]
 
     def __init__(
             self,
@@ -29,6 +32,7 @@ class InvocationServices:
             graph_execution_manager: ItemStorageABC["GraphExecutionState"],
             processor: "InvocationProcessorABC",
             restoration: RestorationServices,
+            invocation_cache: Optional["InvocationCacheBase"] = None,
     ):
         self.model_manager = model_manager
         self.events = events
@@ -37,3 +41,4 @@ class InvocationServices:
         self.graph_execution_manager = graph_execution_manager
         self.processor = processor
         self.restoration = restoration
+        self.invocation_cache = invocation_cache
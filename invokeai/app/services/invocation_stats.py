@@ -0,0 +1,136 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import psutil
+import torch
+from pydantic import BaseModel, Field
+
+# Image I/O time of the invocation being measured on each thread
+_local = threading.local()
+
+
+class InvocationStats(BaseModel):
+    """Time and memory used by an invocation. Invocations run in a batch share the time and memory
+    of the whole batch."""
+
+    node_type: str = Field(description="The type of the invocation")
+    batch_size: int = Field(default=1, description="The number of invocations run in the same batch")
+    cached: bool = Field(default=False, description="Whether the outputs of an identical invocation were reused")
+    queue_wait: float = Field(default=0.0, description="Seconds from being queued until a worker started it")
+    wall_time: float = Field(default=0.0, description="Seconds the invocation ran")
+    cpu_time: float = Field(default=0.0, description="CPU seconds used by the worker thread (not by other threads, e.g. torch's)")
+    image_io_time: float = Field(default=0.0, description="Seconds spent loading and saving images")
+    rss: Optional[int] = Field(default=None, description="Bytes of memory used by the process when the invocation finished")
+    peak_rss: Optional[int] = Field(default=None, description="Peak bytes of memory used by the process so far, when the invocation finished")
+    peak_vram: Optional[int] = Field(default=None, description="Peak bytes of GPU memory allocated while the invocation ran (GPU invocations only, when they can't run at the same time as others)")
+
+
+class InvocationTypeStats(BaseModel):
+    """Stats of the invocations of a type, added up"""
+
+    count: int = Field(default=0, description="The number of invocations")
+    cached: int = Field(default=0, description="The number of invocations that reused cached outputs")
+    queue_wait: float = Field(default=0.0, description="Total seconds waited in the queue")
+    wall_time: float = Field(default=0.0, description="Total seconds run")
+    max_wall_time: float = Field(default=0.0, description="Seconds run by the slowest invocation")
+    cpu_time: float = Field(default=0.0, description="Total CPU seconds used by worker threads")
+    image_io_time: float = Field(default=0.0, description="Total seconds spent loading and saving images")
+
+
+class SessionStats(BaseModel):
+    invocations: dict[str, InvocationStats] = Field(description="The stats of each invocation, by prepared node id")
+    by_type: dict[str, InvocationTypeStats] = Field(description="The stats of the invocations of each type")
+
+
+def summarize_stats(stats: dict[str, InvocationStats]) -> SessionStats:
+    by_type: dict[str, InvocationTypeStats] = dict()
+    for s in stats.values():
+        t = by_type.setdefault(s.node_type, InvocationTypeStats())
+        t.count += 1
+        t.cached += int(s.cached)
+        t.queue_wait += s.queue_wait
+        t.wall_time += s.wall_time
+        t.max_wall_time = max(t.max_wall_time, s.wall_time)
+        t.cpu_time += s.cpu_time
+        t.image_io_time += s.image_io_time
+    return SessionStats(invocations=stats, by_type=by_type)
+
+
+@contextmanager
+def timed_image_io() -> Iterator[None]:
+    """Counts the time taken as image I/O of the invocation being measured on this thread"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if getattr(_local, "image_io_time", None) is not None:
+            _local.image_io_time += time.perf_counter() - start
+
+
+def get_rss() -> tuple[Optional[int], Optional[int]]:
+    """Gets the current and peak memory used by the process, in bytes"""
+    memory_info = psutil.Process().memory_info()
+    if sys.platform == "win32":
+        return (memory_info.rss, getattr(memory_info, "peak_wset", None))
+
+    import resource
+
+    # ru_maxrss is in kilobytes, except on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (memory_info.rss, peak_rss if sys.platform == "darwin" else peak_rss * 1024)
+
+
+class InvocationMeasurement:
+    """Measures the time and memory used while invoking on the current thread.
+
+    The peak VRAM is measured for the whole process, so it's only measured (with measure_vram)
+    when nothing else can be using the GPU at the same time.
+    """
+
+    __measure_vram: bool
+    __start_time: float
+    __start_cpu_time: float
+    wall_time: float
+    cpu_time: float
+    image_io_time: float
+    peak_vram: Optional[int]
+
+    def __init__(self, measure_vram: bool = False):
+        self.__measure_vram = measure_vram and torch.cuda.is_available()
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.image_io_time = 0.0
+        self.peak_vram = None
+
+    def __enter__(self) -> "InvocationMeasurement":
+        if self.__measure_vram:
+            torch.cuda.reset_peak_memory_stats()
+        _local.image_io_time = 0.0
+        self.__start_time = time.perf_counter()
+        self.__start_cpu_time = time.thread_time()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.wall_time = time.perf_counter() - self.__start_time
+        self.cpu_time = time.thread_time() - self.__start_cpu_time
+        self.image_io_time = _local.image_io_time
+        _local.image_io_time = None
+        if self.__measure_vram:
+            self.peak_vram = torch.cuda.max_memory_allocated()
+
+    def get_stats(self, node_type: str, queue_wait: float, batch_size: int = 1) -> InvocationStats:
+        (rss, peak_rss) = get_rss()
+        return InvocationStats(
+            node_type=node_type,
+            batch_size=batch_size,
+            queue_wait=queue_wait,
+            wall_time=self.wall_time,
+            cpu_time=self.cpu_time,
+            image_io_time=self.image_io_time,
+            rss=rss,
+            peak_rss=peak_rss,
+            peak_vram=self.peak_vram,
+        )
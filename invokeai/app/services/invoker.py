@@ -5,7 +5,12 @@ from threading import Event, Thread
 
 from ..invocations.baseinvocation import InvocationContext
 from .graph import Graph, GraphExecutionState
-from .invocation_queue import InvocationQueueABC, InvocationQueueItem
+from .invocation_queue import (
+    BULK_PRIORITY,
+    INTERACTIVE_PRIORITY,
+    InvocationQueueABC,
+    InvocationQueueItem,
+)
 from .invocation_services import InvocationServices
 from .item_storage import ItemStorageABC
 
@@ -20,30 +25,50 @@ class Invoker:
         self._start()
 
     def invoke(
-        self, graph_execution_state: GraphExecutionState, invoke_all: bool = False
+        self,
+        graph_execution_state: GraphExecutionState,
+        invoke_all: bool = False,
+        priority: int | None = None,
+        owner: str | None = None,
     ) -> str | None:
-        """Determines the next node to invoke and returns the id of the invoked node, or None if there are no nodes to execute"""
+        """Determines the next node to invoke and returns the id of the invoked node, or None if there are no nodes to execute.
+        When invoke_all is set, every node that is ready to execute is queued.
+        Single steps are queued ahead of invoke_all runs unless a priority is given, and turns are shared fairly between owners (or sessions)."""
 
         # Get the next invocation
         invocation = graph_execution_state.next()
         if not invocation:
             return None
 
+        # When invoking all, queue every ready invocation so independent nodes can run at the same time
+        invocations = [invocation]
+        while invoke_all and (invocation := graph_execution_state.next()) is not None:
+            invocations.append(invocation)
+
         # Save the execution state
         self.services.graph_execution_manager.set(graph_execution_state)
 
-        # Queue the invocation
-        print(f"queueing item {invocation.id}")
-        self.services.queue.put(
-            InvocationQueueItem(
-                # session_id    = session.id,
-                graph_execution_state_id=graph_execution_state.id,
-                invocation_id=invocation.id,
-                invoke_all=invoke_all,
+        # Queue the invocations
+        for invocation in invocations:
+            print(f"queueing item {invocation.id}")
+            self.services.queue.put(
+                InvocationQueueItem(
+                    # session_id    = session.id,
+                    graph_execution_state_id=str(graph_execution_state.id),
+                    invocation_id=invocation.id,
+                    invoke_all=invoke_all,
+                    priority=(
+                        priority
+                        if priority is not None
+                        else BULK_PRIORITY if invoke_all else INTERACTIVE_PRIORITY
+                    ),
+                    owner=owner,
+                    batch_key=invocation.get_batch_key(),
+                    uses_gpu=invocation.uses_gpu,
+                )
             )
-        )
 
-        return invocation.id
+        return invocations[0].id
 
     def create_execution_state(self, graph: Graph | None = None) -> GraphExecutionState:
         """Creates a new execution state for the given graph"""
@@ -54,6 +79,7 @@ class Invoker:
     def cancel(self, graph_execution_state_id: str) -> None:
         """Cancels the given execution state"""
         self.services.queue.cancel(graph_execution_state_id)
+        self.services.processor.cancel(graph_execution_state_id)
 
     def __start_service(self, service) -> None:
         # Call start() method on any services that have it
@@ -88,4 +114,7 @@ class Invoker:
 
 
 class InvocationProcessorABC(ABC):
-    pass
+    def cancel(self, graph_execution_state_id: str) -> None:
+        """Cancels the running invocations of an execution state, and returns its executing nodes
+        so they are handed out again when it is invoked again"""
+        pass
@@ -0,0 +1,108 @@
+import json
+import zlib
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, Union
+
+from pydantic.json import pydantic_encoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class ItemCodec(ABC):
+    """Encodes the values of items (as given by BaseModel.dict()) for storage, and decodes them
+    back to JSON-compatible values that the items can be parsed from.
+
+    Codecs that encode to text encode JSON, which can still be queried by SQLite. Codecs that
+    encode to bytes are stored with their name, so items can be decoded after the codec that is
+    used has been changed.
+    """
+
+    name: str
+
+    @abstractmethod
+    def encode(self, value: Any) -> Union[str, bytes]:
+        pass
+
+    @abstractmethod
+    def decode(self, data: Union[str, bytes]) -> Any:
+        pass
+
+
+class JsonItemCodec(ItemCodec):
+    """Encodes JSON text, with orjson if it is installed"""
+
+    name = "json"
+
+    def encode(self, value: Any) -> str:
+        if orjson is not None:
+            return orjson.dumps(
+                value, default=pydantic_encoder, option=orjson.OPT_NON_STR_KEYS
+            ).decode()
+        return json.dumps(value, default=pydantic_encoder)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class MsgpackItemCodec(ItemCodec):
+    """Encodes MessagePack, which requires msgpack to be installed"""
+
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ValueError("The msgpack item codec requires msgpack to be installed")
+
+    def encode(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=pydantic_encoder)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return msgpack.unpackb(data)
+
+
+class ZlibItemCodec(ItemCodec):
+    """Compresses what another codec encodes"""
+
+    _codec: ItemCodec
+    _level: int
+
+    def __init__(self, codec: ItemCodec, level: int = 1):
+        self._codec = codec
+        self._level = level
+        self.name = f"{codec.name}+zlib"
+
+    def encode(self, value: Any) -> bytes:
+        data = self._codec.encode(value)
+        if isinstance(data, str):
+            data = data.encode()
+        return zlib.compress(data, self._level)
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        return self._codec.decode(zlib.decompress(data))
+
+
+_codecs = dict(json=JsonItemCodec, msgpack=MsgpackItemCodec)
+
+ITEM_CODEC_NAMES = ["json", "json+zlib", "msgpack", "msgpack+zlib"]
+
+
+@lru_cache(maxsize=None)
+def get_item_codec(name: str) -> ItemCodec:
+    """Gets a codec by name: a base codec (json or msgpack), optionally followed by +zlib"""
+    base, *wrappers = name.split("+")
+    if base not in _codecs or any(w != "zlib" for w in wrappers):
+        raise ValueError(f"Unknown item codec {name}")
+
+    codec = _codecs[base]()
+    for _ in wrappers:
+        codec = ZlibItemCodec(codec)
+    return codec
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Callable, Generic, TypeVar
+from typing import Callable, Generic, Optional, TypeVar
 
 from pydantic import BaseModel, Field
 from pydantic.generics import GenericModel
@@ -15,6 +15,7 @@ class PaginatedResults(GenericModel, Generic[T]):
     pages: int = Field(description="Total number of pages")
     per_page: int = Field(description="Number of items per page")
     total: int = Field(description="Total number of items in result")
+    next_cursor: Optional[str] = Field(default=None, description="Cursor to get the page after this one with, if there is one")
     #fmt: on
 
 class ItemStorageABC(ABC, Generic[T]):
@@ -36,13 +37,40 @@ class ItemStorageABC(ABC, Generic[T]):
         pass
 
     @abstractmethod
-    def list(self, page: int = 0, per_page: int = 10) -> PaginatedResults[T]:
+    def delete(self, item_id: str) -> None:
+        pass
+
+    def get_many(self, item_ids: list[str]) -> list[Optional[T]]:
+        """Gets several items, in the order of their ids (None for items that don't exist)"""
+        return [self.get(item_id) for item_id in item_ids]
+
+    def set_many(self, items: list[T]) -> None:
+        """Sets several items. Implementations should write them all at once."""
+        for item in items:
+            self.set(item)
+
+    def delete_many(self, item_ids: list[str]) -> None:
+        """Deletes several items. Implementations should delete them all at once."""
+        for item_id in item_ids:
+            self.delete(item_id)
+
+    @abstractmethod
+    def list(
+        self, page: int = 0, per_page: int = 10, cursor: Optional[str] = None
+    ) -> PaginatedResults[T]:
+        """Gets a page of items. If a cursor (the next_cursor of a previous page) is given,
+        gets the page after that one instead of the numbered page."""
         pass
 
     @abstractmethod
     def search(
-        self, query: str, page: int = 0, per_page: int = 10
+        self,
+        query: str,
+        page: int = 0,
+        per_page: int = 10,
+        cursor: Optional[str] = None,
     ) -> PaginatedResults[T]:
+        """Gets a page of items matching a query, paged the same way as list()"""
         pass
 
     def on_changed(self, on_changed: Callable[[T], None]) -> None:
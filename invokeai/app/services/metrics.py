@@ -0,0 +1,250 @@
+"""Metrics exported in the Prometheus text format.
+
+Updating a metric doesn't take a lock: each thread updates its own shard of the metric's values,
+and the shards are added up when the metrics are collected. Metrics that are already counted
+elsewhere (e.g. the queue depth) can get their value from a function when collected instead.
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Generic, Iterator, Optional, TypeVar
+
+S = TypeVar("S")
+
+# Labels values of a sample, in the order of the metric's label names
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _ThreadShards(Generic[S]):
+    """A shard of values for each thread that updates them"""
+
+    __factory: Callable[[], S]
+    __local: threading.local
+    __shards: list[S]
+    __lock: threading.Lock
+
+    def __init__(self, factory: Callable[[], S]):
+        self.__factory = factory
+        self.__local = threading.local()
+        self.__shards = list()
+        self.__lock = threading.Lock()
+
+    def get(self) -> S:
+        shard = getattr(self.__local, "shard", None)
+        if shard is None:
+            # Only taken the first time a thread updates the metric
+            shard = self.__local.shard = self.__factory()
+            with self.__lock:
+                self.__shards.append(shard)
+        return shard
+
+    def all(self) -> list[S]:
+        with self.__lock:
+            return list(self.__shards)
+
+
+class MetricsRegistry:
+    __metrics: dict[str, "Metric"]
+    __lock: threading.Lock
+
+    def __init__(self):
+        self.__metrics = dict()
+        self.__lock = threading.Lock()
+
+    def register(self, metric: "Metric") -> None:
+        with self.__lock:
+            if metric.name in self.__metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.__metrics[metric.name] = metric
+
+    def expose(self) -> str:
+        """Gets the metrics in the Prometheus text exposition format"""
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+
+        lines = list()
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.collect():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Metric:
+    name: str
+    help: str
+    type: str
+    labelnames: tuple[str, ...]
+    _function: Optional[Callable[[], float]]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        registry: Optional[MetricsRegistry] = REGISTRY,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._function = None
+        if registry is not None:
+            registry.register(self)
+
+    def set_function(self, function: Optional[Callable[[], float]]) -> None:
+        """Gets the value of the metric from a function when it's collected"""
+        self._function = function
+
+    def collect(self) -> list[tuple[str, list[tuple[str, str]], float]]:
+        """Gets the (name, labels, value) of each sample"""
+        if self._function is not None:
+            return [(self.name, [], float(self._function()))]
+
+        return [
+            (self.name, list(zip(self.labelnames, labelvalues)), value)
+            for labelvalues, value in sorted(self._collect_values().items())
+        ]
+
+    def _collect_values(self) -> dict[LabelValues, float]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    type = "counter"
+    _shards: _ThreadShards[dict[LabelValues, float]]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._shards = _ThreadShards(dict)
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        shard = self._shards.get()
+        shard[labelvalues] = shard.get(labelvalues, 0.0) + amount
+
+    def _collect_values(self) -> dict[LabelValues, float]:
+        values = dict()
+        for shard in self._shards.all():
+            for labelvalues, value in shard.copy().items():
+                values[labelvalues] = values.get(labelvalues, 0.0) + value
+        return values
+
+
+class Gauge(Counter):
+    """A value that goes up and down"""
+
+    type = "gauge"
+
+    def dec(self, *labelvalues: str, amount: float = 1.0) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(Metric):
+    """Counts of observed values (e.g. latencies) in buckets, with their sum"""
+
+    type = "histogram"
+    buckets: tuple[float, ...]
+    _shards: _ThreadShards[dict[LabelValues, list[float]]]
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._shards = _ThreadShards(dict)
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        shard = self._shards.get()
+        row = shard.get(labelvalues)
+        if row is None:
+            # The count of each bucket (the last is +Inf), then the sum
+            row = shard[labelvalues] = [0.0] * (len(self.buckets) + 2)
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        """Observes the seconds taken"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def collect(self) -> list[tuple[str, list[tuple[str, str]], float]]:
+        rows: dict[LabelValues, list[float]] = dict()
+        for shard in self._shards.all():
+            for labelvalues, row in shard.copy().items():
+                total = rows.setdefault(labelvalues, [0.0] * len(row))
+                for i, value in enumerate(row):
+                    total[i] += value
+
+        samples = list()
+        for labelvalues, row in sorted(rows.items()):
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), row[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", labels + [("le", _format_value(bound))], cumulative))
+            samples.append((f"{self.name}_sum", labels, row[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape_help(help: str) -> str:
+    return help.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels: list[tuple[str, str]]) -> str:
+    if len(labels) == 0:
+        return ""
+    escaped = (
+        k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+# Metrics of the nodes API
+queue_depth = Gauge("invokeai_queue_depth", "Invocations waiting in the queue")
+invocations_in_flight = Gauge("invokeai_invocations_in_flight", "Invocations being run by workers")
+invocation_duration = Histogram(
+    "invokeai_invocation_duration_seconds",
+    "Seconds invocations ran, by invocation type (not counting cached outputs)",
+    ("type",),
+)
+invocation_errors = Counter(
+    "invokeai_invocation_errors_total", "Invocations that raised an error, by invocation type", ("type",)
+)
+diffusion_steps = Counter("invokeai_diffusion_steps_total", "Diffusion steps run, for all images of a batch")
+model_cache_hits = Counter("invokeai_model_cache_hits_total", "Models retrieved from the model cache")
+model_cache_misses = Counter("invokeai_model_cache_misses_total", "Models loaded because they weren't in the model cache")
+model_cache_evictions = Counter("invokeai_model_cache_evictions_total", "Models removed from the model cache to make room")
+image_cache_hits = Counter("invokeai_image_cache_hits_total", "Images retrieved from the image storage's cache")
+image_cache_misses = Counter("invokeai_image_cache_misses_total", "Images loaded because they weren't in the image storage's cache")
+image_cache_evictions = Counter("invokeai_image_cache_evictions_total", "Images removed from the image storage's cache to make room")
+image_cache_bytes = Gauge("invokeai_image_cache_bytes", "Bytes of decoded images in the image storage's cache")
+sqlite_operation_duration = Histogram(
+    "invokeai_sqlite_operation_duration_seconds",
+    "Seconds SQLite storage reads and writes took, including waiting for the write lock",
+    ("table", "operation"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+event_dispatch_lag = Histogram(
+    "invokeai_event_dispatch_lag_seconds",
+    "Seconds from emitting events to dispatching them on the event loop",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
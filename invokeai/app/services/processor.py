@@ -1,19 +1,124 @@
+import os
+import time
 import traceback
-from threading import Event, Thread
+from queue import Queue
+from threading import BoundedSemaphore, Event, Lock, Thread
+from typing import Optional
 
-from ..invocations.baseinvocation import InvocationContext
+from ...backend.stable_diffusion.profiling import ChromeTraceProfiler, use_profiling_hooks
+from ..invocations.baseinvocation import BaseInvocation, BaseInvocationOutput, InvocationContext
+from .cancellation import CancellationToken
+from .image_storage import ImageType
+from .invocation_cache import get_output_images
 from .invocation_queue import InvocationQueueItem
+from .invocation_stats import InvocationMeasurement, InvocationStats
+from . import metrics
 from .invoker import InvocationProcessorABC, Invoker
 from ..util.util import CanceledException
 
+# Number of locks that session updates are spread across
+SESSION_LOCK_COUNT = 64
+
+# Seconds between checks for more items to add to a batch
+BATCH_POLL_INTERVAL = 0.01
+
+# Seconds between checks for a worker freeing up in a busy lane, while waiting for items for the
+# other lane
+LANE_POLL_INTERVAL = 0.05
+
+# An invocation taken from the queue, and the token that cancels it
+Work = tuple[InvocationQueueItem, BaseInvocation, CancellationToken]
+
+
 class DefaultInvocationProcessor(InvocationProcessorABC):
+    """Runs queued invocations on worker threads.
+
+    Invocations are split into a GPU lane and a CPU lane (see BaseInvocation.uses_gpu), each with
+    its own pool of workers. With the default of no CPU workers, both lanes share a single worker
+    and invocations run one at a time, in queue order.
+
+    Invocations are only taken from the queue when a worker in their lane is free, so the queue
+    decides what runs next (e.g. by priority) up until a worker can start it, and invocations
+    for a busy lane don't hold up those for the other.
+
+    Each invocation taken from the queue gets a cancellation token (passed to it in its
+    InvocationContext), which is canceled when its session is canceled.
+
+    The time and memory used by each invocation (see InvocationStats) are saved to its session and
+    emitted as an invocation_stats event.
+
+    With a batch window, invocations that can be batched (see BaseInvocation.get_batch_key) wait
+    up to that many seconds for compatible invocations to be queued, and up to max_batch_size of
+    them are invoked together on one worker.
+
+    With a profile dir, the stages of generation (see invokeai.backend.stable_diffusion.profiling)
+    are profiled and a Chrome trace is written there for each invocation, named
+    {session id}_{invocation id}.json. Invocations run in a batch get the same trace.
+
+    When started, nodes left executing when the app last stopped are handed out again, unless
+    their sessions still have queued items.
+
+    When a session completes, the intermediate images it output are persisted (see
+    DiskImageStorage), as nothing else in the session will use them.
+    """
+
     __invoker_thread: Thread
+    __worker_threads: list[Thread]
+    __lanes: dict[str, Queue]
+    __lane_slots: dict[str, BoundedSemaphore]
+    __session_locks: list[Lock]
+    __tokens: dict[str, set[CancellationToken]]
+    __tokens_lock: Lock
     __stop_event: Event
     __invoker: Invoker
+    __cpu_workers: int
+    __gpu_workers: int
+    __batch_window: float
+    __max_batch_size: int
+    __profile_dir: Optional[str]
+    __started: bool
+
+    def __init__(
+        self,
+        cpu_workers: int = 0,
+        gpu_workers: int = 1,
+        batch_window: float = 0.0,
+        max_batch_size: int = 4,
+        profile_dir: Optional[str] = None,
+    ):
+        self.__cpu_workers = max(0, cpu_workers)
+        self.__gpu_workers = max(1, gpu_workers)
+        self.__batch_window = max(0.0, batch_window)
+        self.__max_batch_size = max(1, max_batch_size)
+        self.__profile_dir = profile_dir
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        self.__session_locks = [Lock() for _ in range(SESSION_LOCK_COUNT)]
+        self.__tokens = dict()
+        self.__tokens_lock = Lock()
+        self.__started = False
 
     def start(self, invoker) -> None:
+        # The invoker may start services more than once
+        if self.__started:
+            return
+        self.__started = True
+
         self.__invoker = invoker
         self.__stop_event = Event()
+        self.__release_abandoned_nodes()
+
+        gpu_lane = Queue()
+        cpu_lane = Queue() if self.__cpu_workers > 0 else gpu_lane
+        self.__lanes = dict(gpu=gpu_lane, cpu=cpu_lane)
+
+        # Free workers in each lane
+        gpu_slots = BoundedSemaphore(self.__gpu_workers)
+        cpu_slots = (
+            BoundedSemaphore(self.__cpu_workers) if self.__cpu_workers > 0 else gpu_slots
+        )
+        self.__lane_slots = dict(gpu=gpu_slots, cpu=cpu_slots)
+
         self.__invoker_thread = Thread(
             name="invoker_processor",
             target=self.__process,
@@ -22,103 +127,450 @@ class DefaultInvocationProcessor(InvocationProcessorABC):
         self.__invoker_thread.daemon = (
             True  # TODO: probably better to just not use threads?
         )
+
+        self.__worker_threads = [
+            Thread(
+                name=f"invoker_worker_gpu_{i}",
+                target=self.__work,
+                kwargs=dict(stop_event=self.__stop_event, lane=gpu_lane, slots=gpu_slots),
+                daemon=True,
+            )
+            for i in range(self.__gpu_workers)
+        ] + [
+            Thread(
+                name=f"invoker_worker_cpu_{i}",
+                target=self.__work,
+                kwargs=dict(stop_event=self.__stop_event, lane=cpu_lane, slots=cpu_slots),
+                daemon=True,
+            )
+            for i in range(self.__cpu_workers)
+        ]
+
+        for thread in self.__worker_threads:
+            thread.start()
         self.__invoker_thread.start()
 
     def stop(self, *args, **kwargs) -> None:
+        if not self.__started or self.__stop_event.is_set():
+            return
+
         self.__stop_event.set()
 
+        # Wake up all workers so they can exit
+        for _ in range(self.__gpu_workers):
+            self.__lanes["gpu"].put(None)
+        for _ in range(self.__cpu_workers):
+            self.__lanes["cpu"].put(None)
+
+    def __release_abandoned_nodes(self) -> None:
+        """Returns nodes left executing when the app last stopped, so they are handed out again.
+        Nodes of sessions that still have queued items are left, as their items will be processed
+        (e.g. by a SQLite queue). Otherwise, they would never run, and their sessions would never
+        complete."""
+        services = self.__invoker.services
+        queued = services.queue.get_queued_sessions()
+        storage = services.graph_execution_manager
+
+        # Status fields (see SqliteItemStorage.list_status) are listed without parsing sessions
+        list_status = getattr(storage, "list_status", None)
+        cursor = None
+        while True:
+            if list_status is not None:
+                page = list_status(per_page=100, cursor=cursor)
+                ids = [s["id"] for s in page.items if s.get("executing", True)]
+            else:
+                page = storage.list(per_page=100, cursor=cursor)
+                ids = [s.id for s in page.items if len(s.executing) > 0]
+
+            ids = [i for i in ids if i not in queued]
+            for graph_execution_state in storage.get_many(ids) if len(ids) > 0 else []:
+                if graph_execution_state is not None and len(graph_execution_state.executing) > 0:
+                    graph_execution_state.release_executing()
+                    storage.set(graph_execution_state)
+
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
     def __process(self, stop_event: Event):
+        """Routes queued invocations to the lane that should run them"""
         try:
+            queue = self.__invoker.services.queue
             while not stop_event.is_set():
-                queue_item: InvocationQueueItem = self.__invoker.services.queue.get()
-                if not queue_item:  # Probably stopping
+                # Wait for a free worker, and only take items that a free worker can start
+                free_slots = self.__take_free_workers(stop_event)
+                if len(free_slots) == 0:
                     continue
 
-                graph_execution_state = (
-                    self.__invoker.services.graph_execution_manager.get(
-                        queue_item.graph_execution_state_id
-                    )
-                )
-                invocation = graph_execution_state.execution_graph.get_node(
-                    queue_item.invocation_id
+                uses_gpu = None
+                if len(free_slots) < len(self.__lane_slots):
+                    uses_gpu = "gpu" in free_slots
+                queue_item: InvocationQueueItem = queue.get(
+                    uses_gpu=uses_gpu,
+                    # Check again for workers that free up in the busy lane
+                    timeout=LANE_POLL_INTERVAL if uses_gpu is not None else None,
                 )
 
-                # Send starting event
-                self.__invoker.services.events.emit_invocation_started(
-                    graph_execution_state_id=graph_execution_state.id,
-                    invocation_id=invocation.id,
-                )
+                # Give back the workers the item doesn't need
+                lane_name = None
+                if queue_item:
+                    lane_name = "gpu" if queue_item.uses_gpu else "cpu"
+                slots = free_slots.get(lane_name)
+                for s in set(free_slots.values()):
+                    if s is not slots:
+                        s.release()
+
+                if not queue_item:  # Probably stopping, or nothing queued for the free lane
+                    continue
+
+                invocation = self.__get_invocation(queue_item)
+                if invocation is None:
+                    slots.release()
+                    continue
+
+                batch = [
+                    (queue_item, invocation, self.__add_token(queue_item.graph_execution_state_id))
+                ]
+                if self.__batch_window > 0 and queue_item.batch_key is not None:
+                    batch.extend(self.__gather_batch(queue_item.batch_key, stop_event))
+                self.__lanes[lane_name].put(batch)
+
+        except KeyboardInterrupt:
+            ...  # Log something?
 
-                # Invoke
+    def __get_invocation(self, queue_item: InvocationQueueItem) -> Optional[BaseInvocation]:
+        """Gets the invocation of a queue item, or completes the item if it no longer exists"""
+        graph_execution_state = self.__invoker.services.graph_execution_manager.get(
+            queue_item.graph_execution_state_id
+        )
+
+        # Items of a persistent queue may outlive their session
+        if (
+            graph_execution_state is None
+            or queue_item.invocation_id not in graph_execution_state.execution_graph.nodes
+        ):
+            self.__invoker.services.queue.complete(queue_item)
+            return None
+
+        return graph_execution_state.execution_graph.get_node(queue_item.invocation_id)
+
+    def __gather_batch(self, batch_key: str, stop_event: Event) -> list[Work]:
+        """Takes queued items with a batch key until the batch is full or the batch window ends"""
+        queue = self.__invoker.services.queue
+        deadline = time.monotonic() + self.__batch_window
+        batch = list()
+        while True:
+            for queue_item in queue.get_batch(batch_key, self.__max_batch_size - 1 - len(batch)):
+                invocation = self.__get_invocation(queue_item)
+                if invocation is not None:
+                    token = self.__add_token(queue_item.graph_execution_state_id)
+                    batch.append((queue_item, invocation, token))
+
+            remaining = deadline - time.monotonic()
+            if (
+                len(batch) >= self.__max_batch_size - 1
+                or remaining <= 0
+                or stop_event.wait(min(remaining, BATCH_POLL_INTERVAL))
+            ):
+                return batch
+
+    def __take_free_workers(self, stop_event: Event) -> dict[str, BoundedSemaphore]:
+        """Takes a free worker slot from each lane that has one, waiting for one if none do, or
+        returns none if stopping. Lanes that share workers share the slot that was taken."""
+        while not stop_event.is_set():
+            taken = dict()
+            for name, slots in self.__lane_slots.items():
+                if slots in taken.values() or slots.acquire(blocking=False):
+                    taken[name] = slots
+            if len(taken) > 0:
+                return taken
+
+            gpu_slots = self.__lane_slots["gpu"]
+            if gpu_slots.acquire(timeout=LANE_POLL_INTERVAL):
+                return {name: s for name, s in self.__lane_slots.items() if s is gpu_slots}
+        return dict()
+
+    def __work(self, stop_event: Event, lane: Queue, slots: BoundedSemaphore):
+        try:
+            while not stop_event.is_set():
+                batch = lane.get()
+                if not batch:  # Probably stopping
+                    continue
+
+                metrics.invocations_in_flight.inc(amount=len(batch))
                 try:
-                    outputs = invocation.invoke(
-                        InvocationContext(
-                            services=self.__invoker.services,
-                            graph_execution_state_id=graph_execution_state.id,
+                    self.__invoke(batch)
+                finally:
+                    metrics.invocations_in_flight.dec(amount=len(batch))
+                    for queue_item, _, token in batch:
+                        self.__remove_token(queue_item.graph_execution_state_id, token)
+                        self.__invoker.services.queue.complete(queue_item)
+                    slots.release()
+
+        except KeyboardInterrupt:
+            ...  # Log something?
+
+    def cancel(self, graph_execution_state_id: str) -> None:
+        with self.__tokens_lock:
+            for token in self.__tokens.get(graph_execution_state_id, ()):
+                token.cancel()
+
+        # Return any handed out nodes, so the session can be invoked again. This holds the
+        # session's lock, so invocations completing at the same time don't save over it.
+        graph_execution_manager = self.__invoker.services.graph_execution_manager
+        with self.__session_lock(graph_execution_state_id):
+            graph_execution_state = graph_execution_manager.get(graph_execution_state_id)
+            if graph_execution_state is not None and len(graph_execution_state.executing) > 0:
+                graph_execution_state.release_executing()
+                graph_execution_manager.set(graph_execution_state)
+
+    def __add_token(self, graph_execution_state_id: str) -> CancellationToken:
+        token = CancellationToken()
+        with self.__tokens_lock:
+            self.__tokens.setdefault(graph_execution_state_id, set()).add(token)
+
+        # The session may have been canceled after the item was taken from the queue
+        if self.__invoker.services.queue.is_canceled(graph_execution_state_id):
+            token.cancel()
+        return token
+
+    def __remove_token(self, graph_execution_state_id: str, token: CancellationToken) -> None:
+        with self.__tokens_lock:
+            tokens = self.__tokens.get(graph_execution_state_id)
+            if tokens is not None:
+                tokens.discard(token)
+                if len(tokens) == 0:
+                    del self.__tokens[graph_execution_state_id]
+
+    def __session_lock(self, graph_execution_state_id: str) -> Lock:
+        return self.__session_locks[hash(graph_execution_state_id) % SESSION_LOCK_COUNT]
+
+    def __invoke(self, batch: list[Work]):
+        services = self.__invoker.services
+        started = time.time()
+
+        # Skip invocations that were canceled while they waited for a worker
+        batch = [work for work in batch if not work[2].is_canceled]
+
+        # Send starting events
+        for queue_item, invocation, _ in batch:
+            services.events.emit_invocation_started(
+                graph_execution_state_id=queue_item.graph_execution_state_id,
+                invocation_id=invocation.id,
+            )
+
+        def queue_wait(i: int) -> float:
+            return max(0.0, started - batch[i][0].timestamp)
+
+        # Use the cached outputs of identical invocations if there are any
+        outputs = [None] * len(batch)
+        errors = [None] * len(batch)
+        stats: list[Optional[InvocationStats]] = [None] * len(batch)
+        cache = services.invocation_cache
+        cache_keys = [None] * len(batch)
+        if cache is not None:
+            for i, (_, invocation, _) in enumerate(batch):
+                try:
+                    cache_keys[i] = cache.create_key(invocation, services)
+                    if cache_keys[i] is not None:
+                        outputs[i] = cache.get(cache_keys[i])
+                    if outputs[i] is not None:
+                        stats[i] = InvocationStats(
+                            node_type=invocation.type, cached=True, queue_wait=queue_wait(i)
                         )
+                except Exception as e:
+                    errors[i] = traceback.format_exc()
+
+        # Invoke
+        pending = [i for i in range(len(batch)) if outputs[i] is None and errors[i] is None]
+        contexts = [
+            InvocationContext(
+                services=services,
+                graph_execution_state_id=queue_item.graph_execution_state_id,
+                cancellation_token=token,
+            )
+            for queue_item, _, token in batch
+        ]
+        if len(pending) > 1:
+            try:
+                invocation_type = type(batch[pending[0]][1])
+                profiler = self.__create_profiler()
+                try:
+                    with use_profiling_hooks(profiler), InvocationMeasurement(
+                        self.__measures_vram(invocation_type)
+                    ) as measurement:
+                        batch_outputs = invocation_type.invoke_batch(
+                            [batch[i][1] for i in pending], [contexts[i] for i in pending]
+                        )
+                finally:
+                    self.__write_trace(profiler, [batch[i] for i in pending])
+                for i, output in zip(pending, batch_outputs):
+                    outputs[i] = output
+                    stats[i] = measurement.get_stats(
+                        batch[i][1].type, queue_wait(i), len(pending)
                     )
+                pending = []
 
-                    # Check queue to see if this is canceled, and skip if so
-                    if self.__invoker.services.queue.is_canceled(
-                        graph_execution_state.id
-                    ):
-                        continue
+            except KeyboardInterrupt:
+                pending = []
 
-                    # Save outputs and history
-                    graph_execution_state.complete(invocation.id, outputs)
+            except Exception as e:
+                # Invoke them one at a time instead, so errors are reported for the invocations
+                # that caused them
+                pending = [i for i in pending if not batch[i][2].is_canceled]
 
-                    # Save the state changes
-                    self.__invoker.services.graph_execution_manager.set(
-                        graph_execution_state
-                    )
+        for i in pending:
+            measurement = InvocationMeasurement(self.__measures_vram(type(batch[i][1])))
+            profiler = self.__create_profiler()
+            try:
+                with use_profiling_hooks(profiler), measurement:
+                    outputs[i] = batch[i][1].invoke(contexts[i])
 
-                    # Send complete event
-                    self.__invoker.services.events.emit_invocation_complete(
-                        graph_execution_state_id=graph_execution_state.id,
-                        invocation_id=invocation.id,
-                        result=outputs.dict(),
-                    )
+            except KeyboardInterrupt:
+                pass
+
+            except CanceledException:
+                pass
 
-                except KeyboardInterrupt:
-                    pass
+            except Exception as e:
+                errors[i] = traceback.format_exc()
 
-                except CanceledException:
-                    pass
+            self.__write_trace(profiler, [batch[i]])
+            stats[i] = measurement.get_stats(batch[i][1].type, queue_wait(i))
 
+        for i, (queue_item, invocation, token) in enumerate(batch):
+            # The key may not be available until the invocation has loaded its model
+            if cache is not None and outputs[i] is not None and errors[i] is None:
+                try:
+                    cache_key = cache_keys[i] or cache.create_key(invocation, services)
+                    if cache_key is not None:
+                        cache.save(cache_key, outputs[i])
                 except Exception as e:
-                    error = traceback.format_exc()
+                    outputs[i], errors[i] = None, traceback.format_exc()
 
-                    # Save error
-                    graph_execution_state.set_node_error(invocation.id, error)
+            self.__complete(queue_item, invocation, token, outputs[i], errors[i], stats[i])
 
-                    # Save the state changes
-                    self.__invoker.services.graph_execution_manager.set(
-                        graph_execution_state
-                    )
+    def __measures_vram(self, invocation_type: type[BaseInvocation]) -> bool:
+        """Whether to measure the peak VRAM of an invocation. Peaks are process-wide, so they are
+        only measured when GPU invocations run one at a time."""
+        return invocation_type.uses_gpu and self.__gpu_workers == 1
+
+    def __create_profiler(self) -> Optional[ChromeTraceProfiler]:
+        return ChromeTraceProfiler() if self.__profile_dir is not None else None
+
+    def __write_trace(self, profiler: Optional[ChromeTraceProfiler], batch: list[Work]) -> None:
+        """Writes the trace of invoking a batch (or a single invocation) for each of its invocations"""
+        if profiler is None:
+            return
 
-                    # Send error event
-                    self.__invoker.services.events.emit_invocation_error(
-                        graph_execution_state_id=graph_execution_state.id,
+        for queue_item, invocation, _ in batch:
+            try:
+                profiler.write(
+                    os.path.join(
+                        self.__profile_dir,
+                        f"{queue_item.graph_execution_state_id}_{invocation.id}.json",
+                    ),
+                    metadata=dict(
+                        graph_execution_state_id=queue_item.graph_execution_state_id,
                         invocation_id=invocation.id,
-                        error=error,
-                    )
+                        invocation_type=invocation.type,
+                        batch_size=len(batch),
+                    ),
+                )
+            except OSError:
+                # Failing to write a trace shouldn't fail the invocation
+                traceback.print_exc()
 
-                    pass
-                
-                # Check queue to see if this is canceled, and skip if so
-                if self.__invoker.services.queue.is_canceled(
-                    graph_execution_state.id
-                ):
-                    continue
+    def __complete(
+        self,
+        queue_item: InvocationQueueItem,
+        invocation: BaseInvocation,
+        token: CancellationToken,
+        outputs: Optional[BaseInvocationOutput],
+        error: Optional[str],
+        stats: Optional[InvocationStats] = None,
+    ):
+        """Saves the outputs (or error) and stats of an invocation to its session"""
+        services = self.__invoker.services
+        graph_execution_state_id = queue_item.graph_execution_state_id
+        completed_state = None
 
-                # Queue any further commands if invoking all
-                is_complete = graph_execution_state.is_complete()
-                if queue_item.invoke_all and not is_complete:
-                    self.__invoker.invoke(graph_execution_state, invoke_all=True)
-                elif is_complete:
-                    self.__invoker.services.events.emit_graph_execution_complete(
-                        graph_execution_state.id
-                    )
+        # Other workers may have updated this session while the invocation ran, so the
+        # state is reloaded and updated while holding the session's lock
+        with self.__session_lock(graph_execution_state_id):
+            graph_execution_state = services.graph_execution_manager.get(
+                graph_execution_state_id
+            )
 
-        except KeyboardInterrupt:
-            ...  # Log something?
+            # The session was deleted while the invocation ran. Its worker and queue item are
+            # released by the caller.
+            if graph_execution_state is None:
+                return
+
+            was_complete = graph_execution_state.is_complete()
+            if stats is not None:
+                graph_execution_state.set_node_stats(invocation.id, stats)
+                if not stats.cached:
+                    metrics.invocation_duration.observe(stats.wall_time, invocation.type)
+
+            if error is not None:
+                metrics.invocation_errors.inc(invocation.type)
+
+                # Save error
+                graph_execution_state.set_node_error(invocation.id, error)
+
+                # Save the state changes
+                services.graph_execution_manager.set(graph_execution_state)
+
+                # Send error event
+                services.events.emit_invocation_error(
+                    graph_execution_state_id=graph_execution_state_id,
+                    invocation_id=invocation.id,
+                    error=error,
+                )
+
+            # Skip saving the outputs if this was canceled
+            if token.is_canceled:
+                return
+
+            if outputs is not None:
+                # Save outputs and history
+                graph_execution_state.complete(invocation.id, outputs)
+
+                # Save the state changes
+                services.graph_execution_manager.set(graph_execution_state)
+
+                # Send complete event
+                services.events.emit_invocation_complete(
+                    graph_execution_state_id=graph_execution_state_id,
+                    invocation_id=invocation.id,
+                    result=outputs.dict(),
+                )
+
+            if stats is not None:
+                services.events.emit_invocation_stats(
+                    graph_execution_state_id=graph_execution_state_id,
+                    invocation_id=invocation.id,
+                    stats=stats.dict(),
+                )
+
+            # Queue any further commands if invoking all
+            is_complete = graph_execution_state.is_complete()
+            if queue_item.invoke_all and not is_complete:
+                self.__invoker.invoke(
+                    graph_execution_state,
+                    invoke_all=True,
+                    priority=queue_item.priority,
+                    owner=queue_item.owner,
+                )
+            elif is_complete and not was_complete:
+                services.events.emit_graph_execution_complete(
+                    graph_execution_state_id
+                )
+                completed_state = graph_execution_state
+
+        # Written outside of the session's lock
+        if completed_state is not None and services.images is not None:
+            for image in get_output_images(completed_state.results):
+                if image.image_type == ImageType.INTERMEDIATE:
+                    services.images.persist(image.image_type, image.image_name)
@@ -1,138 +1,510 @@
+import re
 import sqlite3
-from threading import Lock
-from typing import Generic, TypeVar, Union, get_args
+from contextlib import contextmanager
+from threading import Lock, local
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterator,
+    Optional,
+    TypeVar,
+    Union,
+    get_args,
+    get_origin,
+)
+from uuid import UUID
 
-from pydantic import BaseModel, parse_raw_as
+from pydantic import BaseModel, parse_obj_as
 
+from . import metrics
+from .item_codec import ItemCodec, JsonItemCodec, get_item_codec
 from .item_storage import ItemStorageABC, PaginatedResults
 
 T = TypeVar("T", bound=BaseModel)
 
 sqlite_memory = ":memory:"
 
+# Write-ahead logging lets readers keep reading while a write is in progress, and with it the
+# normal synchronous level only syncs at checkpoints (a crash can lose the last few commits, but
+# can't corrupt the database)
+DEFAULT_PRAGMAS: dict[str, Any] = dict(
+    journal_mode="wal",
+    synchronous="normal",
+    busy_timeout=5000,
+)
+
+# Max number of search result counts to cache
+MAX_CACHED_COUNTS = 128
+
+_pragma_pattern = re.compile(r"^-?\w+$")
+
+# Items are stored as JSON text unless another codec is used, and projected fields are always
+# stored as JSON text
+_json_codec = JsonItemCodec()
+
+
+def get_pragmas(pragmas: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+    """Gets the default pragmas updated with the given ones, which are checked to be valid"""
+    pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+    for name, value in pragmas.items():
+        if not name.isidentifier() or not _pragma_pattern.match(str(value)):
+            raise ValueError(f"Invalid SQLite pragma {name}={value}")
+    return pragmas
+
+
+def sqlite_connect(filename: str, pragmas: dict[str, Any], **kwargs) -> sqlite3.Connection:
+    """Opens a connection that can be used from any thread, and sets pragmas on it"""
+    conn = sqlite3.connect(filename, check_same_thread=False, **kwargs)
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value};")
+    return conn
+
+
+def get_search_text(value: Any) -> str:
+    """Gets the text to index an item's value by for search: all of the distinct strings in it"""
+    strings = dict()
+
+    def add_strings(value: Any) -> None:
+        if isinstance(value, str):
+            strings[value] = None
+        elif isinstance(value, UUID):
+            strings[str(value)] = None
+        elif isinstance(value, dict):
+            for v in value.values():
+                add_strings(v)
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            for v in value:
+                add_strings(v)
+
+    add_strings(value)
+    return "\n".join(strings)
+
+
+def get_match_query(query: str) -> str:
+    """Converts a search query to an FTS5 query that matches items containing words starting
+    with each word of the query"""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", query))
+
 
 class SqliteItemStorage(ItemStorageABC, Generic[T]):
+    """Stores items in a SQLite table, as JSON or encoded by another codec.
+
+    Writes are serialized on a single connection. Reads of a database file use a connection per
+    thread, so with write-ahead logging they don't wait for each other or for the writer. In-memory
+    databases can't be shared between connections, so they read and write on one connection.
+
+    Items are indexed for search in an FTS5 table, and are paged in the order they were first
+    added.
+
+    Items encoded to bytes (e.g. compressed) are stored alongside a JSON object of their id and
+    status fields. The status fields of items can be listed without parsing the items, for views
+    that don't need all of them.
+    """
+
     _filename: str
     _table_name: str
+    _search_table_name: str
     _conn: sqlite3.Connection
     _cursor: sqlite3.Cursor
     _id_field: str
     _lock: Lock
+    _pragmas: dict[str, Any]
+    _readers: local
+    _counts: dict[Optional[str], int]
+    _codec: ItemCodec
+    _status_fields: list[str]
+    _parser: Optional[Callable[[Any], T]]
 
-    def __init__(self, filename: str, table_name: str, id_field: str = "id"):
+    def __init__(
+        self,
+        filename: str,
+        table_name: str,
+        id_field: str = "id",
+        pragmas: Optional[dict[str, Any]] = None,
+        codec: Optional[ItemCodec] = None,
+        status_fields: Optional[list[str]] = None,
+    ):
         super().__init__()
 
         self._filename = filename
         self._table_name = table_name
+        self._search_table_name = f"{table_name}_search"
         self._id_field = id_field  # TODO: validate that T has this field
         self._lock = Lock()
+        self._pragmas = get_pragmas(pragmas)
+        self._readers = local()
+        self._counts = dict()
+        self._codec = codec or _json_codec
+        self._status_fields = [id_field, *(status_fields or [])]
+        self._parser = None
+
+        for field in self._status_fields:
+            if not field.isidentifier():
+                raise ValueError(f"Invalid status field {field}")
 
-        self._conn = sqlite3.connect(
-            self._filename, check_same_thread=False
-        )  # TODO: figure out a better threading solution
+        self._conn = self._connect()
         self._cursor = self._conn.cursor()
 
         self._create_table()
 
-    def _create_table(self):
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        return sqlite_connect(self._filename, self._pragmas, **kwargs)
+
+    @contextmanager
+    def _writing(self) -> Iterator[sqlite3.Cursor]:
+        """Gets the write cursor, holding the write lock and committing when done"""
+        with metrics.sqlite_operation_duration.time(self._table_name, "write"), self._lock:
+            try:
+                yield self._cursor
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                self._counts.pop(None, None)  # It may have counted rolled back changes
+                raise
+            finally:
+                # Any write can change search results, but writes keep the total up to date
+                self._counts = {k: v for k, v in self._counts.items() if k is None}
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Cursor]:
+        """Gets a cursor for this thread that reads a consistent snapshot of the database"""
+        with metrics.sqlite_operation_duration.time(self._table_name, "read"):
+            with self.__read_snapshot() as cursor:
+                yield cursor
+
+    @contextmanager
+    def __read_snapshot(self) -> Iterator[sqlite3.Cursor]:
+        if self._filename == sqlite_memory:
+            with self._lock:
+                yield self._cursor
+            return
+
+        cursor = getattr(self._readers, "cursor", None)
+        if cursor is None:
+            # Transactions are managed here, so the connection is opened in autocommit mode
+            conn = self._connect(isolation_level=None)
+            conn.execute("PRAGMA query_only = ON;")
+            cursor = self._readers.cursor = conn.cursor()
+
+        cursor.execute("BEGIN;")
         try:
-            self._lock.acquire()
-            self._cursor.execute(
+            yield cursor
+        finally:
+            cursor.execute("COMMIT;")
+
+    def _create_table(self):
+        with self._writing() as cursor:
+            cursor.execute(
                 f"""CREATE TABLE IF NOT EXISTS {self._table_name} (
                 item TEXT,
-                id TEXT GENERATED ALWAYS AS (json_extract(item, '$.{self._id_field}')) VIRTUAL NOT NULL);"""
+                id TEXT GENERATED ALWAYS AS (json_extract(item, '$.{self._id_field}')) VIRTUAL NOT NULL,
+                codec TEXT,
+                data BLOB);"""
             )
-            self._cursor.execute(
+
+            # Tables created before items could be encoded by other codecs only have JSON items
+            cursor.execute(f"""PRAGMA table_info({self._table_name});""")
+            columns = set(r[1] for r in cursor.fetchall())
+            for column, column_type in [("codec", "TEXT"), ("data", "BLOB")]:
+                if column not in columns:
+                    cursor.execute(
+                        f"""ALTER TABLE {self._table_name} ADD COLUMN {column} {column_type};"""
+                    )
+            cursor.execute(
                 f"""CREATE UNIQUE INDEX IF NOT EXISTS {self._table_name}_id ON {self._table_name}(id);"""
             )
-        finally:
-            self._lock.release()
 
-    def _parse_item(self, item: str) -> T:
-        item_type = get_args(self.__orig_class__)[0]
-        return parse_raw_as(item_type, item)
+            cursor.execute(
+                """SELECT count(*) FROM sqlite_master WHERE name = ?;""",
+                (self._search_table_name,),
+            )
+            has_search_table = cursor.fetchone()[0] > 0
+            cursor.execute(
+                f"""CREATE VIRTUAL TABLE IF NOT EXISTS {self._search_table_name} USING fts5(text);"""
+            )
+
+            # Index items that were stored before there was a search index
+            if not has_search_table:
+                cursor.execute(
+                    f"""SELECT rowid, item, codec, data FROM {self._table_name};"""
+                )
+                cursor.executemany(
+                    f"""INSERT INTO {self._search_table_name} (rowid, text) VALUES (?, ?);""",
+                    [
+                        (r[0], get_search_text(self._decode_row(r[1:])))
+                        for r in cursor.fetchall()
+                    ],
+                )
 
-    def set(self, item: T):
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
-                f"""INSERT OR REPLACE INTO {self._table_name} (item) VALUES (?);""",
-                (item.json(),),
+    def _get_item_type(self) -> Any:
+        """Gets the type of the items, from SqliteItemStorage[T] or a subclass of it"""
+        orig_class = getattr(self, "__orig_class__", None)
+        if orig_class is not None:
+            return get_args(orig_class)[0]
+
+        for cls in type(self).__mro__:
+            for base in getattr(cls, "__orig_bases__", ()):
+                args = get_args(base)
+                if (
+                    get_origin(base) is SqliteItemStorage
+                    and len(args) > 0
+                    and not isinstance(args[0], TypeVar)
+                ):
+                    return args[0]
+        raise TypeError(f"The item type of {type(self).__name__} is not known")
+
+    def _parse_item(self, value: Any) -> T:
+        """Parses an item from its decoded value"""
+        # Finding the item type (and for types other than models, building a model to parse it
+        # with) is only done once
+        if self._parser is None:
+            item_type = self._get_item_type()
+            if isinstance(item_type, type) and issubclass(item_type, BaseModel):
+                self._parser = item_type.parse_obj
+            else:
+                self._parser = lambda v: parse_obj_as(item_type, v)
+        return self._parser(value)
+
+    def _decode_row(self, row: tuple[str, Optional[str], Optional[bytes]]) -> Any:
+        """Decodes the (item, codec, data) columns of a row"""
+        item, codec, data = row
+        if codec is None:
+            return _json_codec.decode(item)
+        return get_item_codec(codec).decode(data)
+
+    def _write_item(self, cursor: sqlite3.Cursor, item: T) -> int:
+        """Inserts or updates an item and its search index, returning the size it was encoded
+        to. Updated items keep their place in the paging order."""
+        value = item.dict()
+        encoded = self._codec.encode(value)
+        if isinstance(encoded, str):
+            row = (encoded, None, None)
+        else:
+            status = {f: value.get(f) for f in self._status_fields}
+            row = (_json_codec.encode(status), self._codec.name, encoded)
+
+        id = str(getattr(item, self._id_field))
+        cursor.execute(
+            f"""SELECT rowid FROM {self._table_name} WHERE id = ?;""", (id,)
+        )
+        result = cursor.fetchone()
+        if result is None:
+            cursor.execute(
+                f"""INSERT INTO {self._table_name} (item, codec, data) VALUES (?, ?, ?);""",
+                row,
             )
-        finally:
-            self._lock.release()
+            rowid = cursor.lastrowid
+            if None in self._counts:
+                self._counts[None] += 1
+        else:
+            rowid = result[0]
+            cursor.execute(
+                f"""UPDATE {self._table_name} SET item = ?, codec = ?, data = ? WHERE rowid = ?;""",
+                row + (rowid,),
+            )
+
+        cursor.execute(
+            f"""INSERT OR REPLACE INTO {self._search_table_name} (rowid, text) VALUES (?, ?);""",
+            (rowid, get_search_text(value)),
+        )
+        return len(encoded)
+
+    def _delete_item(self, cursor: sqlite3.Cursor, id: str) -> None:
+        cursor.execute(
+            f"""SELECT rowid FROM {self._table_name} WHERE id = ?;""", (id,)
+        )
+        result = cursor.fetchone()
+        if result is None:
+            return
+
+        cursor.execute(
+            f"""DELETE FROM {self._table_name} WHERE rowid = ?;""", (result[0],)
+        )
+        cursor.execute(
+            f"""DELETE FROM {self._search_table_name} WHERE rowid = ?;""", (result[0],)
+        )
+        if None in self._counts:
+            self._counts[None] -= 1
+
+    def set(self, item: T):
+        with self._writing() as cursor:
+            self._write_item(cursor, item)
         self._on_changed(item)
 
     def get(self, id: str) -> Union[T, None]:
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
-                f"""SELECT item FROM {self._table_name} WHERE id = ?;""", (str(id),)
+        with self._reading() as cursor:
+            cursor.execute(
+                f"""SELECT item, codec, data FROM {self._table_name} WHERE id = ?;""",
+                (str(id),),
             )
-            result = self._cursor.fetchone()
-        finally:
-            self._lock.release()
+            result = cursor.fetchone()
 
         if not result:
             return None
 
-        return self._parse_item(result[0])
+        return self._parse_item(self._decode_row(result))
 
     def delete(self, id: str):
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
-                f"""DELETE FROM {self._table_name} WHERE id = ?;""", (str(id),)
-            )
-        finally:
-            self._lock.release()
+        with self._writing() as cursor:
+            self._delete_item(cursor, str(id))
         self._on_deleted(id)
 
-    def list(self, page: int = 0, per_page: int = 10) -> PaginatedResults[T]:
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
-                f"""SELECT item FROM {self._table_name} LIMIT ? OFFSET ?;""",
-                (per_page, page * per_page),
-            )
-            result = self._cursor.fetchall()
+    def set_many(self, items: list[T]) -> None:
+        with self._writing() as cursor:
+            for item in items:
+                self._write_item(cursor, item)
+        for item in items:
+            self._on_changed(item)
 
-            items = list(map(lambda r: self._parse_item(r[0]), result))
+    def get_many(self, ids: list[str]) -> list[Optional[T]]:
+        ids = [str(id) for id in ids]
+        with self._reading() as cursor:
+            rows = self._read_rows(cursor, ids)
+            related = self._read_related(cursor, [id for id in ids if id in rows])
 
-            self._cursor.execute(f"""SELECT count(*) FROM {self._table_name};""")
-            count = self._cursor.fetchone()[0]
-        finally:
-            self._lock.release()
+        related_by_id = dict(zip([id for id in ids if id in rows], related))
+        return [
+            self._parse_row(rows[id], related_by_id[id]) if id in rows else None
+            for id in ids
+        ]
 
-        pageCount = int(count / per_page) + 1
+    def delete_many(self, ids: list[str]) -> None:
+        with self._writing() as cursor:
+            for id in ids:
+                self._delete_item(cursor, str(id))
+        for id in ids:
+            self._on_deleted(id)
 
-        return PaginatedResults[T](
-            items=items, page=page, pages=pageCount, per_page=per_page, total=count
+    def _read_rows(self, cursor: sqlite3.Cursor, ids: list[str]) -> dict[str, tuple]:
+        """Reads the (item, codec, data) rows of the items with the given ids, by id"""
+        rows = dict()
+        # Stay well under SQLite's limit on the number of query parameters
+        for i in range(0, len(ids), 500):
+            chunk = ids[i : i + 500]
+            cursor.execute(
+                f"""SELECT id, item, codec, data FROM {self._table_name} WHERE id IN ({", ".join("?" * len(chunk))});""",
+                chunk,
+            )
+            rows.update((r[0], r[1:]) for r in cursor.fetchall())
+        return rows
+
+    def _get_search_filter(self, query: str) -> tuple[str, tuple]:
+        """Gets the condition (and its parameters) that items matching a query meet"""
+        match_query = get_match_query(query)
+        if match_query == "":
+            return ("", ())
+        return (
+            f"""rowid IN (SELECT rowid FROM {self._search_table_name} WHERE {self._search_table_name} MATCH ?)""",
+            (match_query,),
         )
 
-    def search(
-        self, query: str, page: int = 0, per_page: int = 10
-    ) -> PaginatedResults[T]:
-        try:
-            self._lock.acquire()
-            self._cursor.execute(
-                f"""SELECT item FROM {self._table_name} WHERE item LIKE ? LIMIT ? OFFSET ?;""",
-                (f"%{query}%", per_page, page * per_page),
-            )
-            result = self._cursor.fetchall()
+    def _read_related(self, cursor: sqlite3.Cursor, ids: list[str]) -> list[Any]:
+        """Reads anything besides the items that is needed to parse them"""
+        return [None] * len(ids)
+
+    def _parse_row(self, row: tuple, related: Any) -> T:
+        """Parses an item from its (item, codec, data) row and what was read with it"""
+        return self._parse_item(self._decode_row(row))
+
+    def _parse_status_row(self, row: tuple, related: Any) -> dict[str, Any]:
+        """Parses an item's status fields from its (status) row and what was read with it"""
+        return dict(zip(self._status_fields, _json_codec.decode(row[0])))
+
+    def _get_count(self, where: str, parameters: tuple, key: Optional[str]) -> int:
+        """Gets the number of items meeting a condition, cached under a key until the next write
+        (or always, for the total number of items)"""
+        count = self._counts.get(key)
+        if count is not None:
+            return count
+
+        with self._lock:
+            count = self._counts.get(key)
+            if count is None:
+                self._cursor.execute(
+                    f"""SELECT count(*) FROM {self._table_name} {f"WHERE {where}" if where else ""};""",
+                    parameters,
+                )
+                count = self._cursor.fetchone()[0]
+                if len(self._counts) >= MAX_CACHED_COUNTS:
+                    self._counts.clear()
+                self._counts[key] = count
+        return count
 
-            items = list(map(lambda r: self._parse_item(r[0]), result))
+    def _get_page(
+        self,
+        where: str,
+        parameters: tuple,
+        count_key: Optional[str],
+        page: int,
+        per_page: int,
+        cursor: Optional[str],
+        columns: str = "item, codec, data",
+        parse_row: Optional[Callable[[tuple, Any], Any]] = None,
+    ) -> PaginatedResults:
+        # With a cursor, the page starts after the last item of the previous page, which is
+        # found in the rowid index instead of by skipping over all of the items before it
+        conditions = [where] if where else []
+        page_parameters = parameters
+        if cursor is not None:
+            conditions.append("rowid > ?")
+            page_parameters = parameters + (int(cursor),)
+        offset = 0 if cursor is not None else page * per_page
 
-            self._cursor.execute(
-                f"""SELECT count(*) FROM {self._table_name} WHERE item LIKE ?;""",
-                (f"%{query}%",),
+        with self._reading() as db_cursor:
+            db_cursor.execute(
+                f"""SELECT rowid, id, {columns} FROM {self._table_name} {f"WHERE {' AND '.join(conditions)}" if conditions else ""}
+                ORDER BY rowid LIMIT ? OFFSET ?;""",
+                page_parameters + (per_page + 1, offset),
             )
-            count = self._cursor.fetchone()[0]
-        finally:
-            self._lock.release()
+            result = db_cursor.fetchall()
+            related = self._read_related(db_cursor, [r[1] for r in result[:per_page]])
+
+        parse_row = parse_row or self._parse_row
+        items = [parse_row(r[2:], d) for r, d in zip(result, related)]
+        next_cursor = str(result[per_page - 1][0]) if len(result) > per_page else None
 
+        count = self._get_count(where, parameters, count_key)
         pageCount = int(count / per_page) + 1
 
-        return PaginatedResults[T](
-            items=items, page=page, pages=pageCount, per_page=per_page, total=count
+        return PaginatedResults[Any](
+            items=items,
+            page=page,
+            pages=pageCount,
+            per_page=per_page,
+            total=count,
+            next_cursor=next_cursor,
+        )
+
+    def list(
+        self, page: int = 0, per_page: int = 10, cursor: Optional[str] = None
+    ) -> PaginatedResults[T]:
+        return self._get_page("", (), None, page, per_page, cursor)
+
+    def search(
+        self,
+        query: str,
+        page: int = 0,
+        per_page: int = 10,
+        cursor: Optional[str] = None,
+    ) -> PaginatedResults[T]:
+        where, parameters = self._get_search_filter(query)
+        return self._get_page(
+            where, parameters, f"search:{query}" if where else None, page, per_page, cursor
+        )
+
+    def list_status(
+        self, page: int = 0, per_page: int = 10, cursor: Optional[str] = None
+    ) -> PaginatedResults[dict[str, Any]]:
+        """Lists the id and status fields of items, without parsing them"""
+        columns = ", ".join(f"json_extract(item, '$.{f}')" for f in self._status_fields)
+        return self._get_page(
+            "",
+            (),
+            None,
+            page,
+            per_page,
+            cursor,
+            columns=f"json_array({columns})",
+            parse_row=self._parse_status_row,
         )
@@ -1,7 +1,8 @@
 import torch
 from PIL import Image
 from ..invocations.baseinvocation import InvocationContext
-from ...backend.util.util import image_to_dataURL
+from ..services import metrics
+from ...backend.util.util import encode_progress_frame
 from ...backend.generator.base import Generator
 from ...backend.stable_diffusion import PipelineIntermediateState
 
@@ -9,26 +10,46 @@ class CanceledException(Exception):
     pass
 
 def fast_latents_step_callback(sample: torch.Tensor, step: int, steps: int, id: str, context: InvocationContext, ):
-    # TODO: only output a preview image when requested
-    image = Generator.sample_to_lowres_estimated_image(sample)
-
-    (width, height) = image.size
-    width *= 8
-    height *= 8
-
-    dataURL = image_to_dataURL(image, image_format="JPEG")
-
-    context.services.events.emit_generator_progress(
-        context.graph_execution_state_id,
-        id,
-        {
-            "width": width,
-            "height": height,
-            "dataURL": dataURL
-        },
-        step,
-        steps,
+    metrics.diffusion_steps.inc()
+
+    # Don't render previews that nobody will see, or that would be sent faster than the max frame rate
+    if not context.services.events.should_emit_progress(context.graph_execution_state_id, step, steps):
+        return
+
+    def emit_progress(image: Image.Image) -> None:
+        (width, height) = image.size
+        width *= 8
+        height *= 8
+
+        frame_format = context.services.events.progress_frame_format
+
+        context.services.events.emit_generator_progress(
+            context.graph_execution_state_id,
+            id,
+            {
+                "width": width,
+                "height": height,
+                "format": frame_format,
+                "data": encode_progress_frame(image, frame_format),
+            },
+            step,
+            steps,
+        )
+
+    # The preview is encoded and emitted off the diffusion thread. It's dropped if the previews
+    # of this invocation's earlier steps are still being encoded, unless it's the last step.
+    rendering = Generator.preview_renderer.render_async(
+        sample,
+        emit_progress,
+        block=step >= steps - 1,
+        key=(context.graph_execution_state_id, id),
     )
+    if rendering is not None:
+        context.services.events.record_progress(context.graph_execution_state_id)
+
+def flush_progress(context: InvocationContext, id: str) -> None:
+    """Waits for the progress of an invocation's steps so far to be emitted"""
+    Generator.preview_renderer.flush(key=(context.graph_execution_state_id, id))
 
 def diffusers_step_callback_adapter(*cb_args, **kwargs):
     """
@@ -678,6 +678,109 @@ class Args(object):
             action="store_true",
             help="Generates debugging image to display",
         )
+        render_group.add_argument(
+            "--cpu_workers",
+            type=int,
+            default=0,
+            help="Number of worker threads that run invocations which don't use the GPU (e.g. crop, paste, blur) in the node-based interfaces. 0 runs all invocations on a single worker. [0]",
+        )
+        render_group.add_argument(
+            "--batch_window",
+            type=float,
+            default=0.0,
+            help="Seconds that txt2img and img2img invocations in the node-based interfaces wait for compatible invocations (same model, size, steps, sampler and cfg_scale) to be queued, so they can be denoised in one batch. 0 disables batching. [0]",
+        )
+        render_group.add_argument(
+            "--max_batch_size",
+            type=int,
+            default=4,
+            help="Max number of invocations denoised in one batch when --batch_window is set. [4]",
+        )
+        render_group.add_argument(
+            "--progress_max_fps",
+            type=float,
+            default=10.0,
+            help="Max number of progress images sent per second for each session in the node-based interfaces. Progress images are only rendered when a client is subscribed to the session. 0 sends one for every step. [10]",
+        )
+        render_group.add_argument(
+            "--progress_frame_format",
+            choices=["jpeg", "webp", "rgb"],
+            default="jpeg",
+            help="Format of the progress images sent as binary frames to clients of the node-based interfaces that subscribe with progress_frames. rgb sends the raw uint8 pixels. Other clients get the progress images as dataURLs. [jpeg]",
+        )
+        render_group.add_argument(
+            "--profile_dir",
+            type=str,
+            default=None,
+            help="Directory to write a Chrome trace (chrome://tracing) of the stages of generation (text encoding, UNet, scheduler, VAE) of each invocation in the node-based interfaces to. Profiling is disabled when not set.",
+        )
+        render_group.add_argument(
+            "--image_cache_mb",
+            type=int,
+            default=256,
+            help="Megabytes of decoded images the node-based interfaces keep in memory, evicting the least recently used, so images used by several nodes aren't loaded from disk each time. 0 disables the cache. [256]",
+        )
+        render_group.add_argument(
+            "--image_write_workers",
+            type=int,
+            default=0,
+            help="Number of threads that write images saved by the node-based interfaces in the background, so invocations don't wait for images to be encoded and written. Images are served from memory until they are written, and are all written before shutting down. 0 writes images before invocations complete. [0]",
+        )
+        render_group.add_argument(
+            "--intermediate_memory_mb",
+            type=int,
+            default=0,
+            help="Megabytes of intermediate images the node-based interfaces keep in memory rather than writing them, so the nodes that use them get them without encoding or decoding them. They are written when their session completes, when they are requested, or when they don't fit. 0 writes intermediate images when they are saved. [0]",
+        )
+        render_group.add_argument(
+            "--result_image_codec",
+            choices=["png", "png-fast", "png-uncompressed", "webp-lossless", "webp", "jpeg"],
+            default="png",
+            help="How the node-based interfaces encode result images. 'png-fast' and 'png-uncompressed' are faster to encode but bigger, 'webp-lossless' is smaller, and 'webp' and 'jpeg' are much smaller but lossy. Images keep their names whatever the format, and images written with any codec can still be read. [png]",
+        )
+        render_group.add_argument(
+            "--intermediate_image_codec",
+            choices=["png", "png-fast", "png-uncompressed", "webp-lossless", "webp", "jpeg", "npy"],
+            default="png-fast",
+            help="How the node-based interfaces encode intermediate images, which are only read by the next nodes. 'npy' stores uncompressed pixels that are memory-mapped rather than decoded when read, and are converted to PNG when served. [png-fast]",
+        )
+        render_group.add_argument(
+            "--invocation_cache_size",
+            type=int,
+            default=0,
+            help="Number of invocation outputs to remember in the node-based interfaces, so re-running an identical invocation with a fixed seed reuses its output. 0 disables the cache. [0]",
+        )
+        render_group.add_argument(
+            "--session_storage",
+            choices=["full", "delta"],
+            default="full",
+            help="How the node-based interfaces save sessions. 'full' writes the whole session each time a node completes; 'delta' appends only what changed, which writes far less for large iterated graphs. [full]",
+        )
+        render_group.add_argument(
+            "--session_codec",
+            choices=["json", "json+zlib", "msgpack", "msgpack+zlib"],
+            default="json",
+            help="How the node-based interfaces encode saved sessions. '+zlib' compresses them, which makes the session database much smaller. 'msgpack' requires msgpack to be installed. Sessions saved with any codec can still be read. [json]",
+        )
+        render_group.add_argument(
+            "--session_flush_interval",
+            type=float,
+            default=0,
+            help="Seconds the node-based interfaces may hold session changes in memory before writing them, so repeated saves of a session are written once. 0 writes every save straight away. [0]",
+        )
+        render_group.add_argument(
+            "--invocation_queue",
+            choices=["fair", "memory", "sqlite"],
+            default="fair",
+            help="How the node-based interfaces queue invocations. 'fair' runs single invocations ahead of invoking whole graphs, and takes turns between sessions; 'memory' runs them in the order they were queued; 'sqlite' is like 'fair', but stores the queue and cancellations in the session database so queued and interrupted invocations are resumed after a restart. [fair]",
+        )
+        render_group.add_argument(
+            "--sqlite_pragma",
+            action="append",
+            default=[],
+            metavar="NAME=VALUE",
+            help="Sets a pragma on the node-based interfaces' session database (e.g. synchronous=full). May be given more than once. Sessions are stored with journal_mode=wal and synchronous=normal by default.",
+        )
         render_group.add_argument(
             "--karras_max",
             type=int,
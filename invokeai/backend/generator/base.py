@@ -29,7 +29,8 @@ from ..image_util import configure_model_padding
 from ..util.util import rand_perlin_2d
 from ..safety_checker import SafetyChecker
 from ..prompting.conditioning import get_uc_and_c_and_ec
-from ..stable_diffusion.diffusers_pipeline import StableDiffusionGeneratorPipeline
+from ..stable_diffusion.diffusers_pipeline import PipelineIntermediateState, StableDiffusionGeneratorPipeline
+from ..stable_diffusion.latent_preview import LatentPreviewRenderer
 
 downsampling = 8
 
@@ -138,17 +139,7 @@ class InvokeAIGenerator(metaclass=ABCMeta):
                                     generator_args.get('with_variations')
                                     )
 
-        if isinstance(model, DiffusionPipeline):
-            for component in [model.unet, model.vae]:
-                configure_model_padding(component,
-                                        generator_args.get('seamless',False),
-                                        generator_args.get('seamless_axes')
-                                        )
-        else:
-            configure_model_padding(model,
-                                    generator_args.get('seamless',False),
-                                    generator_args.get('seamless_axes')
-                                    )
+        self._configure_model_padding(model, generator_args)
 
         iteration_count = range(iterations) if iterations else itertools.count(start=0, step=1)
         for i in iteration_count:
@@ -169,6 +160,83 @@ class InvokeAIGenerator(metaclass=ABCMeta):
                 callback(output)
             yield output
 
+    def generate_batch(self,
+                       prompts: List[str],
+                       seeds: List[Optional[int]],
+                       step_callbacks: Optional[List[Optional[Callable]]]=None,
+                       init_images: Optional[List[Image.Image]]=None,
+                       **keyword_args,
+                       )->List[InvokeAIGeneratorOutput]:
+        '''
+        Return an InvokeAIGeneratorOutput for each of the prompts, denoising as many
+        of them as possible together in one batch. Each prompt has its own seed
+        (None for a random one), step callback and, for img2img, initial image; all
+        the other parameters are shared.
+
+           outputs = txt2img.generate_batch(prompts=['banana sushi', 'apple pie'],
+                                            seeds=[1, 2])
+
+        Prompts that can't share a batch (e.g. ones that encode to a different
+        number of tokens, or that use cross-attention control) are generated in
+        smaller batches. With deterministic schedulers the images are the same as
+        calling generate() for each prompt, up to numerical differences.
+        '''
+        step_callbacks = step_callbacks or [None] * len(prompts)
+        if self.params.variation_amount > 0:
+            # Variations are made from the noise of a single seed, so they aren't batched
+            init_args = lambda i: dict() if init_images is None else dict(init_image=init_images[i])
+            return [next(self.generate(prompt=prompts[i],
+                                       step_callback=step_callbacks[i],
+                                       seed=seeds[i],
+                                       **init_args(i),
+                                       **keyword_args,
+                                       ))
+                    for i in range(len(prompts))
+                    ]
+
+        generator_args = dataclasses.asdict(self.params)
+        generator_args.update(keyword_args)
+        generator_args.pop('seed', None)
+
+        model_info = self.model_info
+        model:StableDiffusionGeneratorPipeline = model_info['model']
+        scheduler: Scheduler = self.get_scheduler(
+            model=model,
+            scheduler_name=generator_args.get('scheduler')
+        )
+        conditionings = [get_uc_and_c_and_ec(prompt,model=model) for prompt in prompts]
+        generator = self._generator_class()(model, self.params.precision)
+        self._configure_model_padding(model, generator_args)
+
+        # Group the prompts whose conditioning (and initial images) can be concatenated
+        batches = dict()
+        for i, (uc, c, extra_conditioning_info) in enumerate(conditionings):
+            if extra_conditioning_info is not None and extra_conditioning_info.wants_cross_attention_control:
+                key = ('unbatched', i)
+            else:
+                key = (uc.shape, c.shape, None if init_images is None else init_images[i].size)
+            batches.setdefault(key, []).append(i)
+
+        outputs = [None] * len(prompts)
+        for indices in batches.values():
+            results = generator.generate_batch(
+                conditionings=[conditionings[i] for i in indices],
+                seeds=[seeds[i] for i in indices],
+                step_callbacks=[step_callbacks[i] for i in indices],
+                init_images=None if init_images is None else [init_images[i] for i in indices],
+                sampler=scheduler,
+                **generator_args,
+            )
+            for i, (image, seed) in zip(indices, results):
+                outputs[i] = InvokeAIGeneratorOutput(
+                    image=image,
+                    seed=seed,
+                    attention_maps_images=[],
+                    model_hash=model_info['hash'],
+                    params=Namespace(model_name=model_info['model_name'], seed=seed, **generator_args),
+                )
+        return outputs
+
     @classmethod
     def schedulers(self)->List[str]:
         '''
@@ -187,6 +255,19 @@ class InvokeAIGenerator(metaclass=ABCMeta):
             scheduler.uses_inpainting_model = lambda: False
         return scheduler
 
+    def _configure_model_padding(self, model: StableDiffusionGeneratorPipeline, generator_args: dict):
+        if isinstance(model, DiffusionPipeline):
+            for component in [model.unet, model.vae]:
+                configure_model_padding(component,
+                                        generator_args.get('seamless',False),
+                                        generator_args.get('seamless_axes')
+                                        )
+        else:
+            configure_model_padding(model,
+                                    generator_args.get('seamless',False),
+                                    generator_args.get('seamless_axes')
+                                    )
+
     @classmethod
     def _generator_class(cls)->Type[Generator]:
         '''
@@ -281,6 +362,9 @@ class Generator:
     precision: str
     model: DiffusionPipeline
 
+    # Shared by all pipelines, the latent to RGB factors are the same for all SD 1.x models
+    preview_renderer: LatentPreviewRenderer = LatentPreviewRenderer()
+
     def __init__(self, model: DiffusionPipeline, precision: str):
         self.model = model
         self.precision = precision
@@ -305,6 +389,16 @@ class Generator:
             "image_iterator() must be implemented in a descendent class"
         )
 
+    # this is overridden in img2img.py and txt2img.py, for the generators that can make batches
+    def get_make_images(self, conditioning, **kwargs):
+        """
+        Returns a function returning an image for each of a batch of initial noise,
+        derived from the conditioning of each (concatenated in the same order)
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} can't generate batches of images"
+        )
+
     def set_variation(self, seed, variation_amount, with_variations):
         self.seed = seed
         self.variation_amount = variation_amount
@@ -407,6 +501,82 @@ class Generator:
 
         return results
 
+    def generate_batch(
+        self,
+        conditionings,
+        seeds,
+        width,
+        height,
+        sampler,
+        step_callbacks=None,
+        perlin=0.0,
+        safety_checker: SafetyChecker=None,
+        free_gpu_mem: bool = False,
+        **kwargs,
+    ):
+        """
+        Generates an image for each of the conditionings, denoising them together in
+        one batch. The initial noise of each is made from its own seed (a new one if it
+        is None or negative), the same way generate() makes it. Returns [image, seed]
+        for each.
+
+        The conditionings must have embeddings of the same shape, and no cross-attention
+        control.
+        """
+        self.safety_checker = safety_checker
+        self.free_gpu_mem = free_gpu_mem
+
+        # Extra conditioning info is only needed for cross-attention control
+        conditioning = (
+            torch.cat([uc for uc, _, _ in conditionings]),
+            torch.cat([c for _, c, _ in conditionings]),
+            None,
+        )
+        make_images = self.get_make_images(
+            conditioning=conditioning,
+            sampler=sampler,
+            width=width,
+            height=height,
+            step_callback=self.split_step_callback(step_callbacks),
+            perlin=perlin,
+            **kwargs,
+        )
+
+        seeds = [seed if seed is not None and seed >= 0 else self.new_seed() for seed in seeds]
+        noise = []
+        for seed in seeds:
+            set_seed(seed)
+            noise.append(self.get_noise(width, height))
+
+        images = make_images(torch.cat(noise), seeds)
+        if self.safety_checker is not None:
+            images = [self.safety_checker.check(image) for image in images]
+
+        return [[image, seed] for image, seed in zip(images, seeds)]
+
+    @staticmethod
+    def split_step_callback(step_callbacks: Optional[List[Optional[Callable]]]) -> Optional[Callable]:
+        """
+        Returns a step callback for a batch that calls the step callback of each
+        item in the batch with only its own latents
+        """
+        if step_callbacks is None or all(callback is None for callback in step_callbacks):
+            return None
+
+        def step_callback(state: PipelineIntermediateState):
+            for i, callback in enumerate(step_callbacks):
+                if callback is None:
+                    continue
+                callback(dataclasses.replace(
+                    state,
+                    latents=state.latents[i:i+1],
+                    predicted_original=(
+                        None if state.predicted_original is None else state.predicted_original[i:i+1]
+                    ),
+                ))
+
+        return step_callback
+
     def sample_to_image(self, samples) -> Image.Image:
         """
         Given samples returned from a sampler, converts
@@ -500,31 +670,7 @@ class Generator:
 
     @staticmethod
     def sample_to_lowres_estimated_image(samples):
-        # origingally adapted from code by @erucipe and @keturn here:
-        # https://discuss.huggingface.co/t/decoding-latents-to-rgb-without-upscaling/23204/7
-
-        # these updated numbers for v1.5 are from @torridgristle
-        v1_5_latent_rgb_factors = torch.tensor(
-            [
-                #    R        G        B
-                [0.3444, 0.1385, 0.0670],  # L1
-                [0.1247, 0.4027, 0.1494],  # L2
-                [-0.3192, 0.2513, 0.2103],  # L3
-                [-0.1307, -0.1874, -0.7445],  # L4
-            ],
-            dtype=samples.dtype,
-            device=samples.device,
-        )
-
-        latent_image = samples[0].permute(1, 2, 0) @ v1_5_latent_rgb_factors
-        latents_ubyte = (
-            ((latent_image + 1) / 2)
-            .clamp(0, 1)  # change scale from -1..1 to 0..1
-            .mul(0xFF)  # to 0..255
-            .byte()
-        ).cpu()
-
-        return Image.fromarray(latents_ubyte.numpy())
+        return Generator.preview_renderer.render(samples)
 
     def generate_initial_noise(self, seed, width, height):
         initial_noise = None
@@ -30,12 +30,14 @@ class Embiggen(Generator):
         make_image = self.get_make_image(prompt, step_callback=step_callback, **kwargs)
         results = []
         seed = seed if seed else self.new_seed()
+        # The tiles are seeded from self.seed
+        self.seed = seed
 
         # Noise will be generated by the Img2Img generator when called
         for _ in trange(iterations, desc="Generating"):
             # make_image will call Img2Img which will do the equivalent of get_noise itself
             image = make_image()
-            results.append([image, seed])
+            results.append([image, seed, []])  # No attention maps
             if image_callback is not None:
                 image_callback(image, seed, prompt_in=prompt)
             seed = self.new_seed()
@@ -20,15 +20,22 @@ class Img2Img(Generator):
         super().__init__(model, precision)
         self.init_latent = None  # by get_noise()
 
-    def get_make_image(
+    def get_make_image(self, prompt, init_image, **kwargs):
+        """
+        Returns a function returning an image derived from the prompt and the initial image
+        Return value depends on the seed at the time you call it.
+        """
+        make_images = self.get_make_images(init_images=[init_image], **kwargs)
+        return lambda x_T, seed: make_images(x_T, [seed])[0]
+
+    def get_make_images(
         self,
-        prompt,
         sampler,
         steps,
         cfg_scale,
         ddim_eta,
         conditioning,
-        init_image,
+        init_images,
         strength,
         step_callback=None,
         threshold=0.0,
@@ -40,8 +47,8 @@ class Img2Img(Generator):
         **kwargs,
     ):
         """
-        Returns a function returning an image derived from the prompt and the initial image
-        Return value depends on the seed at the time you call it.
+        Returns a function returning an image for each of a batch of initial images (which
+        must all be the same size), derived from the conditioning of each and the seed of each.
         """
         self.perlin = perlin
 
@@ -63,29 +70,34 @@ class Img2Img(Generator):
             ),
         ).add_scheduler_args_if_applicable(pipeline.scheduler, eta=ddim_eta)
 
-        def make_image(x_T: torch.Tensor, seed: int):
+        def make_images(x_T: torch.Tensor, seeds: list[int]):
             # FIXME: use x_T for initial seeded noise
             # We're not at the moment because the pipeline automatically resizes init_image if
             # necessary, which the x_T input might not match.
             # In the meantime, reset the seed prior to generating pipeline output so we at least get the same result.
             logging.set_verbosity_error()  # quench safety check warnings
-            pipeline_output = pipeline.img2img_from_embeddings(
-                init_image,
-                strength,
+            latents_and_noise = [
+                pipeline.img2img_latents_and_noise(
+                    init_image, noise_func=self.get_noise_like, seed=seed
+                )
+                for init_image, seed in zip(init_images, seeds)
+            ]
+            pipeline_output = pipeline.img2img_from_latents_and_embeddings(
+                torch.cat([latents for latents, _ in latents_and_noise]),
                 steps,
                 conditioning_data,
-                noise_func=self.get_noise_like,
+                strength,
+                torch.cat([noise for _, noise in latents_and_noise]),
                 callback=step_callback,
-                seed=seed,
             )
             if (
                 pipeline_output.attention_map_saver is not None
                 and attention_maps_callback is not None
             ):
                 attention_maps_callback(pipeline_output.attention_map_saver)
-            return pipeline.numpy_to_pil(pipeline_output.images)[0]
+            return pipeline.numpy_to_pil(pipeline_output.images)
 
-        return make_image
+        return make_images
 
     def get_noise_like(self, like: torch.Tensor):
         device = like.device
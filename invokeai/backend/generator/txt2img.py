@@ -17,9 +17,18 @@ class Txt2Img(Generator):
         super().__init__(model, precision)
 
     @torch.no_grad()
-    def get_make_image(
+    def get_make_image(self, prompt, **kwargs):
+        """
+        Returns a function returning an image derived from the prompt and the initial image
+        Return value depends on the seed at the time you call it
+        kwargs are 'width' and 'height'
+        """
+        make_images = self.get_make_images(**kwargs)
+        return lambda x_T, seed: make_images(x_T, [seed])[0]
+
+    @torch.no_grad()
+    def get_make_images(
         self,
-        prompt,
         sampler,
         steps,
         cfg_scale,
@@ -37,9 +46,8 @@ class Txt2Img(Generator):
         **kwargs,
     ):
         """
-        Returns a function returning an image derived from the prompt and the initial image
-        Return value depends on the seed at the time you call it
-        kwargs are 'width' and 'height'
+        Returns a function returning an image for each of a batch of initial noise,
+        derived from the conditioning of each (concatenated in the same order)
         """
         self.perlin = perlin
 
@@ -61,7 +69,7 @@ class Txt2Img(Generator):
             ),
         ).add_scheduler_args_if_applicable(pipeline.scheduler, eta=ddim_eta)
 
-        def make_image(x_T: torch.Tensor, _: int) -> PIL.Image.Image:
+        def make_images(x_T: torch.Tensor, _: list[int]) -> list[PIL.Image.Image]:
             pipeline_output = pipeline.image_from_embeddings(
                 latents=torch.zeros_like(x_T, dtype=self.torch_dtype()),
                 noise=x_T,
@@ -76,6 +84,6 @@ class Txt2Img(Generator):
             ):
                 attention_maps_callback(pipeline_output.attention_map_saver)
 
-            return pipeline.numpy_to_pil(pipeline_output.images)[0]
+            return pipeline.numpy_to_pil(pipeline_output.images)
 
-        return make_image
+        return make_images
@@ -80,6 +80,11 @@ class ModelManager(object):
         self.sequential_offload = sequential_offload
         self.embedding_path = embedding_path
 
+        # Counts of model cache use, since the manager was created
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
     def valid_model(self, model_name: str) -> bool:
         """
         Given a model name, returns True if it is a valid
@@ -108,6 +113,7 @@ class ModelManager(object):
             self.offload_model(self.current_model)
 
         if model_name in self.models:
+            self.cache_hits += 1
             requested_model = self.models[model_name]["model"]
             print(f">> Retrieving model {model_name} from system RAM cache")
             requested_model.ready()
@@ -116,6 +122,7 @@ class ModelManager(object):
             hash = self.models[model_name]["hash"]
 
         else:  # we're about to load a new model, so potentially offload the least recently used one
+            self.cache_misses += 1
             requested_model, width, height, hash = self._load_model(model_name)
             self.models[model_name] = {
                 "model_name": model_name,
@@ -900,6 +907,7 @@ class ModelManager(object):
             )
             if least_recent_model is not None:
                 del self.models[least_recent_model]
+                self.cache_evictions += 1
                 gc.collect()
 
     def print_vram_usage(self) -> None:
@@ -21,6 +21,7 @@ from compel.prompt_parser import (
 from invokeai.backend.globals import Globals
 
 from ..stable_diffusion import InvokeAIDiffuserComponent
+from ..stable_diffusion.profiling import profile_section
 from ..util import torch_dtype
 
 
@@ -63,9 +64,10 @@ def get_uc_and_c_and_ec(
     if log_tokens or getattr(Globals, "log_tokenization", False):
         log_tokenization(positive_prompt, negative_prompt, tokenizer=tokenizer)
 
-    c, options = compel.build_conditioning_tensor_for_prompt_object(positive_prompt)
-    uc, _ = compel.build_conditioning_tensor_for_prompt_object(negative_prompt)
-    [c, uc] = compel.pad_conditioning_tensors_to_same_length([c, uc])
+    with profile_section("text_encoding"):
+        c, options = compel.build_conditioning_tensor_for_prompt_object(positive_prompt)
+        uc, _ = compel.build_conditioning_tensor_for_prompt_object(negative_prompt)
+        [c, uc] = compel.pad_conditioning_tensors_to_same_length([c, uc])
 
     tokens_count = get_max_token_count(tokenizer, positive_prompt)
 
@@ -10,4 +10,11 @@ from .diffusers_pipeline import (
 from .diffusion import InvokeAIDiffuserComponent
 from .diffusion.cross_attention_map_saving import AttentionMapSaver
 from .diffusion.shared_invokeai_diffusion import PostprocessingSettings
+from .latent_preview import LatentPreviewRenderer
+from .profiling import (
+    ChromeTraceProfiler,
+    ProfilingHooks,
+    profile_section,
+    use_profiling_hooks,
+)
 from .textual_inversion_manager import TextualInversionManager
@@ -42,6 +42,7 @@ from .diffusion import (
     PostprocessingSettings,
 )
 from .offloading import FullyLoadedModelGroup, LazilyLoadedModelGroup, ModelGroup
+from .profiling import profile_section
 from .textual_inversion_manager import TextualInversionManager
 
 
@@ -561,23 +562,24 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
 
             for i, t in enumerate(self.progress_bar(timesteps)):
                 batched_t.fill_(t)
-                step_output = self.step(
-                    batched_t,
-                    latents,
-                    conditioning_data,
-                    step_index=i,
-                    total_step_count=len(timesteps),
-                    additional_guidance=additional_guidance,
-                )
-                latents = step_output.prev_sample
-
-                latents = self.invokeai_diffuser.do_latent_postprocessing(
-                    postprocessing_settings=conditioning_data.postprocessing_settings,
-                    latents=latents,
-                    sigma=batched_t,
-                    step_index=i,
-                    total_step_count=len(timesteps),
-                )
+                with profile_section("diffusion_step", step=i):
+                    step_output = self.step(
+                        batched_t,
+                        latents,
+                        conditioning_data,
+                        step_index=i,
+                        total_step_count=len(timesteps),
+                        additional_guidance=additional_guidance,
+                    )
+                    latents = step_output.prev_sample
+
+                    latents = self.invokeai_diffuser.do_latent_postprocessing(
+                        postprocessing_settings=conditioning_data.postprocessing_settings,
+                        latents=latents,
+                        sigma=batched_t,
+                        step_index=i,
+                        total_step_count=len(timesteps),
+                    )
 
                 predicted_original = getattr(step_output, "pred_original_sample", None)
 
@@ -631,9 +633,10 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         )
 
         # compute the previous noisy sample x_t -> x_t-1
-        step_output = self.scheduler.step(
-            noise_pred, timestep, latents, **conditioning_data.scheduler_args
-        )
+        with profile_section("scheduler_step"):
+            step_output = self.scheduler.step(
+                noise_pred, timestep, latents, **conditioning_data.scheduler_args
+            )
 
         # TODO: this additional_guidance extension point feels redundant with InvokeAIDiffusionComponent.
         #    But the way things are now, scheduler runs _after_ that, so there was
@@ -667,9 +670,10 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
             ).add_mask_channels(latents)
 
         # First three args should be positional, not keywords, so torch hooks can see them.
-        return self.unet(
-            latents, t, text_embeddings, cross_attention_kwargs=cross_attention_kwargs
-        ).sample
+        with profile_section("unet_forward"):
+            return self.unet(
+                latents, t, text_embeddings, cross_attention_kwargs=cross_attention_kwargs
+            ).sample
 
     def img2img_from_embeddings(
         self,
@@ -683,6 +687,31 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         noise_func=None,
         seed=None,
     ) -> InvokeAIStableDiffusionPipelineOutput:
+        initial_latents, noise = self.img2img_latents_and_noise(
+            init_image, noise_func=noise_func, seed=seed
+        )
+
+        return self.img2img_from_latents_and_embeddings(
+            initial_latents,
+            num_inference_steps,
+            conditioning_data,
+            strength,
+            noise,
+            run_id,
+            callback,
+        )
+
+    def img2img_latents_and_noise(
+        self,
+        init_image: Union[torch.FloatTensor, PIL.Image.Image],
+        *,
+        noise_func,
+        seed=None,
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns the un-noised latents of an initial image, and the noise to add to them
+        (made by noise_func after setting the seed, if one is given).
+        """
         if isinstance(init_image, PIL.Image.Image):
             init_image = image_resized_to_grid_as_tensor(init_image.convert("RGB"))
 
@@ -698,16 +727,7 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         if seed is not None:
             set_seed(seed)
         noise = noise_func(initial_latents)
-
-        return self.img2img_from_latents_and_embeddings(
-            initial_latents,
-            num_inference_steps,
-            conditioning_data,
-            strength,
-            noise,
-            run_id,
-            callback,
-        )
+        return initial_latents, noise
 
     def img2img_from_latents_and_embeddings(
         self,
@@ -866,10 +886,11 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
                 init_image = init_image.to(CPU_DEVICE)
             else:
                 self._model_group.load(self.vae)
-            init_latent_dist = self.vae.encode(init_image).latent_dist
-            init_latents = init_latent_dist.sample().to(
-                dtype=dtype
-            )  # FIXME: uses torch.randn. make reproducible!
+            with profile_section("vae_encode"):
+                init_latent_dist = self.vae.encode(init_image).latent_dist
+                init_latents = init_latent_dist.sample().to(
+                    dtype=dtype
+                )  # FIXME: uses torch.randn. make reproducible!
             if device.type == "mps":
                 self.vae.to(device)
                 init_latents = init_latents.to(device)
@@ -905,12 +926,13 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         """
         Compatibility function for invokeai.models.diffusion.ddpm.LatentDiffusion.
         """
-        return self.embeddings_provider.get_embeddings_for_weighted_prompt_fragments(
-            text_batch=c,
-            fragment_weights_batch=fragment_weights,
-            should_return_tokens=return_tokens,
-            device=self._model_group.device_for(self.unet),
-        )
+        with profile_section("text_encoding"):
+            return self.embeddings_provider.get_embeddings_for_weighted_prompt_fragments(
+                text_batch=c,
+                fragment_weights_batch=fragment_weights,
+                should_return_tokens=return_tokens,
+                device=self._model_group.device_for(self.unet),
+            )
 
     @property
     def channels(self) -> int:
@@ -920,7 +942,8 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
     def decode_latents(self, latents):
         # Explicit call to get the vae loaded, since `decode` isn't the forward method.
         self._model_group.load(self.vae)
-        return super().decode_latents(latents)
+        with profile_section("vae_decode"):
+            return super().decode_latents(latents)
 
     def debug_latents(self, latents, msg):
         from invokeai.backend.image_util import debug_image
@@ -19,6 +19,7 @@ from .cross_attention_control import (
     override_cross_attention,
     restore_default_cross_attention,
 )
+from ..profiling import profile_section
 from .cross_attention_map_saving import AttentionMapSaver
 
 ModelForwardCallback: TypeAlias = Union[
@@ -225,9 +226,10 @@ class InvokeAIDiffuserComponent:
                 x, sigma, unconditioning, conditioning
             )
 
-        combined_next_x = self._combine(
-            unconditioned_next_x, conditioned_next_x, unconditional_guidance_scale
-        )
+        with profile_section("cfg_combine"):
+            combined_next_x = self._combine(
+                unconditioned_next_x, conditioned_next_x, unconditional_guidance_scale
+            )
 
         return combined_next_x
 
@@ -240,15 +242,16 @@ class InvokeAIDiffuserComponent:
         total_step_count,
     ) -> torch.Tensor:
         if postprocessing_settings is not None:
-            percent_through = self.calculate_percent_through(
-                sigma, step_index, total_step_count
-            )
-            latents = self.apply_threshold(
-                postprocessing_settings, latents, percent_through
-            )
-            latents = self.apply_symmetry(
-                postprocessing_settings, latents, percent_through
-            )
+            with profile_section("latent_postprocessing"):
+                percent_through = self.calculate_percent_through(
+                    sigma, step_index, total_step_count
+                )
+                latents = self.apply_threshold(
+                    postprocessing_settings, latents, percent_through
+                )
+                latents = self.apply_symmetry(
+                    postprocessing_settings, latents, percent_through
+                )
         return latents
 
     def calculate_percent_through(self, sigma, step_index, total_step_count):
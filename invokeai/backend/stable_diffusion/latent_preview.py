@@ -0,0 +1,200 @@
+"""
+Renders low resolution previews of latents, without decoding them with the VAE.
+"""
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Hashable, Optional, TypeVar
+
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# Originally adapted from code by @erucipe and @keturn here:
+# https://discuss.huggingface.co/t/decoding-latents-to-rgb-without-upscaling/23204/7
+# These updated numbers for v1.5 are from @torridgristle
+V1_5_LATENT_RGB_FACTORS = [
+    #    R        G        B
+    [0.3444, 0.1385, 0.0670],  # L1
+    [0.1247, 0.4027, 0.1494],  # L2
+    [-0.3192, 0.2513, 0.2103],  # L3
+    [-0.1307, -0.1874, -0.7445],  # L4
+]
+
+T = TypeVar("T")
+
+
+class LatentPreviewRenderer:
+    """Renders previews of latents as RGB images, one pixel per latent (unless resized).
+
+    The latent to RGB factors are cached for each dtype and device the latents are on, and the
+    preview is computed (and resized) on that device. render_async() finishes the preview (and
+    whatever is done with it, e.g. encoding it) on a worker thread, copying it from the GPU
+    through reused pinned host buffers, so the diffusion thread isn't held up. At most
+    max_pending previews of each key (e.g. each generation, when several are batched) are in
+    flight; more are dropped rather than slowing down the diffusion.
+    """
+
+    __latent_rgb_factors: list[list[float]]
+    __factors: dict[tuple[torch.dtype, torch.device], torch.Tensor]
+    __host_buffers: dict[tuple[int, ...], list[torch.Tensor]]
+    __lock: threading.Lock
+    __pending: dict[Hashable, int]
+    __pending_changed: threading.Condition
+    __max_pending: int
+    __workers: int
+    __executor: Optional[ThreadPoolExecutor]
+
+    def __init__(
+        self,
+        latent_rgb_factors: list[list[float]] = V1_5_LATENT_RGB_FACTORS,
+        max_pending: int = 2,
+        workers: int = 1,
+    ):
+        self.__latent_rgb_factors = latent_rgb_factors
+        self.__factors = dict()
+        self.__host_buffers = dict()
+        self.__lock = threading.Lock()
+        self.__pending = dict()
+        self.__pending_changed = threading.Condition()
+        self.__max_pending = max_pending
+        self.__workers = workers
+        self.__executor = None
+
+    def render(
+        self, samples: torch.Tensor, size: Optional[tuple[int, int]] = None
+    ) -> Image.Image:
+        """Renders the preview of the first latents of a batch, optionally resized to (width, height)"""
+        return Image.fromarray(self.__to_pixels(samples, size).cpu().numpy())
+
+    def render_async(
+        self,
+        samples: torch.Tensor,
+        then: Callable[[Image.Image], T],
+        size: Optional[tuple[int, int]] = None,
+        block: bool = False,
+        key: Hashable = None,
+    ) -> Optional[Future[T]]:
+        """Renders a preview, then calls then() with it on a worker thread. Returns a future of what
+        then() returns (None if it raised), or None if the preview was dropped because max_pending
+        previews with the same key are already in flight. With block, waits for one to finish
+        instead of dropping it. Previews are finished in order when there is a single worker."""
+        with self.__pending_changed:
+            while self.__pending.get(key, 0) >= self.__max_pending:
+                if not block:
+                    return None
+                self.__pending_changed.wait()
+            self.__pending[key] = self.__pending.get(key, 0) + 1
+
+        try:
+            pixels = self.__to_pixels(samples, size)
+            copied = None
+            if pixels.device.type == "cuda":
+                host_buffer = self.__take_host_buffer(tuple(pixels.shape))
+                host_buffer.copy_(pixels, non_blocking=True)
+                copied = torch.cuda.Event()
+                copied.record()
+                pixels = host_buffer
+            return self.__get_executor().submit(self.__finish, pixels, copied, then, key)
+        except Exception:
+            self.__release(key)
+            raise
+
+    def flush(self, key: Optional[Hashable] = None) -> None:
+        """Waits for the previews in flight to be finished (only those with a key, if given)"""
+        with self.__pending_changed:
+            self.__pending_changed.wait_for(
+                lambda: len(self.__pending) == 0 if key is None else key not in self.__pending
+            )
+
+    def shutdown(self) -> None:
+        """Waits for the previews in flight, and stops the worker threads"""
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def __finish(
+        self,
+        pixels: torch.Tensor,
+        copied: Optional["torch.cuda.Event"],
+        then: Callable[[Image.Image], T],
+        key: Hashable,
+    ) -> Optional[T]:
+        try:
+            if copied is not None:
+                copied.synchronize()
+                # Copy out of the pinned buffer, so it can be reused right away
+                image = Image.fromarray(pixels.numpy().copy())
+                self.__return_host_buffer(pixels)
+            else:
+                image = Image.fromarray(pixels.numpy())
+            return then(image)
+        except Exception:
+            # A preview failing shouldn't fail the generation
+            traceback.print_exc()
+            return None
+        finally:
+            self.__release(key)
+
+    def __release(self, key: Hashable) -> None:
+        with self.__pending_changed:
+            self.__pending[key] -= 1
+            if self.__pending[key] == 0:
+                del self.__pending[key]
+            self.__pending_changed.notify_all()
+
+    def __to_pixels(
+        self, samples: torch.Tensor, size: Optional[tuple[int, int]]
+    ) -> torch.Tensor:
+        """Computes the preview as uint8 RGB pixels (height, width, 3), on the device of the samples"""
+        with torch.no_grad():
+            latent_image = samples[0].permute(1, 2, 0) @ self.__get_factors(
+                samples.dtype, samples.device
+            )
+
+            if size is not None and size != (latent_image.shape[1], latent_image.shape[0]):
+                (width, height) = size
+                upsample = width * height > latent_image.shape[0] * latent_image.shape[1]
+                latent_image = (
+                    F.interpolate(
+                        latent_image.permute(2, 0, 1).unsqueeze(0),
+                        size=(height, width),
+                        mode="bilinear" if upsample else "area",
+                    )
+                    .squeeze(0)
+                    .permute(1, 2, 0)
+                )
+
+            return (
+                ((latent_image + 1) / 2)
+                .clamp(0, 1)  # change scale from -1..1 to 0..1
+                .mul(0xFF)  # to 0..255
+                .byte()
+            )
+
+    def __get_factors(self, dtype: torch.dtype, device: torch.device) -> torch.Tensor:
+        factors = self.__factors.get((dtype, device))
+        if factors is None:
+            factors = torch.tensor(self.__latent_rgb_factors, dtype=dtype, device=device)
+            self.__factors[(dtype, device)] = factors
+        return factors
+
+    def __take_host_buffer(self, shape: tuple[int, ...]) -> torch.Tensor:
+        with self.__lock:
+            buffers = self.__host_buffers.get(shape)
+            if buffers:
+                return buffers.pop()
+        return torch.empty(shape, dtype=torch.uint8, pin_memory=True)
+
+    def __return_host_buffer(self, buffer: torch.Tensor) -> None:
+        with self.__lock:
+            self.__host_buffers.setdefault(tuple(buffer.shape), list()).append(buffer)
+
+    def __get_executor(self) -> ThreadPoolExecutor:
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.__workers, thread_name_prefix="latent_preview"
+                )
+            return self.__executor
@@ -0,0 +1,138 @@
+"""
+Opt-in profiling hooks around the stages of generation (text encoding, the UNet forward, CFG,
+scheduler steps, latent postprocessing and VAE decoding).
+
+The stages are wrapped in profile_section(), which returns a shared no-op context manager unless
+hooks are in use on the current thread, so they cost nothing when profiling is disabled:
+
+    with use_profiling_hooks(ChromeTraceProfiler()) as profiler:
+        generate()
+    profiler.write("trace.json")  # Open in chrome://tracing or https://ui.perfetto.dev
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Iterator, Optional
+
+import torch
+
+# The hooks in use on each thread
+_local = threading.local()
+
+_DISABLED = nullcontext()
+
+
+class ProfilingHooks:
+    """Called at the beginning and end of each profiled section. Sections are nested: end() is
+    called for the most recently begun section."""
+
+    def begin(self, name: str, args: dict[str, Any]) -> None:
+        pass
+
+    def end(self, name: str) -> None:
+        pass
+
+
+class _Section:
+    __slots__ = ("hooks", "name", "args")
+
+    def __init__(self, hooks: ProfilingHooks, name: str, args: dict[str, Any]):
+        self.hooks = hooks
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> None:
+        self.hooks.begin(self.name, self.args)
+
+    def __exit__(self, *args) -> None:
+        self.hooks.end(self.name)
+
+
+def profile_section(name: str, **args: Any) -> ContextManager[None]:
+    """Profiles the code run in the context with the hooks in use on this thread, if any"""
+    hooks = getattr(_local, "hooks", None)
+    if hooks is None:
+        return _DISABLED
+    return _Section(hooks, name, args)
+
+
+def get_profiling_hooks() -> Optional[ProfilingHooks]:
+    """Gets the hooks in use on this thread"""
+    return getattr(_local, "hooks", None)
+
+
+@contextmanager
+def use_profiling_hooks(hooks: Optional[ProfilingHooks]) -> Iterator[Optional[ProfilingHooks]]:
+    """Uses the hooks for the sections profiled on this thread in the context"""
+    previous = getattr(_local, "hooks", None)
+    _local.hooks = hooks
+    try:
+        yield hooks
+    finally:
+        _local.hooks = previous
+
+
+class ChromeTraceProfiler(ProfilingHooks):
+    """Records sections as complete ("X") events of the Chrome trace event format.
+
+    CUDA runs kernels asynchronously, so with synchronize_cuda (the default) the device is
+    synchronized at the beginning and end of each section for its time to include the kernels it
+    launched. That slows down generation a little, but attributes the time to the right section.
+    """
+
+    events: list[dict[str, Any]]
+    __synchronize_cuda: bool
+    __stack: list[tuple[str, dict[str, Any], float]]
+    __start: float
+
+    def __init__(self, synchronize_cuda: bool = True):
+        self.events = list()
+        self.__synchronize_cuda = synchronize_cuda and torch.cuda.is_available()
+        self.__stack = list()
+        self.__start = time.perf_counter()
+
+    def begin(self, name: str, args: dict[str, Any]) -> None:
+        if self.__synchronize_cuda:
+            torch.cuda.synchronize()
+        self.__stack.append((name, args, time.perf_counter()))
+
+    def end(self, name: str) -> None:
+        if self.__synchronize_cuda:
+            torch.cuda.synchronize()
+        end = time.perf_counter()
+        (name, args, begin) = self.__stack.pop()
+        event = dict(
+            name=name,
+            ph="X",
+            ts=round((begin - self.__start) * 1e6, 3),
+            dur=round((end - begin) * 1e6, 3),
+            pid=os.getpid(),
+            tid=threading.get_ident(),
+        )
+        if args:
+            event["args"] = {k: _to_json(v) for k, v in args.items()}
+        self.events.append(event)
+
+    def get_trace(self, metadata: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+        """Gets the trace, with events sorted by start time"""
+        trace = dict(
+            traceEvents=sorted(self.events, key=lambda e: e["ts"]),
+            displayTimeUnit="ms",
+        )
+        if metadata:
+            trace["otherData"] = {k: _to_json(v) for k, v in metadata.items()}
+        return trace
+
+    def write(self, path: str, metadata: Optional[dict[str, Any]] = None) -> None:
+        with open(path, "w") as f:
+            json.dump(self.get_trace(metadata), f)
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, torch.Tensor) and value.numel() == 1:
+        return value.item()
+    return str(value)
@@ -373,10 +373,46 @@ def image_to_dataURL(image: Image.Image, image_format: str = "PNG") -> str:
     """
     Converts an image into a base64 image dataURL.
     """
+    return bytes_to_dataURL(image_to_bytes(image, image_format), image_format)
+
+
+def image_to_bytes(image: Image.Image, image_format: str = "PNG") -> bytes:
+    """
+    Encodes an image in a file format (e.g. PNG, JPEG, WEBP).
+    """
     buffered = io.BytesIO()
     image.save(buffered, format=image_format)
+    return buffered.getvalue()
+
+
+def bytes_to_dataURL(data: bytes, image_format: str) -> str:
+    """
+    Converts an encoded image into a base64 image dataURL.
+    """
     mime_type = Image.MIME.get(image_format.upper(), "image/" + image_format.lower())
-    image_base64 = f"data:{mime_type};base64," + base64.b64encode(
-        buffered.getvalue()
-    ).decode("UTF-8")
-    return image_base64
+    return f"data:{mime_type};base64," + base64.b64encode(data).decode("UTF-8")
+
+
+# Formats of progress frames: encoded images, or the raw uint8 RGB pixels (row by row)
+PROGRESS_FRAME_FORMATS = ["jpeg", "webp", "rgb"]
+
+
+def encode_progress_frame(image: Image.Image, frame_format: str = "jpeg") -> bytes:
+    """
+    Encodes an RGB progress image as the bytes of a progress frame.
+    """
+    if frame_format == "rgb":
+        return image.tobytes()
+    return image_to_bytes(image, frame_format)
+
+
+def progress_frame_to_dataURL(
+    data: bytes, frame_format: str, size: tuple[int, int]
+) -> str:
+    """
+    Converts a progress frame of the given size (width, height) into a base64 image dataURL,
+    for clients that don't receive frames. Raw frames are encoded as JPEG.
+    """
+    if frame_format == "rgb":
+        return image_to_dataURL(Image.frombytes("RGB", size, data), image_format="JPEG")
+    return bytes_to_dataURL(data, frame_format)
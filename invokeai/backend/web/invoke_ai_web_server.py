@@ -32,6 +32,7 @@ from ..prompting import (
     get_tokens_for_prompt_object,
 )
 from ..stable_diffusion import PipelineIntermediateState
+from ..util.util import encode_progress_frame
 from .modules.get_canvas_generation_mode import get_canvas_generation_mode
 from .modules.parameters import parameters_to_command
 
@@ -1092,12 +1093,21 @@ class InvokeAIWebServer:
                     (width, height) = image.size
                     width *= 8
                     height *= 8
-                    img_base64 = image_to_dataURL(image, image_format="JPEG")
+                    if generation_parameters.get("progress_frames", False):
+                        # Clients that ask for frames get the JPEG bytes as a binary attachment
+                        image_data = {
+                            "data": encode_progress_frame(image, "jpeg"),
+                            "format": "jpeg",
+                        }
+                    else:
+                        image_data = {
+                            "url": image_to_dataURL(image, image_format="JPEG"),
+                            "isBase64": True,
+                        }
                     self.socketio.emit(
                         "intermediateResult",
                         {
-                            "url": img_base64,
-                            "isBase64": True,
+                            **image_data,
                             "mtime": 0,
                             "metadata": {},
                             "width": width,
@@ -0,0 +1,150 @@
+from .test_nodes import PromptTestInvocation, TestEventService, create_edge, wait_until
+from invokeai.app.services.buffered_item_storage import BufferedItemStorage
+from invokeai.app.services.processor import DefaultInvocationProcessor
+from invokeai.app.services.sqlite import SqliteItemStorage, sqlite_memory
+from invokeai.app.services.invocation_queue import MemoryInvocationQueue
+from invokeai.app.services.invoker import Invoker
+from invokeai.app.services.invocation_services import InvocationServices
+from invokeai.app.services.graph import Graph, GraphExecutionState
+from pydantic import BaseModel, Field
+import pytest
+
+
+class TestModel(BaseModel):
+    id: str = Field(description = "ID")
+    name: str = Field(description = "Name")
+
+class CountingItemStorage(SqliteItemStorage[TestModel]):
+    def __init__(self):
+        super().__init__(sqlite_memory, 'test', 'id')
+        self.writes = []
+        self.failures = 0 # Number of writes to fail
+        self.before_write = None
+
+    def set_many(self, items: list[TestModel]) -> None:
+        if self.before_write is not None:
+            self.before_write()
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError("Disk full")
+        self.writes.append([i.id for i in items])
+        super().set_many(items)
+
+@pytest.fixture
+def storage() -> CountingItemStorage:
+    return CountingItemStorage()
+
+@pytest.fixture
+def buffered(storage: CountingItemStorage) -> BufferedItemStorage[TestModel]:
+    # A long interval, so only the test flushes
+    buffered = BufferedItemStorage[TestModel](storage, flush_interval = 60)
+    buffered.start(None)
+    yield buffered
+    buffered.stop()
+
+def test_buffered_storage_coalesces_sets(storage: CountingItemStorage, buffered: BufferedItemStorage[TestModel]):
+    changed = []
+    buffered.on_changed(lambda item: changed.append(item.name))
+
+    for i in range(10):
+        buffered.set(TestModel(id = '1', name = str(i)))
+    buffered.set(TestModel(id = '2', name = 'Test'))
+
+    # Callbacks are called and the latest items are read before anything is written
+    assert changed == [str(i) for i in range(10)] + ['Test']
+    assert buffered.get('1') == TestModel(id = '1', name = '9')
+    assert buffered.get_many(['2', '3']) == [TestModel(id = '2', name = 'Test'), None]
+    assert storage.get('1') is None
+
+    buffered.flush()
+    assert storage.writes == [['1', '2']]
+    assert storage.get('1') == TestModel(id = '1', name = '9')
+
+def test_buffered_storage_copies_items(buffered: BufferedItemStorage[TestModel]):
+    item = TestModel(id = '1', name = 'Test')
+    buffered.set(item)
+    item.name = 'Changed'
+    buffered.get('1').name = 'Changed'
+    assert buffered.get('1').name == 'Test'
+
+def test_buffered_storage_flushes_when_full(storage: CountingItemStorage):
+    buffered = BufferedItemStorage[TestModel](storage, flush_interval = 60, max_pending = 3)
+    buffered.start(None)
+    for i in range(3):
+        buffered.set(TestModel(id = str(i), name = 'Test'))
+    assert storage.writes == [['0', '1', '2']]
+    buffered.stop()
+
+def test_buffered_storage_flushes_periodically(storage: CountingItemStorage):
+    buffered = BufferedItemStorage[TestModel](storage, flush_interval = 0.05)
+    buffered.start(None)
+    buffered.set(TestModel(id = '1', name = 'Test'))
+    wait_until(lambda: storage.get('1') is not None, timeout = 5, interval = 0.05)
+    buffered.stop()
+    assert storage.get('1') == TestModel(id = '1', name = 'Test')
+
+def test_buffered_storage_deletes_pending_items(storage: CountingItemStorage, buffered: BufferedItemStorage[TestModel]):
+    buffered.set(TestModel(id = '1', name = 'Test'))
+    buffered.delete('1')
+    buffered.flush()
+    assert buffered.get('1') is None
+    assert storage.writes == []
+
+def test_buffered_storage_flushes_on_stop_and_list(storage: CountingItemStorage, buffered: BufferedItemStorage[TestModel]):
+    buffered.set(TestModel(id = '1', name = 'Test'))
+    assert buffered.list().total == 1
+
+    buffered.set(TestModel(id = '2', name = 'Test'))
+    buffered.stop()
+    assert storage.get('2') == TestModel(id = '2', name = 'Test')
+
+def test_buffered_storage_keeps_items_that_fail_to_be_written(storage: CountingItemStorage, buffered: BufferedItemStorage[TestModel]):
+    buffered.set(TestModel(id = '1', name = 'Test'))
+    buffered.set(TestModel(id = '2', name = 'Test'))
+    storage.failures = 1
+    storage.before_write = lambda: buffered.set(TestModel(id = '2', name = 'Newer'))
+    with pytest.raises(IOError):
+        buffered.flush()
+    assert buffered.get('1') == TestModel(id = '1', name = 'Test')
+
+    # Items set while the write failed aren't overwritten by the failed ones
+    storage.before_write = None
+    buffered.flush()
+    assert storage.get('1') == TestModel(id = '1', name = 'Test')
+    assert storage.get('2') == TestModel(id = '2', name = 'Newer')
+
+def test_buffered_storage_keeps_flushing_after_failures(storage: CountingItemStorage):
+    buffered = BufferedItemStorage[TestModel](storage, flush_interval = 0.05)
+    buffered.start(None)
+    storage.failures = 2
+    buffered.set(TestModel(id = '1', name = 'Test'))
+    wait_until(lambda: storage.get('1') is not None, timeout = 5, interval = 0.05)
+    buffered.stop()
+
+def test_can_invoke_all_with_buffered_storage():
+    g = Graph()
+    g.add_node(PromptTestInvocation(id = "1", prompt = "Banana sushi"))
+    g.add_node(PromptTestInvocation(id = "2"))
+    g.add_edge(create_edge("1", "prompt", "2", "prompt"))
+
+    storage = SqliteItemStorage[GraphExecutionState](filename = sqlite_memory, table_name = 'graph_executions')
+    services = InvocationServices(
+        model_manager = None, # type: ignore
+        events = TestEventService(),
+        images = None, # type: ignore
+        queue = MemoryInvocationQueue(),
+        graph_execution_manager = BufferedItemStorage[GraphExecutionState](storage, flush_interval = 60),
+        processor = DefaultInvocationProcessor(),
+        restoration = None,
+    )
+    invoker = Invoker(services)
+    g = invoker.create_execution_state(graph = g)
+    invoker.invoke(g, invoke_all = True)
+
+    wait_until(lambda: services.graph_execution_manager.get(g.id).is_complete(), timeout = 5, interval = 0.1)
+    invoker.stop()
+
+    # Stopping writes the completed session
+    g = storage.get(g.id)
+    assert g.is_complete()
+    assert g.results[next(iter(g.source_prepared_mapping['2']))].prompt == "Banana sushi"
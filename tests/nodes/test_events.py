@@ -0,0 +1,185 @@
+from invokeai.app.api.events import FastAPIEventService
+from invokeai.app.api.sockets import SocketIO
+from invokeai.app.invocations.baseinvocation import InvocationContext
+from invokeai.app.services.events import EventServiceBase
+from invokeai.app.services.invocation_services import InvocationServices
+from invokeai.app.util.util import fast_latents_step_callback, flush_progress
+from invokeai.backend.generator.base import Generator
+from fastapi import FastAPI
+from typing import Any
+import asyncio
+import threading
+import torch
+
+
+class RecordingEventService(FastAPIEventService):
+    def __init__(self):
+        self.dispatched = list()
+        self.payloads = list()
+        super().__init__(event_handler_id = 0)
+
+    def _dispatch_event(self, event_name: str, payload: Any) -> None:
+        # Events are dispatched on the event loop's thread
+        self.dispatched.append((threading.current_thread(), payload["data"]["invocation_id"]))
+        self.payloads.append(payload)
+
+class CountingEventService(EventServiceBase):
+    def __init__(self, subscribed: set[str], progress_max_fps = None):
+        super().__init__(progress_max_fps = progress_max_fps)
+        self.subscribed = subscribed
+        self.events = list()
+
+    def dispatch(self, event_name: str, payload: Any) -> None:
+        self.events.append(payload)
+
+    def has_subscribers(self, graph_execution_state_id: str) -> bool:
+        return graph_execution_state_id in self.subscribed
+
+def test_dispatches_events_in_order_on_the_event_loop():
+    async def run():
+        events = RecordingEventService()
+        thread = threading.Thread(target = lambda: [events.emit_invocation_started("1", str(i)) for i in range(100)])
+        thread.start()
+        thread.join()
+        for _ in range(100):
+            if len(events.dispatched) == 100:
+                break
+            await asyncio.sleep(0.01)
+        events.stop()
+        return events.dispatched
+
+    dispatched = asyncio.run(run())
+    assert [id for _, id in dispatched] == [str(i) for i in range(100)]
+    assert all(thread is threading.main_thread() for thread, _ in dispatched)
+
+def test_drops_events_once_stopped():
+    async def run():
+        events = RecordingEventService()
+        events.emit_invocation_started("1", "1")
+        events.stop()
+        events.emit_invocation_started("1", "2")
+        await asyncio.sleep(0.01)
+        return events.dispatched
+
+    assert asyncio.run(run()) == []
+
+def test_coalesces_pending_progress_per_session():
+    def emit(events: RecordingEventService):
+        events.emit_invocation_started("1", "a")
+        for step in range(10):
+            events.emit_generator_progress("1", "a", None, step, 10)
+            events.emit_generator_progress("2", "b", None, step, 10)
+        events.emit_invocation_complete("1", "a", dict())
+        events.emit_generator_progress("1", "c", None, 0, 10)
+        events.emit_generator_progress("1", "c", None, 1, 10)
+
+    async def run():
+        events = RecordingEventService()
+        # The loop is blocked until the thread is done, so all of its events are pending together
+        thread = threading.Thread(target = emit, args = (events,))
+        thread.start()
+        thread.join()
+        for _ in range(100):
+            if len(events.payloads) == 5:
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        events.stop()
+        return events.payloads
+
+    payloads = asyncio.run(run())
+    assert [(p["event"], p["data"]["invocation_id"], p["data"].get("step")) for p in payloads] == [
+        ("invocation_started", "a", None),
+        ("generator_progress", "a", 9),
+        ("generator_progress", "b", 9),
+        ("invocation_complete", "a", None),
+        ("generator_progress", "c", 1),
+    ]
+
+def create_context(events: EventServiceBase, session_id: str) -> InvocationContext:
+    services = InvocationServices(
+        model_manager = None, # type: ignore
+        events = events,
+        images = None, # type: ignore
+        queue = None, # type: ignore
+        graph_execution_manager = None, # type: ignore
+        processor = None, # type: ignore
+        restoration = None, # type: ignore
+    )
+    return InvocationContext(services, session_id)
+
+def emit_progress(events: EventServiceBase, session_id: str, steps: int) -> None:
+    context = create_context(events, session_id)
+    sample = torch.zeros((1, 4, 8, 8))
+    for step in range(steps):
+        fast_latents_step_callback(sample, step, steps, "1", context)
+    flush_progress(context, "1")
+
+def test_progress_is_only_emitted_to_subscribed_sessions():
+    events = CountingEventService(subscribed = {"1"})
+    emit_progress(events, "1", 10)
+    emit_progress(events, "2", 10)
+    # Previews may be dropped while earlier ones are encoded, but not the last one
+    assert 0 < len(events.events) <= 10
+    assert events.events[-1]["data"]["step"] == 9
+    assert all(e["data"]["graph_execution_state_id"] == "1" for e in events.events)
+    assert events.events[0]["data"]["progress_image"]["width"] == 64
+
+def test_progress_is_rate_limited_per_session():
+    events = CountingEventService(subscribed = {"1", "2"}, progress_max_fps = 0.1)
+    emit_progress(events, "1", 10)
+    emit_progress(events, "2", 10)
+
+    # The first and last steps of each session
+    assert [(e["data"]["graph_execution_state_id"], e["data"]["step"]) for e in events.events] == [
+        ("1", 0), ("1", 9), ("2", 0), ("2", 9),
+    ]
+
+def test_progress_isnt_rate_limited_by_dropped_previews():
+    events = CountingEventService(subscribed = {"1"}, progress_max_fps = 0.1)
+    context = create_context(events, "1")
+    sample = torch.zeros((1, 4, 8, 8))
+
+    # The invocation's previews of earlier steps are still being encoded
+    release = threading.Event()
+    for _ in range(2):
+        Generator.preview_renderer.render_async(sample, lambda image: release.wait(timeout = 5), key = ("1", "1"))
+    fast_latents_step_callback(sample, 0, 10, "1", context)
+    release.set()
+    flush_progress(context, "1")
+
+    fast_latents_step_callback(sample, 1, 10, "1", context)
+    flush_progress(context, "1")
+    assert [e["data"]["step"] for e in events.events] == [1]
+
+def test_sends_progress_frames_as_bytes_and_data_urls_to_old_clients():
+    app = FastAPI()
+    socket_io = SocketIO(app)
+    emitted = list()
+    async def emit(event, data = None, to = None, room = None, skip_sid = None, **kwargs):
+        emitted.append((to or room, data, skip_sid))
+    app.sio.emit = emit
+    app.sio.enter_room = lambda *args, **kwargs: None
+
+    events = CountingEventService(subscribed = {"1"})
+    events.progress_frame_format = "rgb"
+    emit_progress(events, "1", 1)
+    payload = events.events[0]
+
+    async def run():
+        await socket_io._handle_sub("frames", dict(session = "1", progress_frames = True))
+        await socket_io._handle_session_event(("session_event", payload))
+        await socket_io._handle_sub("old", dict(session = "1"))
+        await socket_io._handle_session_event(("session_event", payload))
+        await socket_io._handle_disconnect("frames")
+        await socket_io._handle_disconnect("old")
+
+    asyncio.run(run())
+    assert not socket_io.has_subscribers("1")
+
+    # Clients that asked for frames get the raw pixels, other clients get a dataURL
+    assert [(target, skip_sid) for target, _, skip_sid in emitted] == [("frames", None), ("frames", None), ("1", ["frames"])]
+    frame = emitted[0][1]["progress_image"]
+    assert frame["format"] == "rgb" and len(frame["data"]) == 8 * 8 * 3
+    assert emitted[2][1]["progress_image"]["dataURL"].startswith("data:image/jpeg;base64,")
+    assert emitted[2][1]["progress_image"]["width"] == 64
@@ -0,0 +1,153 @@
+from .test_nodes import PromptTestInvocation, PromptCollectionTestInvocation, TestEventService, create_edge, wait_until
+from invokeai.app.invocations.baseinvocation import InvocationContext
+from invokeai.app.services.graph_execution_storage import SESSION_STATUS_FIELDS, SqliteGraphExecutionStorage
+from invokeai.app.services.invocation_stats import InvocationStats
+from invokeai.app.services.item_codec import get_item_codec
+from invokeai.app.services.processor import DefaultInvocationProcessor
+from invokeai.app.services.sqlite import sqlite_memory
+from invokeai.app.services.invocation_queue import MemoryInvocationQueue
+from invokeai.app.services.invoker import Invoker
+from invokeai.app.services.invocation_services import InvocationServices
+from invokeai.app.services.graph import Graph, CollectInvocation, IterateInvocation, GraphExecutionState
+import pytest
+
+
+@pytest.fixture
+def iterated_graph():
+    g = Graph()
+    g.add_node(PromptCollectionTestInvocation(id = "1", collection = [f"Banana sushi {i}" for i in range(10)]))
+    g.add_node(IterateInvocation(id = "2"))
+    g.add_node(PromptTestInvocation(id = "3"))
+    g.add_node(CollectInvocation(id = "4"))
+    g.add_edge(create_edge("1", "collection", "2", "collection"))
+    g.add_edge(create_edge("2", "item", "3", "prompt"))
+    g.add_edge(create_edge("3", "prompt", "4", "item"))
+    return g
+
+@pytest.fixture(params = ['memory', 'file'])
+def storage(request, tmp_path) -> SqliteGraphExecutionStorage:
+    filename = sqlite_memory if request.param == 'memory' else str(tmp_path / 'test.db')
+    return SqliteGraphExecutionStorage(filename = filename, table_name = 'graph_executions', status_fields = SESSION_STATUS_FIELDS)
+
+def count_deltas(storage: SqliteGraphExecutionStorage, id: str) -> int:
+    storage._cursor.execute(f"SELECT count(*) FROM {storage._deltas_table_name} WHERE session_id = ?;", (str(id),))
+    return storage._cursor.fetchone()[0]
+
+def assert_same_state(a: GraphExecutionState, b: GraphExecutionState):
+    assert GraphExecutionState.parse_raw(a.json()) == GraphExecutionState.parse_raw(b.json())
+
+def test_delta_storage_rebuilds_state(storage: SqliteGraphExecutionStorage, iterated_graph):
+    run_saving_state(storage, iterated_graph)
+
+def test_delta_storage_rebuilds_compressed_state(tmp_path, iterated_graph):
+    storage = SqliteGraphExecutionStorage(filename = str(tmp_path / 'test.db'), table_name = 'graph_executions', codec = get_item_codec('json+zlib'), status_fields = SESSION_STATUS_FIELDS)
+    run_saving_state(storage, iterated_graph)
+    assert storage.list_status().items[0]['executing'] == []
+
+def run_saving_state(storage: SqliteGraphExecutionStorage, graph: Graph):
+    g = GraphExecutionState(graph = graph)
+    storage.set(g)
+    saw_deltas = False
+
+    # Save the state around each invocation, like the processor does
+    while True:
+        g = storage.get(g.id)
+        n = g.next()
+        if n is None:
+            break
+        storage.set(g)
+        assert_same_state(storage.get(g.id), g)
+
+        o = n.invoke(InvocationContext(None, g.id))
+        g = storage.get(g.id)
+        g.set_node_stats(n.id, InvocationStats(node_type = n.type, wall_time = 0.5))
+        g.complete(n.id, o)
+        storage.set(g)
+        assert_same_state(storage.get(g.id), g)
+        saw_deltas = saw_deltas or count_deltas(storage, g.id) > 0
+
+    assert saw_deltas
+    assert g.is_complete()
+
+    # Completed sessions are compacted
+    assert count_deltas(storage, g.id) == 0
+    assert_same_state(storage.get(g.id), g)
+
+def test_delta_storage_saves_graph_changes(storage: SqliteGraphExecutionStorage, iterated_graph):
+    g = GraphExecutionState(graph = iterated_graph)
+    storage.set(g)
+    g.add_node(PromptTestInvocation(id = "5", prompt = "Cat sushi"))
+    storage.set(g)
+
+    assert storage.get(g.id).graph.get_node("5").prompt == "Cat sushi"
+
+def test_delta_storage_writes_snapshot_for_stale_state(storage: SqliteGraphExecutionStorage, iterated_graph):
+    g = GraphExecutionState(graph = iterated_graph)
+    storage.set(g)
+    stale = storage.get(g.id)
+
+    n = g.next()
+    g.complete(n.id, n.invoke(InvocationContext(None, g.id)))
+    storage.set(g)
+    assert count_deltas(storage, g.id) > 0
+
+    # Saving an older copy replaces the state, as it would without deltas
+    storage.set(stale)
+    assert count_deltas(storage, g.id) == 0
+    assert_same_state(storage.get(g.id), stale)
+
+def test_delta_storage_lists_and_searches_uncompacted_changes(storage: SqliteGraphExecutionStorage, iterated_graph):
+    g = GraphExecutionState(graph = iterated_graph)
+    storage.set(g)
+    n = g.next()
+    g.complete(n.id, n.invoke(InvocationContext(None, g.id)))
+    storage.set(g)
+
+    assert_same_state(storage.list().items[0], g)
+    assert storage.search("Banana sushi 3").total == 1
+
+    storage.delete(g.id)
+    assert storage.get(g.id) is None
+    assert count_deltas(storage, g.id) == 0
+
+def test_delta_storage_lists_status_with_uncompacted_changes(storage: SqliteGraphExecutionStorage, iterated_graph):
+    g = GraphExecutionState(graph = iterated_graph)
+    storage.set(g)
+    n = g.next()
+    storage.set(g)
+    g.complete(n.id, n.invoke(InvocationContext(None, g.id)))
+    storage.set(g)
+    assert count_deltas(storage, g.id) > 0
+
+    status = storage.list_status().items[0]
+    assert status['id'] == str(g.id)
+    assert sorted(status['executed']) == sorted(g.executed)
+    assert status['executed_history'] == g.executed_history
+    assert status['executing'] == []
+    assert status['errors'] == {}
+
+def test_can_invoke_all_with_delta_storage(iterated_graph):
+    services = InvocationServices(
+        model_manager = None, # type: ignore
+        events = TestEventService(),
+        images = None, # type: ignore
+        queue = MemoryInvocationQueue(),
+        graph_execution_manager = SqliteGraphExecutionStorage(filename = sqlite_memory, table_name = 'graph_executions'),
+        processor = DefaultInvocationProcessor(),
+        restoration = None,
+    )
+    invoker = Invoker(services)
+    g = invoker.create_execution_state(graph = iterated_graph)
+    invoker.invoke(g, invoke_all = True)
+
+    def has_executed_all(g: GraphExecutionState):
+        g = services.graph_execution_manager.get(g.id)
+        return g.is_complete()
+
+    wait_until(lambda: has_executed_all(g), timeout = 10, interval = 0.1)
+    invoker.stop()
+
+    g = services.graph_execution_manager.get(g.id)
+    assert not g.has_error()
+    assert sorted(g.results[next(iter(g.source_prepared_mapping['4']))].collection) == [f"Banana sushi {i}" for i in range(10)]
+    assert g.stats.keys() == g.results.keys()
@@ -0,0 +1,61 @@
+from invokeai.app.services.image_cache import ImageCache, get_image_bytes
+from PIL import Image
+import threading
+
+
+def create_image(size: int = 10, mode: str = "RGB") -> Image.Image:
+    return Image.new(mode, (size, size))
+
+def test_counts_decoded_bytes():
+    assert get_image_bytes(create_image(10, "RGB")) == 400 # Padded to 4 bytes per pixel
+    assert get_image_bytes(create_image(10, "RGBA")) == 400
+    assert get_image_bytes(create_image(10, "L")) == 100
+
+def test_evicts_least_recently_used_images_over_budget():
+    cache = ImageCache(max_bytes = 1000)
+    images = [create_image() for _ in range(3)]
+    cache.put("0", images[0])
+    cache.put("1", images[1])
+    assert cache.get("0") is images[0] # Now more recently used than 1
+    cache.put("2", images[2])
+
+    assert cache.get("1") is None
+    assert cache.get("0") is images[0] and cache.get("2") is images[2]
+    assert (len(cache), cache.bytes, cache.evictions) == (2, 800, 1)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+def test_replaces_and_deletes_images():
+    cache = ImageCache(max_bytes = 1000)
+    cache.put("0", create_image())
+    replacement = cache.put("0", create_image(5))
+    assert cache.get("0") is replacement and cache.bytes == 100
+
+    cache.delete("0")
+    assert cache.get("0") is None and cache.bytes == 0
+
+def test_doesnt_cache_images_over_budget():
+    cache = ImageCache(max_bytes = 1000)
+    cache.put("0", create_image())
+    cache.put("1", create_image(100))
+    assert "1" not in cache
+    assert "0" in cache # Nothing was evicted for it
+
+def test_is_consistent_under_concurrent_use():
+    cache = ImageCache(max_bytes = 4000)
+    def use(thread: int):
+        for i in range(500):
+            key = str((thread * 7 + i) % 20)
+            if cache.get(key) is None:
+                cache.put(key, create_image(10 + i % 5))
+            if i % 50 == 0:
+                cache.delete(key)
+
+    threads = [threading.Thread(target = use, args = (t,)) for t in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    cached = [cache.get(str(k)) for k in range(20)]
+    assert cache.bytes == sum(get_image_bytes(i) for i in cached if i is not None)
+    assert cache.bytes <= 4000
@@ -0,0 +1,158 @@
+from invokeai.app.services.image_storage import DiskImageStorage, ImageType, get_image_subpath, migrate_images
+from invokeai.app.services.image_codec import IMAGE_CODEC_NAMES, PngImageCodec, get_media_type
+from PIL import Image
+import os
+import threading
+import pytest
+
+
+def list_images(output_folder, image_type: ImageType) -> list[str]:
+    """Lists the files stored for a type of image, in any directory"""
+    return sorted(f for (_, _, files) in os.walk(os.path.join(output_folder, image_type)) for f in files)
+
+@pytest.fixture
+def blocked_writes(monkeypatch):
+    """Holds up background writes until the event is set"""
+    release = threading.Event()
+    write = PngImageCodec.write
+    def blocked_write(self, *args, **kwargs):
+        if threading.current_thread().name.startswith("image_writer"):
+            release.wait(timeout = 5)
+        return write(self, *args, **kwargs)
+    monkeypatch.setattr(PngImageCodec, "write", blocked_write)
+    yield release
+    release.set()
+
+def test_storage_decodes_loaded_images(tmp_path):
+    DiskImageStorage(str(tmp_path)).save(ImageType.RESULT, "image.png", Image.new("RGB", (8, 8)))
+
+    storage = DiskImageStorage(str(tmp_path))
+    image = storage.get(ImageType.RESULT, "image.png")
+    assert image.fp is None # Decoded, and the file closed
+    assert storage.get(ImageType.RESULT, "image.png") is image
+    assert (storage.cache.hits, storage.cache.misses) == (1, 1)
+
+    storage.delete(ImageType.RESULT, "image.png")
+    assert storage.cache.bytes == 0
+
+def test_serves_images_until_they_are_written(tmp_path, blocked_writes):
+    storage = DiskImageStorage(str(tmp_path), cache_bytes = 0, write_workers = 1)
+    image = Image.new("RGB", (8, 8), (255, 0, 0))
+    storage.save(ImageType.RESULT, "image.png", image)
+
+    path = os.path.join(tmp_path, get_image_subpath(ImageType.RESULT, "image.png"))
+    assert not os.path.exists(path)
+    assert storage.get(ImageType.RESULT, "image.png") is image
+
+    # get_path() waits for the image to be written
+    paths = list()
+    thread = threading.Thread(target = lambda: paths.append(storage.get_path(ImageType.RESULT, "image.png")))
+    thread.start()
+    thread.join(timeout = 0.2)
+    assert thread.is_alive()
+    blocked_writes.set()
+    thread.join(timeout = 5)
+    assert paths == [path]
+    assert Image.open(path).getpixel((0, 0)) == (255, 0, 0)
+    storage.stop()
+
+def test_last_image_saved_with_a_name_is_written(tmp_path, blocked_writes):
+    storage = DiskImageStorage(str(tmp_path), write_workers = 2)
+    for color in [(255, 0, 0), (0, 255, 0), (0, 0, 255)]:
+        storage.save(ImageType.RESULT, "image.png", Image.new("RGB", (8, 8), color))
+    blocked_writes.set()
+    storage.flush()
+
+    path = os.path.join(tmp_path, get_image_subpath(ImageType.RESULT, "image.png"))
+    assert Image.open(path).getpixel((0, 0)) == (0, 0, 255)
+    assert list_images(tmp_path, ImageType.RESULT) == ["image.png"] # No temporary files left
+    storage.stop()
+
+def test_stop_writes_pending_images(tmp_path, blocked_writes):
+    storage = DiskImageStorage(str(tmp_path), write_workers = 1)
+    for i in range(3):
+        storage.save(ImageType.RESULT, f"{i}.png", Image.new("RGB", (8, 8)))
+    blocked_writes.set()
+    storage.stop()
+    assert list_images(tmp_path, ImageType.RESULT) == ["0.png", "1.png", "2.png"]
+
+    # Written right away once stopped
+    storage.save(ImageType.RESULT, "3.png", Image.new("RGB", (8, 8)))
+    assert list_images(tmp_path, ImageType.RESULT) == ["0.png", "1.png", "2.png", "3.png"]
+
+@pytest.mark.parametrize("codec", IMAGE_CODEC_NAMES)
+def test_reads_images_written_with_each_codec(tmp_path, codec):
+    image = Image.new("RGBA", (8, 8), (255, 0, 0, 255))
+    DiskImageStorage(str(tmp_path), codecs = {ImageType.INTERMEDIATE: codec}).save(ImageType.INTERMEDIATE, "image.png", image)
+
+    # Decoded by its format, whatever its name or the codec now used
+    loaded = DiskImageStorage(str(tmp_path)).get(ImageType.INTERMEDIATE, "image.png")
+    assert loaded.size == (8, 8)
+    assert loaded.convert("RGB").getpixel((4, 4))[0] > 240
+
+def test_npy_images_keep_their_mode(tmp_path):
+    storage = DiskImageStorage(str(tmp_path), cache_bytes = 0, codecs = {ImageType.INTERMEDIATE: "npy"})
+    for mode in ["L", "RGB", "RGBA", "P"]:
+        storage.save(ImageType.INTERMEDIATE, "image.png", Image.new(mode, (8, 4), 1))
+        loaded = storage.get(ImageType.INTERMEDIATE, "image.png")
+        assert loaded.size == (8, 4)
+        assert loaded.mode == ("RGBA" if mode == "P" else mode)
+        assert get_media_type(storage.get_path(ImageType.INTERMEDIATE, "image.png")) is None
+
+def test_unknown_codecs_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        DiskImageStorage(str(tmp_path), codecs = {ImageType.RESULT: "gif"})
+
+def test_keeps_intermediates_in_memory(tmp_path):
+    storage = DiskImageStorage(str(tmp_path), intermediate_bytes = 1000)
+    image = Image.new("RGB", (8, 8), (255, 0, 0))
+    storage.save(ImageType.INTERMEDIATE, "image.png", image)
+
+    path = os.path.join(tmp_path, get_image_subpath(ImageType.INTERMEDIATE, "image.png"))
+    assert not os.path.exists(path)
+    assert storage.exists(ImageType.INTERMEDIATE, "image.png")
+
+    # Shares the pixels, which are copied when modified
+    shared = storage.get(ImageType.INTERMEDIATE, "image.png")
+    assert shared.im is image.im
+    shared.paste((0, 255, 0), (0, 0, 4, 4))
+    assert storage.get(ImageType.INTERMEDIATE, "image.png").getpixel((0, 0)) == (255, 0, 0)
+
+    storage.persist(ImageType.INTERMEDIATE, "image.png")
+    assert Image.open(path).getpixel((0, 0)) == (255, 0, 0)
+
+def test_writes_intermediates_over_budget(tmp_path):
+    storage = DiskImageStorage(str(tmp_path), intermediate_bytes = 600)
+    for i in range(3):
+        storage.save(ImageType.INTERMEDIATE, f"{i}.png", Image.new("RGB", (8, 8)))
+    assert list_images(tmp_path, ImageType.INTERMEDIATE) == ["0.png"]
+
+    # Deleted without being written
+    storage.delete(ImageType.INTERMEDIATE, "1.png")
+    assert not storage.exists(ImageType.INTERMEDIATE, "1.png")
+
+    storage.stop()
+    assert list_images(tmp_path, ImageType.INTERMEDIATE) == ["0.png", "2.png"]
+
+def test_names_are_unique(tmp_path):
+    storage = DiskImageStorage(str(tmp_path))
+    names = [storage.create_name("session", "node") for _ in range(1000)]
+    assert len(set(names)) == len(names)
+    assert names == sorted(names)
+
+def test_reads_and_migrates_unsharded_images(tmp_path):
+    os.makedirs(os.path.join(tmp_path, ImageType.RESULT))
+    for name in ["0.png", "1.png"]:
+        Image.new("RGB", (8, 8), (255, 0, 0)).save(os.path.join(tmp_path, ImageType.RESULT, name))
+
+    storage = DiskImageStorage(str(tmp_path))
+    assert storage.exists(ImageType.RESULT, "0.png")
+    assert storage.get(ImageType.RESULT, "0.png").getpixel((0, 0)) == (255, 0, 0)
+    storage.save(ImageType.RESULT, "1.png", Image.new("RGB", (8, 8), (0, 0, 255)))
+
+    # The image saved since is kept over the unsharded one
+    assert migrate_images(str(tmp_path)) == (1, 1)
+    assert migrate_images(str(tmp_path)) == (0, 1)
+    storage = DiskImageStorage(str(tmp_path))
+    assert storage.get_path(ImageType.RESULT, "0.png") == os.path.join(tmp_path, get_image_subpath(ImageType.RESULT, "0.png"))
+    assert storage.get(ImageType.RESULT, "1.png").getpixel((0, 0)) == (0, 0, 255)
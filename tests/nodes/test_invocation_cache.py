@@ -0,0 +1,90 @@
+from .test_nodes import CountingTestInvocation, PromptTestInvocationOutput, TestEventService, wait_until
+from invokeai.app.services.processor import DefaultInvocationProcessor
+from invokeai.app.services.sqlite import SqliteItemStorage, sqlite_memory
+from invokeai.app.services.invocation_cache import MemoryInvocationCache
+from invokeai.app.services.invocation_queue import MemoryInvocationQueue
+from invokeai.app.services.invoker import Invoker
+from invokeai.app.services.invocation_services import InvocationServices
+from invokeai.app.services.graph import CollectInvocation, GraphExecutionState
+import pytest
+
+
+@pytest.fixture
+def mock_services() -> InvocationServices:
+    # NOTE: none of these are actually called by the test invocations
+    return InvocationServices(
+        model_manager = None, # type: ignore
+        events = TestEventService(),
+        images = None, # type: ignore
+        queue = MemoryInvocationQueue(),
+        graph_execution_manager = SqliteItemStorage[GraphExecutionState](filename = sqlite_memory, table_name = 'graph_executions'),
+        processor = DefaultInvocationProcessor(),
+        restoration = None,
+        invocation_cache = MemoryInvocationCache(),
+    )
+
+@pytest.fixture()
+def mock_invoker(mock_services: InvocationServices) -> Invoker:
+    return Invoker(
+        services = mock_services
+    )
+
+def test_cache_key_ignores_id(mock_services: InvocationServices):
+    cache = mock_services.invocation_cache
+    a = cache.create_key(CountingTestInvocation(id = "1", prompt = "Banana sushi"), mock_services)
+    b = cache.create_key(CountingTestInvocation(id = "2", prompt = "Banana sushi"), mock_services)
+    c = cache.create_key(CountingTestInvocation(id = "1", prompt = "Cat sushi"), mock_services)
+
+    assert a is not None
+    assert a == b
+    assert a != c
+
+def test_cache_key_skips_random_seeds_and_uncacheable(mock_services: InvocationServices):
+    cache = mock_services.invocation_cache
+    assert cache.create_key(CountingTestInvocation(id = "1", seed = -1), mock_services) is None
+    assert cache.create_key(CollectInvocation(id = "1"), mock_services) is None
+
+def test_cache_returns_copies():
+    cache = MemoryInvocationCache()
+    cache.save("key", PromptTestInvocationOutput(prompt = "Banana sushi"))
+
+    output = cache.get("key")
+    output.prompt = "Cat sushi"
+
+    assert cache.get("key").prompt == "Banana sushi"
+    assert cache.get("missing") is None
+    assert cache.hits == 2
+    assert cache.misses == 1
+
+def test_cache_evicts_least_recently_used():
+    cache = MemoryInvocationCache(max_size = 2)
+    cache.save("1", PromptTestInvocationOutput(prompt = "1"))
+    cache.save("2", PromptTestInvocationOutput(prompt = "2"))
+    cache.get("1")
+    cache.save("3", PromptTestInvocationOutput(prompt = "3"))
+
+    assert cache.get("1") is not None
+    assert cache.get("2") is None
+    assert cache.get("3") is not None
+
+def test_processor_reuses_cached_outputs(mock_invoker: Invoker):
+    CountingTestInvocation.invoke_count = 0
+
+    states = []
+    for _ in range(2):
+        g = mock_invoker.create_execution_state()
+        g.graph.add_node(CountingTestInvocation(id = "1", prompt = "Banana sushi"))
+        mock_invoker.invoke(g, invoke_all = True)
+
+        def has_executed_all(g: GraphExecutionState):
+            g = mock_invoker.services.graph_execution_manager.get(g.id)
+            return g.is_complete()
+
+        wait_until(lambda: has_executed_all(g), timeout = 5, interval = 0.1)
+        states.append(mock_invoker.services.graph_execution_manager.get(g.id))
+
+    mock_invoker.stop()
+
+    assert CountingTestInvocation.invoke_count == 1
+    for g in states:
+        assert g.results[next(iter(g.source_prepared_mapping['1']))].prompt == "Banana sushi"
@@ -0,0 +1,269 @@
+from .test_nodes import PromptTestInvocation, PromptCollectionTestInvocation, TestEventService, create_edge, wait_until
+from invokeai.app.services.processor import DefaultInvocationProcessor
+from invokeai.app.services.sqlite import SqliteItemStorage, sqlite_memory
+from invokeai.app.services.invocation_queue import BULK_PRIORITY, INTERACTIVE_PRIORITY, FairInvocationQueue, InvocationQueueItem, MemoryInvocationQueue, SqliteInvocationQueue
+from invokeai.app.services.cancellation import CancellationSet, CancellationToken
+from invokeai.app.services.invoker import Invoker
+from invokeai.app.services.invocation_services import InvocationServices
+from invokeai.app.services.graph import Graph, CollectInvocation, IterateInvocation, GraphExecutionState
+from threading import Thread
+import pytest
+import time
+
+
+@pytest.fixture
+def iterated_graph():
+    g = Graph()
+    g.add_node(PromptCollectionTestInvocation(id = "1", collection = [f"Banana sushi {i}" for i in range(3)]))
+    g.add_node(IterateInvocation(id = "2"))
+    g.add_node(PromptTestInvocation(id = "3"))
+    g.add_node(CollectInvocation(id = "4"))
+    g.add_edge(create_edge("1", "collection", "2", "collection"))
+    g.add_edge(create_edge("2", "item", "3", "prompt"))
+    g.add_edge(create_edge("3", "prompt", "4", "item"))
+    return g
+
+def create_item(session_id: str = '1', invocation_id: str = '1', priority: int = BULK_PRIORITY, owner = None, batch_key = None, uses_gpu = False) -> InvocationQueueItem:
+    return InvocationQueueItem(graph_execution_state_id = session_id, invocation_id = invocation_id, priority = priority, owner = owner, batch_key = batch_key, uses_gpu = uses_gpu)
+
+@pytest.fixture(params = ['fair', 'sqlite'])
+def fair_queue(request):
+    weights = dict(heavy = 2.0)
+    if request.param == 'fair':
+        return FairInvocationQueue(weights = weights)
+    return SqliteInvocationQueue(sqlite_memory, weights = weights)
+
+@pytest.fixture(params = ['memory', 'fair', 'sqlite'])
+def any_queue(request):
+    if request.param == 'memory':
+        return MemoryInvocationQueue()
+    if request.param == 'fair':
+        return FairInvocationQueue()
+    return SqliteInvocationQueue(sqlite_memory)
+
+def get_all(queue, count: int) -> list[str]:
+    return [queue.get().invocation_id for _ in range(count)]
+
+def test_fair_queue_hands_out_interactive_items_first(fair_queue):
+    fair_queue.put(create_item(invocation_id = 'bulk'))
+    fair_queue.put(create_item(invocation_id = 'interactive', priority = INTERACTIVE_PRIORITY))
+    assert get_all(fair_queue, 2) == ['interactive', 'bulk']
+
+def test_fair_queue_takes_turns_between_sessions(fair_queue):
+    for i in range(4):
+        fair_queue.put(create_item(session_id = 'batch', invocation_id = f'batch {i}'))
+    fair_queue.put(create_item(session_id = 'other', invocation_id = 'other 0'))
+    fair_queue.put(create_item(session_id = 'other', invocation_id = 'other 1'))
+    assert get_all(fair_queue, 6) == ['batch 0', 'other 0', 'batch 1', 'other 1', 'batch 2', 'batch 3']
+
+def test_fair_queue_shares_turns_by_owner_weight(fair_queue):
+    for i in range(4):
+        fair_queue.put(create_item(session_id = '1', invocation_id = f'light {i}', owner = 'light'))
+        fair_queue.put(create_item(session_id = '2', invocation_id = f'heavy {i}', owner = 'heavy'))
+    assert get_all(fair_queue, 6) == ['heavy 0', 'light 0', 'heavy 1', 'heavy 2', 'light 1', 'heavy 3']
+
+def test_fair_queue_skips_canceled_items(fair_queue):
+    fair_queue.put(create_item(session_id = '1', invocation_id = '1'))
+    fair_queue.put(create_item(session_id = '2', invocation_id = '2'))
+    fair_queue.cancel('1')
+    assert fair_queue.get().invocation_id == '2'
+
+def test_queue_removes_canceled_items_right_away(any_queue):
+    any_queue.put(create_item(session_id = '1', invocation_id = '1'))
+    any_queue.put(create_item(session_id = '1', invocation_id = '2'))
+    any_queue.put(create_item(session_id = '2', invocation_id = '3'))
+    any_queue.cancel('1')
+    assert any_queue.get_stats().depth == 1
+    assert any_queue.get().invocation_id == '3'
+
+def test_queue_lists_queued_sessions(any_queue):
+    any_queue.put(create_item(session_id = '1'))
+    any_queue.put(create_item(session_id = '2'))
+    any_queue.put(create_item(session_id = '3'))
+    any_queue.cancel('3')
+    assert any_queue.get_queued_sessions() == {'1', '2'}
+
+def test_queue_clears_cancellation_when_session_is_queued_again(any_queue):
+    any_queue.cancel('1')
+    assert any_queue.is_canceled('1')
+    any_queue.put(create_item(session_id = '2'))
+    any_queue.get()
+
+    # Other sessions passing through don't clear it, invoking the session again does
+    assert any_queue.is_canceled('1')
+    any_queue.put(create_item(session_id = '1'))
+    assert not any_queue.is_canceled('1')
+    assert any_queue.get().graph_execution_state_id == '1'
+
+def test_queue_gets_batches_of_items_with_a_batch_key(any_queue):
+    any_queue.put(create_item(invocation_id = '1', batch_key = 'a'))
+    any_queue.put(create_item(invocation_id = '2', batch_key = 'b'))
+    any_queue.put(create_item(invocation_id = '3'))
+    any_queue.put(create_item(session_id = '2', invocation_id = '4', batch_key = 'a'))
+    any_queue.put(create_item(session_id = '2', invocation_id = '5', batch_key = 'a'))
+
+    assert any_queue.get().invocation_id == '1'
+    assert [i.invocation_id for i in any_queue.get_batch('a', 1)] == ['4']
+
+    # Canceled items aren't batched
+    any_queue.cancel('2')
+    assert any_queue.get_batch('a', 4) == []
+    assert get_all(any_queue, 2) == ['2', '3']
+    assert any_queue.get_stats().depth == 0
+
+def test_cancellation_set_expires_and_is_bounded():
+    cancellations = CancellationSet(ttl = 60, max_size = 2)
+    cancellations.add('1', time.time() - 120)
+    cancellations.add('2')
+    assert '1' not in cancellations
+    assert '2' in cancellations
+
+    cancellations.add('3')
+    cancellations.add('4')
+    assert len(cancellations) == 2
+    assert '2' not in cancellations
+    cancellations.discard('3')
+    assert '3' not in cancellations and '4' in cancellations
+
+def test_cancellation_token():
+    token = CancellationToken()
+    assert not token.is_canceled
+    assert not token.wait(timeout = 0.01)
+    token.cancel()
+    assert token.is_canceled
+    assert token.wait()
+
+def test_fair_queue_reports_stats(fair_queue):
+    fair_queue.put(create_item(invocation_id = '1', priority = INTERACTIVE_PRIORITY))
+    fair_queue.put(create_item(invocation_id = '2'))
+    fair_queue.put(create_item(invocation_id = '3'))
+    stats = fair_queue.get_stats()
+    assert stats.depth == 3
+    assert stats.depth_by_priority == {INTERACTIVE_PRIORITY: 1, BULK_PRIORITY: 2}
+    assert stats.oldest_wait >= 0
+
+    fair_queue.get()
+    stats = fair_queue.get_stats()
+    assert stats.depth == 2
+    assert stats.recent_wait_max >= stats.recent_wait_mean >= 0
+
+def test_queue_gets_items_by_lane(any_queue):
+    any_queue.put(create_item(invocation_id = 'gpu 0', uses_gpu = True))
+    any_queue.put(create_item(invocation_id = 'gpu 1', uses_gpu = True))
+    any_queue.put(create_item(invocation_id = 'cpu 0'))
+    assert any_queue.get(uses_gpu = False).invocation_id == 'cpu 0'
+    assert any_queue.get(uses_gpu = False, timeout = 0.01) is None
+    assert any_queue.get().invocation_id == 'gpu 0'
+    assert any_queue.get(uses_gpu = True).invocation_id == 'gpu 1'
+
+def test_sqlite_queue_gets_items_in_order():
+    queue = SqliteInvocationQueue(sqlite_memory)
+    queue.put(create_item(invocation_id = '1'))
+    queue.put(create_item(invocation_id = '2'))
+    assert queue.get().invocation_id == '1'
+    assert queue.get().invocation_id == '2'
+
+def test_sqlite_queue_wakes_up_on_none():
+    queue = SqliteInvocationQueue(sqlite_memory)
+    results = []
+    thread = Thread(target = lambda: results.append(queue.get()))
+    thread.start()
+    queue.put(None)
+    thread.join(timeout = 5)
+    assert results == [None]
+
+def test_sqlite_queue_hands_out_items_again_when_leases_expire(tmp_path):
+    filename = str(tmp_path / 'test.db')
+    queue = SqliteInvocationQueue(filename, visibility_timeout = 0.1)
+    queue.put(create_item())
+    item = queue.get()
+
+    # As if the process holding the lease died
+    queue = SqliteInvocationQueue(filename, visibility_timeout = 0.1)
+    time.sleep(0.2)
+    assert queue.get().id == item.id
+
+    queue.complete(item)
+    queue.put(create_item(invocation_id = '2'))
+    assert queue.get().invocation_id == '2'
+
+def test_sqlite_queue_renews_leases_until_stopped(tmp_path):
+    filename = str(tmp_path / 'test.db')
+    queue = SqliteInvocationQueue(filename, visibility_timeout = 0.3)
+    queue.start(None)
+    queue.put(create_item(invocation_id = '1'))
+    queue.put(create_item(invocation_id = '2'))
+    item = queue.get()
+    time.sleep(0.6)
+
+    # The lease of the first item was renewed, so the next item is handed out
+    assert queue.get().invocation_id == '2'
+
+    # Stopping releases the leases of items that weren't completed
+    queue.stop()
+    restarted = SqliteInvocationQueue(filename, visibility_timeout = 60)
+    assert restarted.get().id == item.id
+
+def test_sqlite_queue_persists_cancellations(tmp_path):
+    filename = str(tmp_path / 'test.db')
+    queue = SqliteInvocationQueue(filename)
+    queue.put(create_item(session_id = '1'))
+    queue.put(create_item(session_id = '2'))
+    queue.cancel('1')
+    assert queue.is_canceled('1')
+
+    queue = SqliteInvocationQueue(filename)
+    assert queue.is_canceled('1')
+    assert not queue.is_canceled('2')
+    assert queue.get().graph_execution_state_id == '2'
+
+def test_sqlite_queue_resumes_sessions_after_restart(tmp_path, iterated_graph):
+    filename = str(tmp_path / 'test.db')
+    storage = SqliteItemStorage[GraphExecutionState](filename = filename, table_name = 'graph_executions')
+
+    # A session that was being invoked when the server stopped without releasing its lease
+    g = GraphExecutionState(graph = iterated_graph)
+    n = g.next()
+    storage.set(g)
+    queue = SqliteInvocationQueue(filename, visibility_timeout = 0.2)
+    queue.put(InvocationQueueItem(graph_execution_state_id = str(g.id), invocation_id = n.id, invoke_all = True))
+    queue.get()
+
+    services = InvocationServices(
+        model_manager = None, # type: ignore
+        events = TestEventService(),
+        images = None, # type: ignore
+        queue = SqliteInvocationQueue(filename, visibility_timeout = 0.2),
+        graph_execution_manager = storage,
+        processor = DefaultInvocationProcessor(),
+        restoration = None,
+    )
+    invoker = Invoker(services)
+
+    wait_until(lambda: storage.get(g.id).is_complete(), timeout = 10, interval = 0.1)
+    invoker.stop()
+
+    g = storage.get(g.id)
+    assert not g.has_error()
+    assert sorted(g.results[next(iter(g.source_prepared_mapping['4']))].collection) == [f"Banana sushi {i}" for i in range(3)]
+
+def test_can_invoke_all_with_fair_queue(iterated_graph):
+    services = InvocationServices(
+        model_manager = None, # type: ignore
+        events = TestEventService(),
+        images = None, # type: ignore
+        queue = FairInvocationQueue(),
+        graph_execution_manager = SqliteItemStorage[GraphExecutionState](filename = sqlite_memory, table_name = 'graph_executions'),
+        processor = DefaultInvocationProcessor(cpu_workers = 2),
+        restoration = None,
+    )
+    invoker = Invoker(services)
+    g = invoker.create_execution_state(graph = iterated_graph)
+    invoker.invoke(g, invoke_all = True)
+
+    wait_until(lambda: services.graph_execution_manager.get(g.id).is_complete(), timeout = 10, interval = 0.1)
+    invoker.stop()
+
+    g = services.graph_execution_manager.get(g.id)
+    assert not g.has_error()
+    assert services.queue.get_stats().depth == 0
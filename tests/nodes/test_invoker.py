@@ -1,12 +1,17 @@
-from .test_nodes import ErrorInvocation, ImageTestInvocation, ListPassThroughInvocation, PromptTestInvocation, PromptCollectionTestInvocation, TestEventService, create_edge, wait_until
+from .test_nodes import BarrierTestInvocation, BatchableTestInvocation, CancelableTestInvocation, ErrorInvocation, GpuCancelableTestInvocation, ImageTestInvocation, IntermediateImageTestInvocation, ListPassThroughInvocation, PromptTestInvocation, PromptCollectionTestInvocation, TestEventService, create_edge, wait_until
+import json
+from invokeai.app.services.image_storage import DiskImageStorage, ImageType
 from invokeai.app.services.processor import DefaultInvocationProcessor
 from invokeai.app.services.sqlite import SqliteItemStorage, sqlite_memory
 from invokeai.app.services.invocation_queue import MemoryInvocationQueue
 from invokeai.app.services.invoker import Invoker
 from invokeai.app.invocations.baseinvocation import BaseInvocation, BaseInvocationOutput, InvocationContext
 from invokeai.app.services.invocation_services import InvocationServices
+from invokeai.app.services.invocation_stats import summarize_stats
 from invokeai.app.services.graph import Graph, GraphInvocation, InvalidEdgeError, NodeAlreadyInGraphError, NodeNotFoundError, are_connections_compatible, EdgeConnection, CollectInvocation, IterateInvocation, GraphExecutionState
 import pytest
+from . import test_nodes
+from .test_image_storage import list_images
 
 
 @pytest.fixture
@@ -66,6 +71,22 @@ def test_can_invoke(mock_invoker: Invoker, simple_graph):
     g = mock_invoker.services.graph_execution_manager.get(g.id)
     assert len(g.executed) > 0
 
+def test_records_invocation_stats(mock_invoker: Invoker, simple_graph):
+    g = mock_invoker.create_execution_state(graph = simple_graph)
+    mock_invoker.invoke(g, invoke_all = True)
+    wait_until(lambda: mock_invoker.services.graph_execution_manager.get(g.id).is_complete(), timeout = 5, interval = 0.1)
+    mock_invoker.stop()
+
+    g = mock_invoker.services.graph_execution_manager.get(g.id)
+    assert g.stats.keys() == g.results.keys()
+    assert all(s.wall_time >= 0 and s.queue_wait >= 0 and s.rss > 0 for s in g.stats.values())
+
+    stats_events = [e["data"] for e in mock_invoker.services.events.events if e["event"] == "invocation_stats"]
+    assert sorted(e["invocation_id"] for e in stats_events) == sorted(g.stats.keys())
+
+    summary = summarize_stats(g.stats)
+    assert {t: s.count for t, s in summary.by_type.items()} == {"test_prompt": 1, "test_image": 1}
+
 def test_can_invoke_all(mock_invoker: Invoker, simple_graph):
     g = mock_invoker.create_execution_state(graph = simple_graph)
     invocation_id = mock_invoker.invoke(g, invoke_all = True)
@@ -81,6 +102,30 @@ def test_can_invoke_all(mock_invoker: Invoker, simple_graph):
     g = mock_invoker.services.graph_execution_manager.get(g.id)
     assert g.is_complete()
 
+class RecordingInvocationQueue(MemoryInvocationQueue):
+    def __init__(self):
+        super().__init__()
+        self.items = []
+
+    def put(self, item):
+        if item is not None:
+            self.items.append(item)
+        super().put(item)
+
+def test_invoke_all_keeps_priority_and_owner(mock_services: InvocationServices, simple_graph):
+    mock_services.queue = RecordingInvocationQueue()
+    invoker = Invoker(services = mock_services)
+    g = invoker.create_execution_state(graph = simple_graph)
+    invoker.invoke(g, invoke_all = True, priority = 5, owner = "studio")
+
+    wait_until(lambda: invoker.services.graph_execution_manager.get(g.id).is_complete(), timeout = 5, interval = 0.1)
+    invoker.stop()
+
+    # The second node is queued once the first completes
+    items = mock_services.queue.items
+    assert len(items) == 2
+    assert all(i.priority == 5 and i.owner == "studio" for i in items)
+
 def test_handles_errors(mock_invoker: Invoker):
     g = mock_invoker.create_execution_state()
     g.graph.add_node(ErrorInvocation(id = "1"))
@@ -99,3 +144,178 @@ def test_handles_errors(mock_invoker: Invoker):
     assert g.is_complete()
 
     assert all((i in g.errors for i in g.source_prepared_mapping['1']))
+
+@pytest.fixture()
+def mock_concurrent_invoker(mock_services: InvocationServices) -> Invoker:
+    mock_services.processor = DefaultInvocationProcessor(cpu_workers = 2)
+    return Invoker(
+        services = mock_services
+    )
+
+def test_can_invoke_independent_nodes_concurrently(mock_concurrent_invoker: Invoker):
+    test_nodes.test_barrier.reset()
+    g = mock_concurrent_invoker.create_execution_state()
+    g.graph.add_node(BarrierTestInvocation(id = "1", prompt = "Banana sushi"))
+    g.graph.add_node(BarrierTestInvocation(id = "2", prompt = "Cat sushi"))
+    g.graph.add_node(PromptTestInvocation(id = "3"))
+    g.graph.add_edge(create_edge("2", "prompt", "3", "prompt"))
+
+    mock_concurrent_invoker.invoke(g, invoke_all = True)
+
+    def has_executed_all(g: GraphExecutionState):
+        g = mock_concurrent_invoker.services.graph_execution_manager.get(g.id)
+        return g.is_complete()
+
+    wait_until(lambda: has_executed_all(g), timeout = 10, interval = 0.1)
+    mock_concurrent_invoker.stop()
+
+    g = mock_concurrent_invoker.services.graph_execution_manager.get(g.id)
+    assert not g.has_error()
+    assert len(g.executing) == 0
+    assert g.results[next(iter(g.source_prepared_mapping['3']))].prompt == "Cat sushi"
+
+def test_busy_gpu_lane_doesnt_hold_up_cpu_invocations(mock_concurrent_invoker: Invoker):
+    test_nodes.test_cancelable_started.clear()
+    gpu = mock_concurrent_invoker.create_execution_state()
+    gpu.graph.add_node(GpuCancelableTestInvocation(id = "1"))
+    gpu.graph.add_node(GpuCancelableTestInvocation(id = "2"))
+    mock_concurrent_invoker.invoke(gpu, invoke_all = True)
+    assert test_nodes.test_cancelable_started.wait(timeout = 5)
+
+    # Queued behind the second GPU invocation, which waits for the only GPU worker
+    cpu = mock_concurrent_invoker.create_execution_state()
+    cpu.graph.add_node(PromptTestInvocation(id = "1", prompt = "Banana sushi"))
+    mock_concurrent_invoker.invoke(cpu)
+
+    wait_until(lambda: mock_concurrent_invoker.services.graph_execution_manager.get(cpu.id).is_complete(), timeout = 2, interval = 0.05)
+    mock_concurrent_invoker.cancel(gpu.id)
+    mock_concurrent_invoker.stop()
+
+def test_cancel_stops_running_invocation(mock_invoker: Invoker):
+    test_nodes.test_cancelable_started.clear()
+    g = mock_invoker.create_execution_state()
+    g.graph.add_node(CancelableTestInvocation(id = "1", prompt = "Banana sushi"))
+    g.graph.add_node(PromptTestInvocation(id = "2"))
+    g.graph.add_edge(create_edge("1", "prompt", "2", "prompt"))
+
+    mock_invoker.invoke(g, invoke_all = True)
+    assert test_nodes.test_cancelable_started.wait(timeout = 5)
+    mock_invoker.cancel(g.id)
+
+    # The invocation stops through its cancellation token, and nothing else is queued
+    wait_until(lambda: len(mock_invoker.services.graph_execution_manager.get(g.id).executing) == 0, timeout = 5, interval = 0.1)
+    assert mock_invoker.services.queue.get_stats().depth == 0
+    mock_invoker.stop()
+
+    g = mock_invoker.services.graph_execution_manager.get(g.id)
+    assert not g.has_error()
+    assert len(g.executed) == 0
+
+def test_completes_invocations_of_deleted_sessions(mock_invoker: Invoker):
+    test_nodes.test_barrier.reset()
+    g = mock_invoker.create_execution_state()
+    g.graph.add_node(BarrierTestInvocation(id = "1", prompt = "Banana sushi"))
+    mock_invoker.invoke(g, invoke_all = True)
+
+    # Deleted while its invocation runs
+    wait_until(lambda: test_nodes.test_barrier.n_waiting == 1, timeout = 5, interval = 0.01)
+    mock_invoker.services.graph_execution_manager.delete(g.id)
+    test_nodes.test_barrier.wait(timeout = 5)
+
+    # The worker is still there to run other sessions
+    g = mock_invoker.create_execution_state()
+    g.graph.add_node(PromptTestInvocation(id = "1", prompt = "Cat sushi"))
+    mock_invoker.invoke(g, invoke_all = True)
+    wait_until(lambda: mock_invoker.services.graph_execution_manager.get(g.id).is_complete(), timeout = 5, interval = 0.1)
+    mock_invoker.stop()
+
+def test_releases_nodes_left_executing_when_started(mock_services: InvocationServices, simple_graph):
+    # Handed out by a previous run of the app, whose queue items were lost
+    g = GraphExecutionState(graph = simple_graph)
+    g.next()
+    mock_services.graph_execution_manager.set(g)
+
+    invoker = Invoker(services = mock_services)
+    assert len(invoker.services.graph_execution_manager.get(g.id).executing) == 0
+    invoker.invoke(invoker.services.graph_execution_manager.get(g.id), invoke_all = True)
+    wait_until(lambda: invoker.services.graph_execution_manager.get(g.id).is_complete(), timeout = 5, interval = 0.1)
+    invoker.stop()
+
+@pytest.fixture()
+def mock_batching_invoker(mock_services: InvocationServices) -> Invoker:
+    mock_services.processor = DefaultInvocationProcessor(batch_window = 0.2, max_batch_size = 4)
+    return Invoker(
+        services = mock_services
+    )
+
+def create_batchable_graph(prompts: list[str]) -> Graph:
+    g = Graph()
+    g.add_node(PromptCollectionTestInvocation(id = "1", collection = prompts))
+    g.add_node(IterateInvocation(id = "2"))
+    g.add_node(BatchableTestInvocation(id = "3"))
+    g.add_node(CollectInvocation(id = "4"))
+    g.add_edge(create_edge("1", "collection", "2", "collection"))
+    g.add_edge(create_edge("2", "item", "3", "prompt"))
+    g.add_edge(create_edge("3", "prompt", "4", "item"))
+    return g
+
+def test_invokes_compatible_invocations_in_batches(mock_batching_invoker: Invoker):
+    BatchableTestInvocation.batch_sizes = []
+    g = mock_batching_invoker.create_execution_state(create_batchable_graph([f"banana sushi {i}" for i in range(6)]))
+    mock_batching_invoker.invoke(g, invoke_all = True)
+
+    wait_until(lambda: mock_batching_invoker.services.graph_execution_manager.get(g.id).is_complete(), timeout = 10, interval = 0.1)
+    mock_batching_invoker.stop()
+
+    g = mock_batching_invoker.services.graph_execution_manager.get(g.id)
+    assert not g.has_error()
+    assert BatchableTestInvocation.batch_sizes == [4, 2]
+    assert sorted(g.results[next(iter(g.source_prepared_mapping['4']))].collection) == [f"BANANA SUSHI {i}" for i in range(6)]
+
+def test_batch_errors_are_reported_for_each_invocation(mock_batching_invoker: Invoker):
+    BatchableTestInvocation.batch_sizes = []
+    g = mock_batching_invoker.create_execution_state(create_batchable_graph(["banana", "error", "sushi"]))
+    mock_batching_invoker.invoke(g, invoke_all = True)
+
+    wait_until(lambda: mock_batching_invoker.services.graph_execution_manager.get(g.id).is_complete(), timeout = 10, interval = 0.1)
+    mock_batching_invoker.stop()
+
+    # The batch failed, so its invocations were invoked one at a time
+    g = mock_batching_invoker.services.graph_execution_manager.get(g.id)
+    assert BatchableTestInvocation.batch_sizes == [3, 1, 1, 1]
+    assert len(g.errors) == 1
+    assert sorted(g.results[i].prompt for i in g.source_prepared_mapping['3'] if i in g.results) == ["BANANA", "SUSHI"]
+
+def test_writes_traces_when_profiling(mock_services: InvocationServices, simple_graph, tmp_path):
+    mock_services.processor = DefaultInvocationProcessor(profile_dir = str(tmp_path))
+    invoker = Invoker(services = mock_services)
+    g = invoker.create_execution_state(graph = simple_graph)
+    invoker.invoke(g, invoke_all = True)
+    wait_until(lambda: invoker.services.graph_execution_manager.get(g.id).is_complete(), timeout = 5, interval = 0.1)
+    invoker.stop()
+
+    g = invoker.services.graph_execution_manager.get(g.id)
+    for node_id in g.results.keys():
+        trace = json.loads((tmp_path / f"{g.id}_{node_id}.json").read_text())
+        assert trace["otherData"]["invocation_id"] == node_id
+        assert trace["traceEvents"] == []
+
+def test_writes_intermediates_when_sessions_complete(mock_services: InvocationServices, tmp_path):
+    mock_services.images = DiskImageStorage(str(tmp_path), intermediate_bytes = 2**20)
+    invoker = Invoker(services = mock_services)
+    g = Graph()
+    g.add_node(IntermediateImageTestInvocation(id = "1"))
+    g.add_node(IntermediateImageTestInvocation(id = "2"))
+    g = invoker.create_execution_state(graph = g)
+
+    # Kept in memory while the session runs
+    invoker.invoke(g, invoke_all = False)
+    wait_until(lambda: len(invoker.services.graph_execution_manager.get(g.id).results) == 1, timeout = 5)
+    assert list_images(tmp_path, ImageType.INTERMEDIATE) == []
+
+    invoker.invoke(invoker.services.graph_execution_manager.get(g.id), invoke_all = True)
+    wait_until(lambda: len(list_images(tmp_path, ImageType.INTERMEDIATE)) == 2, timeout = 5)
+    invoker.stop()
+
+    g = invoker.services.graph_execution_manager.get(g.id)
+    assert list_images(tmp_path, ImageType.INTERMEDIATE) == sorted(r.image.image_name for r in g.results.values())
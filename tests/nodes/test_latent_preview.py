@@ -0,0 +1,58 @@
+from invokeai.backend.stable_diffusion.latent_preview import V1_5_LATENT_RGB_FACTORS, LatentPreviewRenderer
+import numpy as np
+import threading
+import torch
+
+
+def render_reference(samples: torch.Tensor) -> np.ndarray:
+    # How previews were rendered before the renderer
+    factors = torch.tensor(V1_5_LATENT_RGB_FACTORS, dtype = samples.dtype)
+    latent_image = samples[0].permute(1, 2, 0) @ factors
+    return ((latent_image + 1) / 2).clamp(0, 1).mul(0xFF).byte().numpy()
+
+def test_renders_previews_of_latents():
+    renderer = LatentPreviewRenderer()
+    samples = torch.randn((2, 4, 8, 12))
+    image = renderer.render(samples)
+    assert image.size == (12, 8)
+    assert np.array_equal(np.asarray(image), render_reference(samples))
+    assert renderer.render(samples, size = (24, 16)).size == (24, 16)
+    assert renderer.render(samples, size = (6, 4)).size == (6, 4)
+
+def test_finishes_previews_in_order_off_the_calling_thread():
+    renderer = LatentPreviewRenderer(max_pending = 2)
+    release = threading.Event()
+    finished = list()
+    def then(step: int, image):
+        release.wait(timeout = 5)
+        finished.append((step, threading.current_thread() is threading.main_thread()))
+        return step
+
+    futures = [renderer.render_async(torch.randn((1, 4, 8, 8)), lambda image, step = step: then(step, image)) for step in range(3)]
+
+    # The third preview is dropped, since two are still in flight
+    assert futures[2] is None
+    release.set()
+    renderer.flush()
+    assert finished == [(0, False), (1, False)]
+    assert [f.result() for f in futures[:2]] == [0, 1]
+
+    # Blocking waits for a preview to finish rather than dropping it
+    assert renderer.render_async(torch.randn((1, 4, 8, 8)), lambda image: then(3, image), block = True).result() == 3
+    renderer.shutdown()
+
+def test_limits_previews_in_flight_per_key():
+    renderer = LatentPreviewRenderer(max_pending = 1)
+    release = threading.Event()
+    samples = torch.randn((1, 4, 8, 8))
+    futures = [renderer.render_async(samples, lambda image: release.wait(timeout = 5), key = key) for key in ["a", "b", "a"]]
+
+    # Only the second preview of "a" is dropped
+    assert futures[0] is not None and futures[1] is not None
+    assert futures[2] is None
+    release.set()
+    renderer.flush(key = "a")
+    assert futures[0].done()
+    renderer.flush()
+    assert futures[1].done()
+    renderer.shutdown()
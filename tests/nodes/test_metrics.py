@@ -0,0 +1,59 @@
+from .test_invoker import mock_services, mock_invoker, simple_graph
+from .test_nodes import wait_until
+from invokeai.app.services import metrics
+from invokeai.app.services.invoker import Invoker
+from invokeai.app.services.metrics import Counter, Gauge, Histogram, MetricsRegistry
+import threading
+
+
+def test_exposes_metrics_updated_from_many_threads():
+    registry = MetricsRegistry()
+    counter = Counter("test_total", "A counter", ("kind",), registry = registry)
+    gauge = Gauge("test_in_flight", "A gauge", registry = registry)
+    histogram = Histogram("test_seconds", "A histogram", ("kind",), buckets = (0.1, 1.0), registry = registry)
+    callback = Gauge("test_depth", "A gauge with a function", registry = registry)
+    callback.set_function(lambda: 7)
+
+    def update():
+        for _ in range(1000):
+            counter.inc('a "quoted" kind')
+            gauge.inc()
+            histogram.observe(0.5, "a")
+        gauge.dec(amount = 500)
+    threads = [threading.Thread(target = update) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    histogram.observe(0.05, "a")
+    histogram.observe(5, "b")
+
+    lines = registry.expose().splitlines()
+    assert '# TYPE test_total counter' in lines
+    assert 'test_total{kind="a \\"quoted\\" kind"} 4000.0' in lines
+    assert 'test_in_flight 2000.0' in lines
+    assert 'test_depth 7.0' in lines
+    assert '# TYPE test_seconds histogram' in lines
+    assert 'test_seconds_bucket{kind="a",le="0.1"} 1.0' in lines
+    assert 'test_seconds_bucket{kind="a",le="1.0"} 4001.0' in lines
+    assert 'test_seconds_bucket{kind="a",le="+Inf"} 4001.0' in lines
+    assert 'test_seconds_count{kind="a"} 4001.0' in lines
+    assert 'test_seconds_bucket{kind="b",le="1.0"} 0.0' in lines
+    assert 'test_seconds_sum{kind="b"} 5.0' in lines
+
+def get_sample(name: str, labels: str = "") -> float:
+    for line in metrics.REGISTRY.expose().splitlines():
+        if line.startswith(f"{name}{labels} "):
+            return float(line.split(" ")[1])
+    return 0.0
+
+def test_records_invocation_metrics(mock_invoker: Invoker, simple_graph):
+    count = get_sample("invokeai_invocation_duration_seconds_count", '{type="test_prompt"}')
+    g = mock_invoker.create_execution_state(graph = simple_graph)
+    mock_invoker.invoke(g, invoke_all = True)
+    wait_until(lambda: mock_invoker.services.graph_execution_manager.get(g.id).is_complete(), timeout = 5, interval = 0.1)
+    mock_invoker.stop()
+
+    assert get_sample("invokeai_invocation_duration_seconds_count", '{type="test_prompt"}') == count + 1
+    wait_until(lambda: get_sample("invokeai_invocations_in_flight") == 0, timeout = 5, interval = 0.1)
+    assert get_sample("invokeai_sqlite_operation_duration_seconds_count", '{table="graph_executions",operation="write"}') > 0
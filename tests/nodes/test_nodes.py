@@ -1,9 +1,11 @@
-from typing import Any, Callable, Literal
+from typing import Any, Callable, ClassVar, Literal
 from invokeai.app.invocations.baseinvocation import BaseInvocation, BaseInvocationOutput, InvocationContext
 from invokeai.app.invocations.image import ImageField
 from invokeai.app.services.invocation_services import InvocationServices
+from invokeai.app.util.util import CanceledException
 from pydantic import Field
 import pytest
+import threading
 
 # Define test invocations before importing anything that uses invocations
 class ListPassThroughInvocationOutput(BaseInvocationOutput):
@@ -38,6 +40,72 @@ class ErrorInvocation(BaseInvocation):
     def invoke(self, context: InvocationContext) -> PromptTestInvocationOutput:
         raise Exception("This invocation is supposed to fail")
 
+# Shared by all barrier test invocations; tests should reset this before use
+test_barrier = threading.Barrier(2)
+
+class BarrierTestInvocation(BaseInvocation):
+    type: Literal['test_barrier'] = 'test_barrier'
+
+    prompt: str = Field(default = "")
+
+    def invoke(self, context: InvocationContext) -> PromptTestInvocationOutput:
+        # Only passes if enough of these are running at the same time
+        test_barrier.wait(timeout = 5)
+        return PromptTestInvocationOutput(prompt = self.prompt)
+
+test_cancelable_started = threading.Event()
+
+class CancelableTestInvocation(BaseInvocation):
+    type: Literal['test_cancelable'] = 'test_cancelable'
+
+    prompt: str = Field(default = "")
+
+    def invoke(self, context: InvocationContext) -> PromptTestInvocationOutput:
+        # Runs until canceled, like a long diffusion loop
+        test_cancelable_started.set()
+        if context.cancellation_token.wait(timeout = 5):
+            raise CanceledException
+        return PromptTestInvocationOutput(prompt = self.prompt)
+
+class GpuCancelableTestInvocation(CancelableTestInvocation):
+    type: Literal['test_gpu_cancelable'] = 'test_gpu_cancelable'
+    uses_gpu = True
+
+class CountingTestInvocation(BaseInvocation):
+    type: Literal['test_counting'] = 'test_counting'
+
+    prompt: str = Field(default = "")
+    seed: int = Field(default = 0)
+
+    # Number of times any of these has been invoked; tests should reset this before use
+    invoke_count: ClassVar[int] = 0
+
+    def invoke(self, context: InvocationContext) -> PromptTestInvocationOutput:
+        CountingTestInvocation.invoke_count += 1
+        return PromptTestInvocationOutput(prompt = self.prompt)
+
+class BatchableTestInvocation(BaseInvocation):
+    type: Literal['test_batchable'] = 'test_batchable'
+    uses_gpu = True
+
+    prompt: str = Field(default = "")
+
+    # Sizes of the batches any of these have been invoked in; tests should reset this before use
+    batch_sizes: ClassVar[list[int]] = []
+
+    def get_batch_key(self) -> str:
+        return self.type
+
+    def invoke(self, context: InvocationContext) -> PromptTestInvocationOutput:
+        return BatchableTestInvocation.invoke_batch([self], [context])[0]
+
+    @classmethod
+    def invoke_batch(cls, invocations: list["BatchableTestInvocation"], contexts: list[InvocationContext]) -> list[PromptTestInvocationOutput]:
+        BatchableTestInvocation.batch_sizes.append(len(invocations))
+        if any(i.prompt == "error" for i in invocations):
+            raise Exception("This invocation is supposed to fail")
+        return [PromptTestInvocationOutput(prompt = i.prompt.upper()) for i in invocations]
+
 class ImageTestInvocationOutput(BaseInvocationOutput):
     type: Literal['test_image_output'] = 'test_image_output'
 
@@ -51,6 +119,17 @@ class ImageTestInvocation(BaseInvocation):
     def invoke(self, context: InvocationContext) -> ImageTestInvocationOutput:
         return ImageTestInvocationOutput(image=ImageField(image_name=self.id))
 
+class IntermediateImageTestInvocation(BaseInvocation):
+    type: Literal['test_intermediate_image'] = 'test_intermediate_image'
+
+    prompt: str = Field(default = "")
+
+    def invoke(self, context: InvocationContext) -> ImageTestInvocationOutput:
+        from invokeai.app.services.image_storage import ImageType
+        from PIL import Image
+        context.services.images.save(ImageType.INTERMEDIATE, self.id, Image.new("RGB", (8, 8)))
+        return ImageTestInvocationOutput(image=ImageField(image_type=ImageType.INTERMEDIATE, image_name=self.id))
+
 class PromptCollectionTestInvocationOutput(BaseInvocationOutput):
     type: Literal['test_prompt_collection_output'] = 'test_prompt_collection_output'
     collection: list[str] = Field(default_factory=list)
@@ -88,7 +167,7 @@ class TestEventService(EventServiceBase):
         self.events = list()
 
     def dispatch(self, event_name: str, payload: Any) -> None:
-        pass
+        self.events.append(payload)
 
 def wait_until(condition: Callable[[], bool], timeout: int = 10, interval: float = 0.1) -> None:
     import time
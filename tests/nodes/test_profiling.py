@@ -0,0 +1,61 @@
+from invokeai.backend.stable_diffusion.profiling import ChromeTraceProfiler, ProfilingHooks, get_profiling_hooks, profile_section, use_profiling_hooks
+import json
+import threading
+import torch
+
+
+def test_sections_do_nothing_when_disabled():
+    assert get_profiling_hooks() is None
+    assert profile_section("unet_forward") is profile_section("scheduler_step")
+    with profile_section("unet_forward"):
+        pass
+
+def test_hooks_are_called_around_sections():
+    calls = list()
+    class RecordingHooks(ProfilingHooks):
+        def begin(self, name, args):
+            calls.append(("begin", name, args))
+        def end(self, name):
+            calls.append(("end", name))
+
+    hooks = RecordingHooks()
+    with use_profiling_hooks(hooks):
+        with profile_section("diffusion_step", step = 3):
+            with profile_section("unet_forward"):
+                pass
+
+        # Hooks are only used on the thread that set them
+        other_thread = list()
+        thread = threading.Thread(target = lambda: other_thread.append(get_profiling_hooks()))
+        thread.start()
+        thread.join()
+        assert other_thread == [None]
+
+    assert get_profiling_hooks() is None
+    assert calls == [
+        ("begin", "diffusion_step", dict(step = 3)),
+        ("begin", "unet_forward", dict()),
+        ("end", "unet_forward"),
+        ("end", "diffusion_step"),
+    ]
+
+def test_writes_chrome_traces(tmp_path):
+    with use_profiling_hooks(ChromeTraceProfiler()) as profiler:
+        with profile_section("diffusion_step", step = torch.tensor(1)):
+            with profile_section("unet_forward"):
+                pass
+            with profile_section("scheduler_step"):
+                pass
+
+    profiler.write(str(tmp_path / "trace.json"), metadata = dict(invocation_id = "1"))
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    assert trace["otherData"] == dict(invocation_id = "1")
+    events = trace["traceEvents"]
+    assert [e["name"] for e in events] == ["diffusion_step", "unet_forward", "scheduler_step"]
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+    assert events[0]["args"] == dict(step = 1)
+
+    # Nested sections are within their parent (give or take rounding)
+    (step, unet, scheduler) = events
+    assert step["ts"] <= unet["ts"] and unet["ts"] + unet["dur"] <= scheduler["ts"] + 0.01
+    assert scheduler["ts"] + scheduler["dur"] <= step["ts"] + step["dur"] + 0.01
@@ -1,5 +1,8 @@
+from invokeai.app.services.item_codec import get_item_codec
 from invokeai.app.services.sqlite import SqliteItemStorage, sqlite_memory
 from pydantic import BaseModel, Field
+import pytest
+import threading
 
 
 class TestModel(BaseModel):
@@ -110,3 +113,196 @@ def test_sqlite_service_can_search_with_pagination_and_offset():
     assert results.per_page == 2
     assert results.total == 3
     assert results.items == [TestModel(id = '3', name = 'Test')]
+
+def test_sqlite_service_uses_wal_for_files(tmp_path):
+    db = SqliteItemStorage[TestModel](str(tmp_path / 'test.db'), 'test', 'id')
+    assert db._conn.execute('PRAGMA journal_mode;').fetchone()[0] == 'wal'
+
+def test_sqlite_service_applies_pragmas(tmp_path):
+    db = SqliteItemStorage[TestModel](str(tmp_path / 'test.db'), 'test', 'id', pragmas = dict(journal_mode = 'delete', synchronous = 'full'))
+    assert db._conn.execute('PRAGMA journal_mode;').fetchone()[0] == 'delete'
+    assert db._conn.execute('PRAGMA synchronous;').fetchone()[0] == 2
+
+def test_sqlite_service_rejects_invalid_pragmas(tmp_path):
+    with pytest.raises(ValueError):
+        SqliteItemStorage[TestModel](str(tmp_path / 'test.db'), 'test', 'id', pragmas = dict(synchronous = 'off; DROP TABLE test'))
+
+def test_sqlite_service_reads_while_writing(tmp_path):
+    db = SqliteItemStorage[TestModel](str(tmp_path / 'test.db'), 'test', 'id')
+    db.set(TestModel(id = '1', name = '0'))
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        try:
+            while not stop.is_set():
+                item = db.get('1')
+                assert item is not None
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target = read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for i in range(200):
+        db.set(TestModel(id = '1', name = str(i)))
+    stop.set()
+    for reader in readers:
+        reader.join()
+
+    assert errors == []
+
+    # Reads on other threads see committed writes
+    result = []
+    reader = threading.Thread(target = lambda: result.append(db.get('1')))
+    reader.start()
+    reader.join()
+    assert result == [TestModel(id = '1', name = '199')]
+
+def test_sqlite_service_can_list_with_cursor():
+    db = SqliteItemStorage[TestModel](sqlite_memory, 'test', 'id')
+    for i in range(5):
+        db.set(TestModel(id = str(i), name = 'Test'))
+
+    results = db.list(per_page = 2)
+    assert [i.id for i in results.items] == ['0', '1']
+    results = db.list(per_page = 2, cursor = results.next_cursor)
+    assert [i.id for i in results.items] == ['2', '3']
+    results = db.list(per_page = 2, cursor = results.next_cursor)
+    assert [i.id for i in results.items] == ['4']
+    assert results.next_cursor is None
+    assert results.total == 5
+
+def test_sqlite_service_keeps_order_of_updated_items():
+    db = SqliteItemStorage[TestModel](sqlite_memory, 'test', 'id')
+    db.set(TestModel(id = '1', name = 'Test'))
+    db.set(TestModel(id = '2', name = 'Test'))
+    db.set(TestModel(id = '1', name = 'Updated'))
+    results = db.list()
+    assert results.items == [TestModel(id = '1', name = 'Updated'), TestModel(id = '2', name = 'Test')]
+    assert results.total == 2
+
+def test_sqlite_service_searches_words_and_prefixes():
+    db = SqliteItemStorage[TestModel](sqlite_memory, 'test', 'id')
+    db.set(TestModel(id = '1', name = 'a photo of banana sushi'))
+    db.set(TestModel(id = '2', name = 'a painting of cat sushi'))
+    db.set(TestModel(id = '3', name = 'image_0003.png'))
+
+    assert [i.id for i in db.search('sushi').items] == ['1', '2']
+    assert [i.id for i in db.search('banana sushi').items] == ['1']
+    assert [i.id for i in db.search('pain').items] == ['2']
+    assert [i.id for i in db.search('image_0003').items] == ['3']
+    assert db.search('dog').total == 0
+
+    # Search results change with the items
+    db.set(TestModel(id = '2', name = 'a painting of a dog'))
+    db.delete('1')
+    assert db.search('sushi').total == 0
+    assert [i.id for i in db.search('dog').items] == ['2']
+
+def test_sqlite_service_keeps_count_up_to_date():
+    db = SqliteItemStorage[TestModel](sqlite_memory, 'test', 'id')
+    db.set(TestModel(id = '1', name = 'Test'))
+    assert db.list().total == 1
+    db.set(TestModel(id = '2', name = 'Test'))
+    db.set(TestModel(id = '2', name = 'Test'))
+    assert db.list().total == 2
+    db.delete('1')
+    db.delete('3')
+    assert db.list().total == 1
+
+def test_sqlite_service_indexes_existing_items(tmp_path):
+    filename = str(tmp_path / 'test.db')
+    db = SqliteItemStorage[TestModel](filename, 'test', 'id')
+    db.set(TestModel(id = '1', name = 'banana sushi'))
+
+    # Drop the index, as if the items were stored before there was one
+    db._conn.execute('DROP TABLE test_search;')
+    db._conn.commit()
+
+    db = SqliteItemStorage[TestModel](filename, 'test', 'id')
+    assert [i.id for i in db.search('banana').items] == ['1']
+
+def test_sqlite_service_can_set_get_and_delete_many():
+    db = SqliteItemStorage[TestModel](sqlite_memory, 'test', 'id')
+    changed = []
+    db.on_changed(lambda item: changed.append(item.id))
+    db.set_many([TestModel(id = '1', name = 'Test'), TestModel(id = '2', name = 'Test')])
+    assert changed == ['1', '2']
+    assert db.get_many(['2', '3', '1']) == [TestModel(id = '2', name = 'Test'), None, TestModel(id = '1', name = 'Test')]
+
+    db.delete_many(['1', '2'])
+    assert db.get_many(['1', '2']) == [None, None]
+    assert db.list().total == 0
+
+class TestStatusModel(BaseModel):
+    id: str = Field(description = "ID")
+    name: str = Field(description = "Name")
+    tags: list[str] = Field(description = "Tags")
+
+def test_sqlite_service_can_use_compressed_codec(tmp_path):
+    db = SqliteItemStorage[TestStatusModel](str(tmp_path / 'test.db'), 'test', 'id', codec = get_item_codec('json+zlib'), status_fields = ['name'])
+    db.set(TestStatusModel(id = '1', name = 'Test', tags = ['banana sushi']))
+    assert db.get('1') == TestStatusModel(id = '1', name = 'Test', tags = ['banana sushi'])
+    assert db.list().items == [TestStatusModel(id = '1', name = 'Test', tags = ['banana sushi'])]
+    assert db.search('banana').total == 1
+
+    # Only the id and status fields are stored as JSON
+    db._cursor.execute('SELECT item, codec FROM test;')
+    assert db._cursor.fetchone() == ('{"id":"1","name":"Test"}', 'json+zlib')
+
+def test_sqlite_service_reads_items_written_with_other_codecs(tmp_path):
+    filename = str(tmp_path / 'test.db')
+    db = SqliteItemStorage[TestModel](filename, 'test', 'id', codec = get_item_codec('json+zlib'))
+    db.set(TestModel(id = '1', name = 'Compressed'))
+
+    db = SqliteItemStorage[TestModel](filename, 'test', 'id')
+    db.set(TestModel(id = '2', name = 'JSON'))
+    assert db.get_many(['1', '2']) == [TestModel(id = '1', name = 'Compressed'), TestModel(id = '2', name = 'JSON')]
+
+def test_sqlite_service_adds_codec_columns_to_existing_tables(tmp_path):
+    filename = str(tmp_path / 'test.db')
+    db = SqliteItemStorage[TestModel](filename, 'test', 'id')
+    db._conn.execute('DROP TABLE test;')
+    db._conn.execute("""CREATE TABLE test (item TEXT, id TEXT GENERATED ALWAYS AS (json_extract(item, '$.id')) VIRTUAL NOT NULL);""")
+    db._conn.execute("""INSERT INTO test (item) VALUES ('{"id": "1", "name": "Old"}');""")
+    db._conn.commit()
+
+    db = SqliteItemStorage[TestModel](filename, 'test', 'id', codec = get_item_codec('json+zlib'))
+    assert db.get('1') == TestModel(id = '1', name = 'Old')
+    db.set(TestModel(id = '1', name = 'New'))
+    assert db.get('1') == TestModel(id = '1', name = 'New')
+
+@pytest.mark.parametrize('codec', ['json', 'json+zlib'])
+def test_sqlite_service_lists_status_fields(codec):
+    db = SqliteItemStorage[TestStatusModel](sqlite_memory, 'test', 'id', codec = get_item_codec(codec), status_fields = ['tags'])
+    db.set(TestStatusModel(id = '1', name = 'Test', tags = ['a', 'b']))
+    db.set(TestStatusModel(id = '2', name = 'Test', tags = []))
+
+    results = db.list_status(per_page = 1)
+    assert results.items == [dict(id = '1', tags = ['a', 'b'])]
+    assert results.total == 2
+    assert db.list_status(per_page = 1, cursor = results.next_cursor).items == [dict(id = '2', tags = [])]
+
+def test_sqlite_service_finds_item_type_of_subclasses():
+    class TestModelStorage(SqliteItemStorage[TestModel]):
+        pass
+
+    db = TestModelStorage(sqlite_memory, 'test', 'id')
+    db.set(TestModel(id = '1', name = 'Test'))
+    assert db.get('1') == TestModel(id = '1', name = 'Test')
+
+def test_item_codecs_round_trip():
+    value = dict(id = '1', name = 'Test', tags = ['a'], seed = 1, weight = 0.5)
+    for name in ['json', 'json+zlib']:
+        codec = get_item_codec(name)
+        assert codec.name == name
+        assert codec.decode(codec.encode(value)) == value
+
+    with pytest.raises(ValueError):
+        get_item_codec('json+gzip')
+
+def test_msgpack_item_codec_round_trips():
+    pytest.importorskip('msgpack')
+    value = dict(id = '1', name = 'Test', tags = ['a'])
+    assert get_item_codec('msgpack+zlib').decode(get_item_codec('msgpack+zlib').encode(value)) == value